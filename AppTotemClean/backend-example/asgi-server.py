@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+Servidor ASGI (Starlette + uvicorn) com reconhecimento facial real
+Execute: python asgi-server.py
+
+Expõe as mesmas rotas do flask-server.py. O corpo das requisições é lido de
+forma assíncrona no event loop, então uploads lentos de totens em rede celular
+não ocupam workers; só o trabalho de CPU do FaceRecognitionSystem vai para um
+executor de threads (e, com FACE_INFERENCE_WORKERS, de lá para o pool de processos).
+
+Dependências: pip install starlette uvicorn face-recognition pillow numpy
+"""
+
+import asyncio
+import os
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from face_pipeline import StageTimer
+from inference_pool import PoolBusy
+from face_system import FaceRecognitionSystem, MAX_BATCH_SIZE, identity_from, gallery_etag, etag_matches
+from bulk_enrollment import ArchiveFile, ArchiveTooLarge, COPY_BUFFER_SIZE, MAX_ARCHIVE_BYTES, save_archive
+from metrics import FaceMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+# Threads que executam o trabalho de CPU fora do event loop
+EXECUTOR_THREADS = int(os.environ.get('FACE_EXECUTOR_THREADS', os.cpu_count() or 4))
+
+# Inicializar sistema de reconhecimento facial
+# (os processos do pool de inferência reimportam este arquivo como __mp_main__)
+if __name__ != '__mp_main__':
+    face_system = FaceRecognitionSystem()
+    face_metrics = FaceMetrics(face_system)
+    executor = ThreadPoolExecutor(max_workers=EXECUTOR_THREADS, thread_name_prefix='face')
+    # Modelos e galeria em segundo plano: GET /ready responde 200 quando terminar
+    face_system.start_warm_up()
+
+
+async def run_in_executor(fn, *args):
+    """Executar trabalho bloqueante sem travar o event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, fn, *args)
+
+
+async def read_json(request):
+    """Ler o corpo JSON de forma assíncrona; None se vazio ou inválido"""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+# Corpo binário: a imagem vai direto para o decodificador, sem base64 (~33% menor)
+RAW_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'application/octet-stream')
+
+
+def media_type(request):
+    return request.headers.get('content-type', '').split(';')[0].strip().lower()
+
+
+async def read_image_upload(request):
+    """
+    Ler a imagem nos mesmos formatos do flask-server.py: JSON com base64,
+    multipart (arquivo no campo "image") ou corpo binário com os demais campos
+    na query string. Retorna (imagem, campos); campos é None se não há dados.
+    Multipart requer: pip install python-multipart
+    """
+    content_type = media_type(request)
+    if content_type in RAW_IMAGE_TYPES:
+        return await request.body(), request.query_params
+    if content_type == 'multipart/form-data':
+        async with request.form() as form:
+            upload = form.get('image')
+            image = await upload.read() if hasattr(upload, 'read') else upload
+            fields = {key: value for key, value in form.items() if isinstance(value, str)}
+        return image, fields
+
+    data = await read_json(request)
+    if not data:
+        return None, None
+    return data.get('image'), data
+
+
+async def read_batch_upload(request):
+    """Itens de um lote: JSON {"images": [...]} ou multipart com vários arquivos no campo images"""
+    if media_type(request) == 'multipart/form-data':
+        async with request.form() as form:
+            uploads = form.getlist('images')
+            timestamps = form.getlist('timestamp')
+            return [
+                {'image': await upload.read(), 'timestamp': timestamps[i] if i < len(timestamps) else None}
+                for i, upload in enumerate(uploads)
+            ]
+
+    data = await read_json(request)
+    if not data or not isinstance(data.get('images'), list):
+        return None
+    return [item if isinstance(item, dict) else {'image': item} for item in data['images']]
+
+
+def busy_response(busy):
+    """Resposta rápida de backpressure: pool de inferência saturado ou sistema ainda aquecendo"""
+    print(f"⏳ {busy.error} (cliente deve tentar novamente em {busy.retry_after}s)")
+    return JSONResponse({
+        'success': False,
+        'error': busy.error,
+        'retry_after': busy.retry_after
+    }, status_code=503, headers={'Retry-After': str(busy.retry_after)})
+
+
+def error_response(message, status_code):
+    return JSONResponse({'success': False, 'error': message}, status_code=status_code)
+
+
+def health_status(details):
+    """Conteúdo do health check; sync() e as estatísticas podem esperar locks, então roda no executor"""
+    face_system.sync()
+    health = {
+        'status': 'OK',
+        'message': 'Servidor ASGI com reconhecimento facial funcionando!',
+        'ready': face_system.ready.is_set(),
+        'known_faces_count': face_system.person_count,
+        'templates_count': len(face_system.gallery),
+        'generation': face_system.generation,
+        'timestamp': datetime.now().isoformat()
+    }
+    if details:
+        health['frame_cache'] = face_system.frame_cache.stats() if face_system.frame_cache else None
+        health['recent_identities'] = face_system.recent.stats() if face_system.recent else None
+        health['partitions'] = face_system.partitions.stats() if face_system.partitions else None
+    return health
+
+
+async def health_check(request):
+    """Endpoint para verificar se o servidor está funcionando (só contagens; detalhes em ?details=1)"""
+    return JSONResponse(await run_in_executor(health_status, bool(request.query_params.get('details'))))
+
+
+async def readiness_check(request):
+    """Readiness: 200 só depois do aquecimento (modelos e galeria carregados); 503 antes"""
+    state = face_system.readiness()
+    return JSONResponse(dict(state, timestamp=datetime.now().isoformat()),
+                        status_code=200 if state['ready'] else 503)
+
+
+async def metrics(request):
+    """Tempos por etapa, tamanho da galeria e memória no formato do Prometheus"""
+    return Response(await run_in_executor(face_metrics.render), media_type=METRICS_CONTENT_TYPE)
+
+
+async def face_recognition_api(request):
+    """API para reconhecimento facial"""
+    try:
+        image, data = await read_image_upload(request)
+        if data is None:
+            return error_response('Dados não fornecidos', 400)
+
+        timestamp = data.get('timestamp')
+        # Crachá/PIN informado: verificação 1:1 em vez de busca na galeria inteira
+        person_id = identity_from(data)
+        mode = 'verification' if person_id else 'identification'
+        # Local do totem: busca só entre os colaboradores do contrato (FACE_PARTITIONS_FILE)
+        site = face_system.site_for(data)
+
+        print(f"[{datetime.now()}] Recebida requisição de reconhecimento facial")
+        print(f"Timestamp: {timestamp}")
+        if person_id:
+            print(f"🪪 Verificação 1:1 do colaborador {person_id}")
+        if site:
+            print(f"🏢 Local {site}")
+
+        if not image:
+            return error_response('Imagem não fornecida', 400)
+
+        timer = StageTimer()
+        try:
+            success, message, person_name, confidence = await run_in_executor(
+                face_system.recognize_face, image, timer, data.get('tablet_id'), person_id, site
+            )
+        except PoolBusy as busy:
+            print(f"⏱️  {face_metrics.observe(mode, 'busy', timer)}")
+            return busy_response(busy)
+        print(f"⏱️  {face_metrics.observe(mode, 'success' if success else 'rejected', timer)}")
+
+        if success:
+            print(f"✅ Pessoa reconhecida: {person_name} (confiança: {confidence:.2f})")
+            return JSONResponse({
+                'success': True,
+                'person_name': person_name,
+                'confidence': round(confidence, 3),
+                'attendance_recorded': True,
+                'message': message,
+                'mode': mode,
+                'timestamp': timestamp
+            })
+
+        print(f"❌ {message} (confiança: {confidence:.2f})")
+        return JSONResponse({
+            'success': False,
+            'error': message,
+            'confidence': round(confidence, 3),
+            'mode': mode
+        }, status_code=404)
+
+    except Exception as e:
+        print(f"❌ Erro: {str(e)}")
+        return error_response(f'Erro interno: {str(e)}', 500)
+
+
+async def face_recognition_batch_api(request):
+    """API para reconhecimento facial em lote (mesmo formato do flask-server.py)"""
+    try:
+        items = await read_batch_upload(request)
+        if items is None:
+            return error_response('Lista de imagens não fornecida', 400)
+        if not items:
+            return error_response('Lista de imagens vazia', 400)
+        if len(items) > MAX_BATCH_SIZE:
+            return error_response(f'Máximo de {MAX_BATCH_SIZE} imagens por lote', 400)
+        if any(not item.get('image') for item in items):
+            return error_response('Imagem não fornecida em um ou mais itens', 400)
+
+        print(f"[{datetime.now()}] Recebido lote de {len(items)} imagens para reconhecimento")
+        timer = StageTimer()
+        try:
+            outcomes = await run_in_executor(
+                face_system.recognize_faces, [item['image'] for item in items], timer
+            )
+        except PoolBusy as busy:
+            print(f"⏱️  {face_metrics.observe('batch', 'busy', timer)}")
+            return busy_response(busy)
+        print(f"⏱️  {face_metrics.observe('batch', 'success', timer)}")
+
+        results = []
+        for item, (success, message, person_name, confidence) in zip(items, outcomes):
+            if success:
+                results.append({
+                    'success': True,
+                    'person_name': person_name,
+                    'confidence': round(confidence, 3),
+                    'attendance_recorded': True,
+                    'message': message,
+                    'timestamp': item.get('timestamp')
+                })
+            else:
+                results.append({
+                    'success': False,
+                    'error': message,
+                    'confidence': round(confidence, 3),
+                    'timestamp': item.get('timestamp')
+                })
+
+        recognized = sum(1 for result in results if result['success'])
+        print(f"✅ Lote processado: {recognized}/{len(results)} reconhecidos")
+        return JSONResponse({
+            'success': True,
+            'total': len(results),
+            'recognized': recognized,
+            'results': results
+        })
+
+    except Exception as e:
+        print(f"❌ Erro: {str(e)}")
+        return error_response(f'Erro interno: {str(e)}', 500)
+
+
+async def add_person_api(request):
+    """API para adicionar nova pessoa ao sistema"""
+    try:
+        image, data = await read_image_upload(request)
+        if data is None:
+            return error_response('Dados não fornecidos', 400)
+
+        name = data.get('name')
+        if not name or not image:
+            return error_response('Nome e imagem são obrigatórios', 400)
+
+        print(f"🆕 Adicionando nova pessoa: {name}")
+        timer = StageTimer()
+        try:
+            success, message = await run_in_executor(
+                face_system.add_person, name, image, timer, identity_from(data)
+            )
+        except PoolBusy as busy:
+            print(f"⏱️  {face_metrics.observe('enrollment', 'busy', timer)}")
+            return busy_response(busy)
+        print(f"⏱️  {face_metrics.observe('enrollment', 'success' if success else 'rejected', timer)}")
+
+        if success:
+            print(f"✅ {message}")
+            return JSONResponse({
+                'success': True,
+                'message': message,
+                'total_known_faces': face_system.person_count
+            })
+
+        print(f"❌ {message}")
+        return error_response(message, 400)
+
+    except Exception as e:
+        print(f"❌ Erro: {str(e)}")
+        return error_response(f'Erro interno: {str(e)}', 500)
+
+
+# Corpo binário do cadastro em lote (o arquivo .zip inteiro)
+ARCHIVE_TYPES = ('application/zip', 'application/x-zip-compressed', 'application/octet-stream')
+
+
+async def save_archive_body(request):
+    """
+    Gravar o corpo binário do lote direto no arquivo temporário, em blocos de até
+    COPY_BUFFER_SIZE escritos no executor (o .zip nunca fica inteiro na memória).
+    Retorna o caminho; ArchiveTooLarge ao passar de MAX_ARCHIVE_BYTES.
+    """
+    archive = ArchiveFile(MAX_ARCHIVE_BYTES)
+    try:
+        pending = bytearray()
+        async for chunk in request.stream():
+            pending += chunk
+            archive.check(len(pending))
+            if len(pending) >= COPY_BUFFER_SIZE:
+                block, pending = pending, bytearray()
+                await run_in_executor(archive.write, block)
+        if pending:
+            await run_in_executor(archive.write, pending)
+    except BaseException:
+        archive.discard()
+        raise
+    return archive.close()
+
+
+async def add_person_bulk_api(request):
+    """
+    API para cadastro em lote: .zip com fotos <employee_id>.jpg no corpo ou no
+    campo "archive" do multipart (mesmo formato e limites do flask-server.py)
+    """
+    try:
+        timer = StageTimer()
+        try:
+            # A vez é tomada antes de receber o arquivo: um segundo pedido recebe
+            # 503 sem enviá-lo, e nenhum lote entra entre o recebimento e o cadastro
+            with face_system.bulk_slot():
+                return await enroll_archive(request, timer)
+        except PoolBusy as busy:
+            print(f"⏱️  {face_metrics.observe('bulk_enrollment', 'busy', timer)}")
+            return busy_response(busy)
+
+    except Exception as e:
+        print(f"❌ Erro: {str(e)}")
+        return error_response(f'Erro interno: {str(e)}', 500)
+
+
+async def enroll_archive(request, timer):
+    """Receber o .zip do lote (com a vez já tomada) e cadastrar as fotos"""
+    content_type = media_type(request)
+    archive_path = None
+    try:
+        content_length = request.headers.get('content-length')
+        if content_length and content_length.isdigit() and int(content_length) > MAX_ARCHIVE_BYTES:
+            raise ArchiveTooLarge(MAX_ARCHIVE_BYTES)
+        if content_type == 'multipart/form-data':
+            async with request.form() as form:
+                upload = form.get('archive')
+                if hasattr(upload, 'file'):
+                    archive_path = await run_in_executor(save_archive, upload.file)
+        elif content_type in ARCHIVE_TYPES:
+            archive_path = await save_archive_body(request)
+    except ArchiveTooLarge as e:
+        return error_response(str(e), 413)
+
+    if archive_path is None:
+        return error_response('Arquivo .zip não fornecido', 400)
+
+    print(f"[{datetime.now()}] Recebido arquivo para cadastro em lote")
+    try:
+        report = await run_in_executor(partial(face_system.add_persons_bulk, archive_path, timer, reserved=True))
+    except ValueError:
+        return error_response('Arquivo .zip inválido', 400)
+    finally:
+        os.remove(archive_path)
+    print(f"⏱️  {face_metrics.observe('bulk_enrollment', 'success', timer)}")
+
+    print(f"✅ Cadastro em lote: {report['enrolled']}/{report['total']} fotos cadastradas")
+    return JSONResponse(dict(report, success=True, total_known_faces=face_system.person_count))
+
+
+async def list_persons_api(request):
+    """API para listar pessoas cadastradas, paginada e com ETag (mesmos parâmetros do flask-server.py)"""
+    try:
+        # Pode esperar o lock de cadastro e ordenar a galeria inteira: fora do event loop
+        page = await run_in_executor(face_system.persons_page, request.query_params.get('cursor'),
+                                     request.query_params.get('limit'))
+    except PoolBusy as busy:
+        return busy_response(busy)
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    etag = gallery_etag(page['generation'])
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(dict(page, success=True), headers=headers)
+
+
+async def reset_system_api(request):
+    """API para resetar o sistema (apagar todas as faces conhecidas)"""
+    try:
+        try:
+            await run_in_executor(face_system.reset)
+        except PoolBusy as busy:
+            return busy_response(busy)
+        print("🔄 Sistema resetado")
+        return JSONResponse({
+            'success': True,
+            'message': 'Sistema resetado com sucesso'
+        })
+    except Exception as e:
+        return error_response(f'Erro ao resetar sistema: {str(e)}', 500)
+
+
+routes = [
+    Route('/', health_check, methods=['GET']),
+    Route('/ready', readiness_check, methods=['GET']),
+    Route('/metrics', metrics, methods=['GET']),
+    Route('/api/face-recognition/', face_recognition_api, methods=['POST']),
+    Route('/api/face-recognition/batch/', face_recognition_batch_api, methods=['POST']),
+    Route('/api/add-person/', add_person_api, methods=['POST']),
+    Route('/api/add-person/bulk/', add_person_bulk_api, methods=['POST']),
+    Route('/api/list-persons/', list_persons_api, methods=['GET']),
+    Route('/api/reset-system/', reset_system_api, methods=['POST']),
+]
+
+# Permitir requisições do app mobile
+app = Starlette(routes=routes, middleware=[
+    Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+])
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("🚀 Iniciando servidor ASGI com reconhecimento facial real...")
+    print("📱 Endpoints disponíveis (mesmos do flask-server.py):")
+    print("   - POST /api/face-recognition/       (reconhecer face)")
+    print("   - POST /api/face-recognition/batch/ (reconhecer lote de imagens)")
+    print("   - POST /api/add-person/             (adicionar pessoa)")
+    print("   - POST /api/add-person/bulk/        (cadastro em lote: .zip de fotos)")
+    print("   - GET  /api/list-persons/           (listar pessoas, paginado)")
+    print("   - POST /api/reset-system/           (resetar sistema)")
+    print("   - GET  /                            (health check)")
+    print("   - GET  /ready                       (pronto para tráfego)")
+    print("   - GET  /metrics                     (métricas Prometheus)")
+    print(f"🧵 Executor: {EXECUTOR_THREADS} threads para o trabalho de CPU")
+    print("⚡ Para parar o servidor: Ctrl+C")
+    print("-" * 60)
+
+    # Porta 8000 para ser compatível com a configuração do app
+    uvicorn.run(app, host='0.0.0.0', port=8000)
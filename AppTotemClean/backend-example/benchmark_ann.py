@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark de recall x latência: índice aproximado (IVF) contra a busca exata
+
+Gera uma galeria sintética (um encoding por pessoa) e consultas que são
+variações ruidosas de pessoas cadastradas, como uma nova foto da mesma pessoa.
+Recall = fração das consultas em que o IVF retorna a mesma linha que a busca exata.
+
+Uso:
+    python benchmark_ann.py
+    python benchmark_ann.py --sizes 10000 100000 --n-probe 4 8 16 32
+"""
+
+import argparse
+import time
+import numpy as np
+
+from face_gallery import FaceGallery, ENCODING_SIZE
+from face_index import ExactIndex, IVFIndex
+
+# Desvios escolhidos para distâncias típicas do dlib: ~1.0 entre pessoas diferentes
+# e ~0.35 entre fotos da mesma pessoa
+IDENTITY_STD = 0.0625
+PROBE_NOISE_STD = 0.031
+
+
+def synthetic_gallery(size, rng):
+    gallery = FaceGallery(capacity=size)
+    gallery.extend(rng.normal(0.0, IDENTITY_STD, (size, ENCODING_SIZE)), list(range(size)))
+    return gallery
+
+
+def timed_search(index, probes):
+    results = []
+    start = time.perf_counter()
+    for probe in probes:
+        results.append(index.search(probe)[0])
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(probes)
+    return results, elapsed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de recall x latência do índice IVF')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[4, 8, 16, 32])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'galeria':>9} {'backend':>12} {'recall@1':>9} {'ms/busca':>9}")
+    for size in args.sizes:
+        gallery = synthetic_gallery(size, rng)
+        targets = rng.choice(size, args.queries, replace=False)
+        probes = gallery.encodings[targets] + rng.normal(0.0, PROBE_NOISE_STD, (args.queries, ENCODING_SIZE))
+
+        exact_results, exact_ms = timed_search(ExactIndex(gallery), probes)
+        print(f"{size:>9} {'exact':>12} {1.0:>9.3f} {exact_ms:>9.3f}")
+
+        for n_probe in args.n_probe:
+            index = IVFIndex(gallery, n_probe=n_probe, seed=args.seed)
+            train_start = time.perf_counter()
+            index.search(probes[0])  # treino + montagem das listas fora da medição
+            train_s = time.perf_counter() - train_start
+
+            ivf_results, ivf_ms = timed_search(index, probes)
+            recall = np.mean(np.asarray(ivf_results) == np.asarray(exact_results))
+            label = f"ivf/{n_probe}"
+            print(f"{size:>9} {label:>12} {recall:>9.3f} {ivf_ms:>9.3f}   (treino {train_s:.1f} s)")
+
+
+if __name__ == '__main__':
+    main()
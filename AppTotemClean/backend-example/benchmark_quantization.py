@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Relatório de precisão das representações compactas (FACE_SCAN_DTYPE)
+
+Compara a busca sobre float32/float16/int8 (com re-ranqueamento em float64)
+contra a busca exata em float64, na mesma galeria sintética e nas mesmas
+consultas. As consultas cobrem fotos da mesma pessoa com ruído variado (as
+distâncias se espalham em torno do limiar) e pessoas não cadastradas.
+
+Decisão = linha reconhecida se a distância for <= limiar, senão "desconhecido".
+"decisões" deve ser 1.000: qualquer divergência é listada.
+
+Uso:
+    python benchmark_quantization.py
+    python benchmark_quantization.py --sizes 10000 100000 --rerank 8 32
+"""
+
+import argparse
+import time
+import numpy as np
+
+from face_gallery import FaceGallery, ENCODING_SIZE
+from face_index import ExactIndex, QuantizedIndex
+from face_quantization import SCAN_DTYPES, bytes_per_row
+
+THRESHOLD = 0.6
+# Distância típica ~1.0 entre pessoas diferentes; o ruído das consultas varia para que
+# as distâncias da mesma pessoa fiquem entre ~0.2 e ~0.8, atravessando o limiar
+IDENTITY_STD = 0.0625
+PROBE_NOISE_RANGE = (0.018, 0.07)
+IMPOSTOR_FRACTION = 0.2
+# Descritores do dlib não são centrados em zero
+MEAN_OFFSET_STD = 0.05
+
+
+def synthetic_data(size, queries, rng):
+    mean = rng.normal(0.0, MEAN_OFFSET_STD, ENCODING_SIZE)
+    encodings = mean + rng.normal(0.0, IDENTITY_STD, (size, ENCODING_SIZE))
+    gallery = FaceGallery(capacity=size)
+    gallery.extend(encodings, list(range(size)))
+
+    impostors = int(queries * IMPOSTOR_FRACTION)
+    genuine = queries - impostors
+    noise = rng.uniform(*PROBE_NOISE_RANGE, genuine)[:, None]
+    probes = np.concatenate([
+        encodings[rng.choice(size, genuine)] + rng.normal(0.0, 1.0, (genuine, ENCODING_SIZE)) * noise,
+        mean + rng.normal(0.0, IDENTITY_STD, (impostors, ENCODING_SIZE)),
+    ])
+    return gallery, probes
+
+
+def run(index, probes):
+    results = []
+    start = time.perf_counter()
+    for probe in probes:
+        results.append(index.search(probe))
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(probes)
+    return results, elapsed_ms
+
+
+def decision(result):
+    row, distance = result
+    return row if row is not None and distance < THRESHOLD else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precisão e custo das representações compactas')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--dtypes', nargs='+', default=list(SCAN_DTYPES[1:]), choices=SCAN_DTYPES)
+    parser.add_argument('--rerank', type=int, nargs='+', default=[32])
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'galeria':>9} {'varredura':>12} {'bytes/linha':>11} {'decisões':>9} "
+          f"{'recall@1':>9} {'Δdist máx':>10} {'ms/busca':>9}")
+    for size in args.sizes:
+        gallery, probes = synthetic_data(size, args.queries, rng)
+        exact, exact_ms = run(ExactIndex(gallery), probes)
+        exact_decisions = [decision(result) for result in exact]
+        near = sum(abs(distance - THRESHOLD) < 0.02 for _, distance in exact)
+        print(f"{size:>9} {'float64':>12} {bytes_per_row('float64'):>11} {1.0:>9.3f} "
+              f"{1.0:>9.3f} {0.0:>10.1e} {exact_ms:>9.3f}   ({near} consultas a ±0.02 do limiar)")
+
+        for scan_dtype in args.dtypes:
+            for candidates in args.rerank:
+                index = QuantizedIndex(gallery, scan_dtype, candidates)
+                index.search(probes[0])  # cópia compacta fora da medição
+                results, ms = run(index, probes)
+
+                decisions = [decision(result) for result in results]
+                agreement = np.mean([a == b for a, b in zip(decisions, exact_decisions)])
+                recall = np.mean([a[0] == b[0] for a, b in zip(results, exact)])
+                delta = max(abs(a[1] - b[1]) for a, b in zip(results, exact))
+                label = f"{scan_dtype}/{candidates}"
+                print(f"{size:>9} {label:>12} {bytes_per_row(scan_dtype):>11} {agreement:>9.3f} "
+                      f"{recall:>9.3f} {delta:>10.1e} {ms:>9.3f}")
+                for number, (a, b) in enumerate(zip(decisions, exact_decisions)):
+                    if a != b:
+                        print(f"{'':>9} ⚠️  consulta {number}: {a} (float64: {b}, distância {exact[number][1]:.4f})")
+
+
+if __name__ == '__main__':
+    main()
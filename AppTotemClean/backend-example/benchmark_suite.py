@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Benchmark do backend de reconhecimento com galerias sintéticas
+
+Para cada tamanho de galeria (padrão 1k/10k/100k encodings) o store é
+preenchido direto (append_many) e então são medidos, no FaceRecognitionSystem:
+
+- inicialização com warm_up (modelos, galeria e índice) e load_known_faces;
+- recognize_face com fotos de pessoas cadastradas e de desconhecidos (latência
+  p50/p95/p99, tempo por etapa e acerto);
+- add_person de novas pessoas sobre a galeria cheia;
+- save_known_faces (compactação + recarga);
+
+e o find_best_match do exemplo Django. O django-api-example.py não é um módulo
+importável, então o PersonGalleryCache é reproduzido com as mesmas peças
+(blobs float32, FaceGallery float32, create_index com as configurações do settings.py).
+
+Motores:
+    --engine stub  face_engine_stub.py (determinístico, não precisa do dlib)
+    --engine dlib  face_recognition real; as fotos vêm de --images (latência
+                   apenas: as identidades das fotos não são conhecidas)
+
+O resultado vai para um JSON (--output). Com --compare, as métricas de tempo são
+comparadas com um resultado anterior e o script sai com código 1 se alguma piorou
+mais que --tolerance.
+
+Uso:
+    python benchmark_suite.py
+    python benchmark_suite.py --sizes 1000 10000 --output bench-1.4.json
+    python benchmark_suite.py --compare bench-1.3.json
+    python benchmark_suite.py --engine dlib --images known_faces/
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+import face_engine_stub
+
+RESULTS_VERSION = 1
+SEED_CHUNK_ROWS = 10000
+# Diferenças abaixo disso (ms) são ruído de medição, não regressão
+REGRESSION_MIN_DELTA_MS = 0.05
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Benchmark mede o caminho completo de cada chamada, na thread atual
+os.environ.setdefault('FACE_INFERENCE_WORKERS', '0')
+os.environ.setdefault('FACE_FRAME_CACHE_TTL', '0')
+
+
+def latency_stats(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        'count': int(len(samples)),
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+    }
+
+
+def timed_ms(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_images(directory):
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        raise SystemExit(f"Nenhuma imagem em {directory}")
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+class Workload:
+    """Imagens/encodings das consultas e cadastros de um tamanho de galeria"""
+
+    def __init__(self, size, args, images=None):
+        rng = np.random.default_rng([args.seed, size])
+        impostors = int(args.queries * args.impostor_fraction)
+        genuine = args.queries - impostors
+        # (identidade esperada ou None, identidade da foto, variação)
+        self.queries = [(int(identity), int(identity), 1 + number)
+                        for number, identity in enumerate(rng.choice(size, genuine))]
+        self.queries += [(None, size + number, 1) for number in range(impostors)]
+        rng.shuffle(self.queries)
+        first_new = size + impostors
+        self.enrollments = [(first_new + number, 0) for number in range(args.enrollments)]
+
+        if images is None:
+            self.query_images = [face_engine_stub.synthetic_image(identity, variant)
+                                 for _, identity, variant in self.queries]
+            self.enrollment_images = [face_engine_stub.synthetic_image(identity, variant)
+                                      for identity, variant in self.enrollments]
+            self.expected = [expected for expected, _, _ in self.queries]
+        else:
+            self.query_images = [images[number % len(images)] for number in range(len(self.queries))]
+            self.enrollment_images = [images[number % len(images)] for number in range(args.enrollments)]
+            self.expected = None
+        self.query_encodings = [face_engine_stub.identity_encoding(identity, variant)
+                                for _, identity, variant in self.queries]
+
+
+def person_name(identity):
+    return f"Pessoa {identity:07d}"
+
+
+def seed_store(directory, size):
+    """Preencher o store com `size` pessoas (um modelo cada), em lotes"""
+    from encoding_store import EncodingStore
+    store = EncodingStore(directory)
+    for start in range(0, size, SEED_CHUNK_ROWS):
+        stop = min(size, start + SEED_CHUNK_ROWS)
+        store.append_many(face_engine_stub.identity_encodings(start, stop),
+                          [person_name(identity) for identity in range(start, stop)],
+                          [str(identity) for identity in range(start, stop)])
+
+
+def bench_face_system(size, workload):
+    import face_system
+    from face_pipeline import StageTimer
+
+    result = {}
+    seed_store(face_system.STORE_DIR, size)
+
+    def start_system():
+        system = face_system.FaceRecognitionSystem()
+        system.warm_up()
+        return system
+
+    # Construção + aquecimento (modelos, galeria e índice): o tempo até GET /ready
+    system, result['startup_ms'] = timed_ms(start_system)
+    samples = [timed_ms(system.load_known_faces)[1] for _ in range(3)]
+    result['load_known_faces_ms'] = round(float(np.median(samples)), 3)
+    result['startup_ms'] = round(result['startup_ms'], 3)
+
+    # Primeira busca fora da medição (treino do IVF, cópia compacta)
+    system.recognize_face(workload.query_images[0])
+
+    samples, stages, correct = [], {}, 0
+    for number, image in enumerate(workload.query_images):
+        timer = StageTimer()
+        (success, _, name, _), elapsed_ms = timed_ms(system.recognize_face, image, timer)
+        samples.append(elapsed_ms)
+        for stage, ms in timer.timings.items():
+            stages[stage] = stages.get(stage, 0.0) + ms
+        if workload.expected is not None:
+            expected = workload.expected[number]
+            correct += (name == person_name(expected)) if expected is not None else not success
+    result['recognize_face'] = latency_stats(samples)
+    result['recognize_face']['stages_mean_ms'] = {
+        stage: round(total / len(samples), 3) for stage, total in stages.items()
+    }
+    if workload.expected is not None:
+        result['recognize_face']['accuracy'] = round(correct / len(samples), 4)
+
+    samples, failures = [], 0
+    for (identity, _), image in zip(workload.enrollments, workload.enrollment_images):
+        (success, _), elapsed_ms = timed_ms(system.add_person, person_name(identity), image,
+                                            person_id=str(identity))
+        samples.append(elapsed_ms)
+        failures += not success
+    result['add_person'] = latency_stats(samples)
+    result['add_person']['failures'] = failures
+
+    result['save_known_faces_ms'] = round(timed_ms(system.save_known_faces)[1], 3)
+    result['gallery_rows'] = len(system.gallery)
+    return result
+
+
+def bench_django_find_best_match(size, workload):
+    """PersonGalleryCache + find_best_match do exemplo Django (ver docstring do módulo)"""
+    from face_gallery import FaceGallery
+    from face_index import create_index, ANN_MIN_GALLERY_SIZE
+    from face_quantization import encoding_from_blob, encoding_to_blob
+    threshold = 0.6
+
+    # Blobs como gravados por Person.set_face_encoding (float32)
+    blobs = [encoding_to_blob(encoding) for encoding in face_engine_stub.identity_encodings(0, size)]
+
+    start = time.perf_counter()
+    gallery = FaceGallery(dtype=np.float32)  # GALLERY_DTYPE do exemplo
+    rows = {}
+    with gallery.batch():  # como PersonGalleryCache._ensure_loaded
+        for person_id, blob in enumerate(blobs):
+            rows[person_id] = gallery.add(encoding_from_blob(blob), person_id)
+    index = create_index(gallery, 'auto', ANN_MIN_GALLERY_SIZE, scan_dtype='float32')
+    index.search(workload.query_encodings[0])
+    result = {'cache_build_ms': round((time.perf_counter() - start) * 1000, 3)}
+
+    identify, verify, correct = [], [], 0
+    for (expected, identity, _), encoding in zip(workload.queries, workload.query_encodings):
+        (row, distance), elapsed_ms = timed_ms(index.search, encoding)
+        identify.append(elapsed_ms)
+        match = gallery.names[row] if row is not None and distance < threshold else None
+        correct += match == expected
+
+        claimed = expected if expected is not None else identity % size
+        _, elapsed_ms = timed_ms(gallery.best_match, encoding, [rows[claimed]])
+        verify.append(elapsed_ms)
+
+    result['identify'] = latency_stats(identify)
+    result['identify']['accuracy'] = round(correct / len(identify), 4)
+    result['verify'] = latency_stats(verify)
+    return result
+
+
+def run_suite(args):
+    images = None
+    if args.engine == 'stub':
+        face_engine_stub.detect_ms = args.stub_detect_ms
+        face_engine_stub.install()
+    else:
+        if not args.images:
+            raise SystemExit("--engine dlib precisa de --images com fotos reais")
+        images = load_images(args.images)
+
+    workdir = tempfile.mkdtemp(prefix='face-bench-')
+    original_cwd = os.getcwd()
+    output = io.StringIO()
+    results = {}
+    try:
+        for size in args.sizes:
+            directory = os.path.join(workdir, f"gallery-{size}")
+            os.makedirs(os.path.join(directory, 'known_faces'))
+            os.chdir(directory)
+            workload = Workload(size, args, images)
+            print(f"⏱️  Galeria de {size} encodings...", flush=True)
+            with contextlib.redirect_stdout(output if not args.verbose else sys.stdout):
+                entry = {'gallery_size': size}
+                entry.update(bench_face_system(size, workload))
+                if args.engine == 'stub':
+                    entry['django_find_best_match'] = bench_django_find_best_match(size, workload)
+            results[str(size)] = entry
+            os.chdir(original_cwd)
+    finally:
+        os.chdir(original_cwd)
+        if not args.keep:
+            import shutil
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    import face_system
+    return {
+        'suite': 'face-backend',
+        'version': RESULTS_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'engine': args.engine,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'config': {
+            'search_backend': face_system.SEARCH_BACKEND,
+            'ann_min_gallery_size': face_system.SEARCH_ANN_MIN_GALLERY_SIZE,
+            'scan_dtype': face_system.SCAN_DTYPE,
+            'rerank_candidates': face_system.RERANK_CANDIDATES,
+            'shared_gallery': face_system.SHARED_GALLERY,
+            'threshold': face_system.RECOGNITION_THRESHOLD,
+            'queries': args.queries,
+            'impostor_fraction': args.impostor_fraction,
+            'enrollments': args.enrollments,
+            'stub_detect_ms': args.stub_detect_ms if args.engine == 'stub' else None,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+
+def flatten(data, prefix=''):
+    """{'a': {'b': 1}} -> {'a.b': 1} (só valores numéricos)"""
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(current, baseline, tolerance):
+    """Listar as métricas que pioraram em relação ao resultado anterior"""
+    new, old = flatten(current['results']), flatten(baseline['results'])
+    regressions = []
+    for key in sorted(new.keys() & old.keys()):
+        # p99 de poucas amostras é praticamente o máximo: ruído demais para comparar
+        if key.endswith('_ms') and not key.endswith('p99_ms'):
+            if new[key] > old[key] * tolerance and new[key] - old[key] > REGRESSION_MIN_DELTA_MS:
+                regressions.append((key, old[key], new[key]))
+        elif key.endswith('accuracy') and new[key] < old[key]:
+            regressions.append((key, old[key], new[key]))
+    return regressions
+
+
+def print_summary(report):
+    print(f"\n{'galeria':>9} {'recognize p50':>14} {'p95':>9} {'acerto':>7} {'add_person p50':>15} "
+          f"{'load':>9} {'save':>9} {'django 1:N p95':>15}")
+    for entry in report['results'].values():
+        recognize = entry['recognize_face']
+        django = entry.get('django_find_best_match', {}).get('identify', {})
+        accuracy = recognize.get('accuracy')
+        print(f"{entry['gallery_size']:>9} {recognize['p50_ms']:>11.2f} ms {recognize['p95_ms']:>6.2f} ms "
+              f"{accuracy if accuracy is not None else '-':>7} {entry['add_person']['p50_ms']:>12.2f} ms "
+              f"{entry['load_known_faces_ms']:>6.1f} ms {entry['save_known_faces_ms']:>6.1f} ms "
+              f"{django.get('p95_ms', float('nan')):>12.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do backend de reconhecimento facial')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--engine', choices=('stub', 'dlib'), default='stub')
+    parser.add_argument('--images', help='Diretório com fotos reais (--engine dlib)')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--impostor-fraction', type=float, default=0.2)
+    parser.add_argument('--enrollments', type=int, default=20)
+    parser.add_argument('--stub-detect-ms', type=float, default=0.0,
+                        help='Tempo simulado da detecção no stub (ms)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help='Resultado anterior (JSON) para detectar regressões')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='Fator de piora aceito nas métricas de tempo')
+    parser.add_argument('--keep', action='store_true', help='Manter o diretório temporário dos stores')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar os logs do backend')
+    args = parser.parse_args()
+
+    report = run_suite(args)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_summary(report)
+    print(f"\n📄 Resultados em {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n⚠️  {len(regressions)} métricas pioraram em relação a {args.compare} "
+                  f"({baseline.get('git_commit') or 'sem commit'}):")
+            for key, old, new in regressions:
+                print(f"   {key}: {old} -> {new}")
+            sys.exit(1)
+        print(f"\n✅ Nenhuma regressão em relação a {args.compare}")
+
+
+if __name__ == '__main__':
+    main()
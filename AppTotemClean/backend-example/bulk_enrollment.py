@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Cadastro em lote a partir de um diretório ou arquivo .zip de fotos
+
+Cada foto se chama <employee_id>.jpg (ou .jpeg/.png): o nome do arquivo é o
+identificador do colaborador, usado também como nome. Para um contrato novo:
+
+    python bulk_enrollment.py fotos/
+    python bulk_enrollment.py fotos.zip --workers 8 --report rejeitadas.json
+
+Decodificação, detecção e encoding rodam em paralelo em um pool de processos
+próprio (FACE_BULK_WORKERS, padrão: um por núcleo). Cada processo lê a foto
+direto do diretório/zip, então as imagens não passam pelo processo principal.
+Os encodings aceitos entram no store em um único commit (append_many), em vez
+de um commit por pessoa como em /api/add-person/. O relatório lista cada
+arquivo rejeitado e o motivo (nenhuma face, várias faces, colaborador repetido...).
+
+Os servidores expõem o mesmo cadastro em POST /api/add-person/bulk/, um lote
+por vez e com o .zip limitado a FACE_BULK_MAX_BYTES.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import zipfile
+from functools import lru_cache
+
+# Processos do pool do cadastro em lote (separado do pool de reconhecimento)
+BULK_WORKERS = int(os.environ.get('FACE_BULK_WORKERS', os.cpu_count() or 2))
+# Fotos enviadas ao pool por vez (o progresso é impresso a cada bloco)
+BULK_CHUNK_SIZE = 256
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Fotos maiores são rejeitadas sem decodificar (zip malformado, arquivo errado)
+MAX_PHOTO_BYTES = 20 * 1024 * 1024
+# Tamanho máximo do .zip recebido em /api/add-person/bulk/ (lotes maiores: use o CLI)
+MAX_ARCHIVE_BYTES = int(os.environ.get('FACE_BULK_MAX_BYTES', 256 * 1024 * 1024))
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class ArchiveTooLarge(Exception):
+    """Arquivo enviado ao endpoint maior que MAX_ARCHIVE_BYTES"""
+
+    def __init__(self, max_bytes=MAX_ARCHIVE_BYTES):
+        super().__init__(f"Arquivo maior que {max_bytes // (1024 * 1024)} MB "
+                         f"(para lotes maiores use python bulk_enrollment.py)")
+
+
+def _photo_entry(file, size, source, seen, photos, rejected):
+    """Validar um arquivo da origem e incluí-lo em `photos` ou `rejected`"""
+    base = os.path.basename(file)
+    if base.startswith('.') or '__MACOSX' in file.split('/'):
+        return  # metadados do sistema operacional, não são fotos
+    employee_id, extension = os.path.splitext(base)
+    employee_id = employee_id.strip()
+
+    if extension.lower() not in IMAGE_EXTENSIONS:
+        error = f"Formato não suportado (use {', '.join(IMAGE_EXTENSIONS)})"
+    elif not employee_id:
+        error = "Nome do arquivo sem identificador do colaborador"
+    elif employee_id in seen:
+        error = f"Colaborador {employee_id} repetido (já cadastrado por {seen[employee_id]})"
+    elif size > MAX_PHOTO_BYTES:
+        error = f"Arquivo maior que {MAX_PHOTO_BYTES // (1024 * 1024)} MB"
+    else:
+        seen[employee_id] = file
+        photos.append((file, employee_id, source))
+        return
+    rejected.append({'file': file, 'employee_id': employee_id or None, 'error': error})
+
+
+def list_photos(path):
+    """
+    Fotos de um diretório (incluindo subdiretórios) ou de um .zip.
+    Retorna (fotos, rejeitadas): fotos são (arquivo, employee_id, origem), com
+    origem = (caminho, membro do zip ou None); rejeitadas são os arquivos
+    descartados antes do pool, no formato {'file', 'employee_id', 'error'}.
+    """
+    photos, rejected, seen = [], [], {}
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full_path = os.path.join(root, name)
+                file = os.path.relpath(full_path, path).replace(os.sep, '/')
+                _photo_entry(file, os.path.getsize(full_path), (full_path, None), seen, photos, rejected)
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            members = sorted((info for info in archive.infolist() if not info.is_dir()),
+                             key=lambda info: info.filename)
+            for info in members:
+                _photo_entry(info.filename, info.file_size, (path, info.filename), seen, photos, rejected)
+    else:
+        raise ValueError(f"{path} não é um diretório nem um arquivo .zip")
+    return photos, rejected
+
+
+@lru_cache(maxsize=4)
+def _archive(path):
+    """ZipFile aberto uma vez por processo (abrir lê o diretório central inteiro)"""
+    return zipfile.ZipFile(path)
+
+
+def read_photo(source):
+    path, member = source
+    if member is None:
+        with open(path, 'rb') as f:
+            return f.read()
+    return _archive(path).read(member)
+
+
+def enrollment_file_task(job):
+    """
+    Executada nos processos do pool: ler a foto, extrair o encoding (exatamente
+    uma face) e salvar a imagem de referência. `job` = (origem, caminho da
+    referência). Retorna (encoding, erro, StageTimer com os tempos).
+    """
+    from face_pipeline import StageTimer, extract_enrollment
+
+    source, reference_path = job
+    timer = StageTimer()
+    try:
+        with timer.stage('read'):
+            image_data = read_photo(source)
+        encoding, error, image = extract_enrollment(image_data, timer)
+        if error is None:
+            image.save(reference_path, format='JPEG', quality=90)
+    except Exception as e:
+        return None, f"Erro ao processar imagem: {str(e)}", timer
+    return encoding, error, timer
+
+
+class ArchiveFile:
+    """
+    Arquivo temporário do .zip recebido (os processos do pool o leem), gravado
+    em pedaços conforme chegam. ArchiveTooLarge se passar de `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=MAX_ARCHIVE_BYTES):
+        fd, self.path = tempfile.mkstemp(prefix='face-bulk-', suffix='.zip')
+        self._file = os.fdopen(fd, 'wb')
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def check(self, size):
+        """ArchiveTooLarge se o arquivo passar de max_bytes com mais `size` bytes"""
+        if self.size + size > self.max_bytes:
+            raise ArchiveTooLarge(self.max_bytes)
+
+    def write(self, chunk):
+        self.check(len(chunk))
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def close(self):
+        """Terminar a gravação e retornar o caminho"""
+        self._file.close()
+        return self.path
+
+    def discard(self):
+        """Remover o arquivo (recebimento interrompido ou recusado)"""
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def save_archive(fileobj, max_bytes=MAX_ARCHIVE_BYTES):
+    """
+    Copiar o .zip recebido para um arquivo temporário (ArchiveFile); retorna o
+    caminho. ArchiveTooLarge se passar de `max_bytes`.
+    """
+    archive = ArchiveFile(max_bytes)
+    try:
+        while True:
+            chunk = fileobj.read(COPY_BUFFER_SIZE)
+            if not chunk:
+                break
+            archive.write(chunk)
+    except BaseException:
+        archive.discard()
+        raise
+    return archive.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cadastro em lote de fotos <employee_id>.jpg")
+    parser.add_argument('path', help="diretório ou arquivo .zip com as fotos")
+    parser.add_argument('--workers', type=int, default=BULK_WORKERS, help="processos de detecção/encoding")
+    parser.add_argument('--report', help="gravar o relatório completo (JSON) neste arquivo")
+    args = parser.parse_args()
+
+    from face_system import FaceRecognitionSystem
+
+    face_system = FaceRecognitionSystem()
+    if not face_system.warm_up():
+        sys.exit(1)
+    try:
+        report = face_system.add_persons_bulk(args.path, workers=args.workers)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    for item in report['rejected']:
+        print(f"   ❌ {item['file']}: {item['error']}")
+    print(f"✅ {report['enrolled']}/{report['total']} fotos cadastradas, {len(report['rejected'])} rejeitadas "
+          f"em {report['seconds']:.1f}s")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📝 Relatório salvo em {args.report}")
+
+
+if __name__ == '__main__':
+    main()
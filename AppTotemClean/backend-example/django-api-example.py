@@ -7,7 +7,6 @@ INSTALAÇÃO DAS DEPENDÊNCIAS:
 pip install django
 pip install djangorestframework
 pip install face-recognition
-pip install opencv-python
 pip install pillow
 pip install google-cloud-storage
 pip install psycopg2-binary
@@ -17,45 +16,109 @@ pip install psycopg2-binary
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.parsers import BaseParser, JSONParser, MultiPartParser
 from django.core.files.base import ContentFile
-import face_recognition
 import numpy as np
 import base64
-import cv2
-from PIL import Image
 import io
 import json
 from datetime import datetime
 from .models import Person, Attendance
 from .serializers import AttendanceSerializer
+from .gallery import person_gallery
+from .attendance_buffer import attendance_buffer, AttendanceBufferFull
+from . import warmup
+# copie backend-example/face_detectors.py para o app
+from .face_detectors import create_cascade
+from django.conf import settings
+# face_recognition e PIL são importados dentro das funções: o import do
+# face_recognition carrega os modelos do dlib (~1,5 s), o que atrasaria o
+# manage.py (migrate, shell) e a subida do worker. Ver warmup.py.
+
+# Cascata de detectores (ex.: 'hog:0,hog'): o próximo só roda se o anterior não achar faces
+detector_cascade = create_cascade(getattr(settings, 'FACE_DETECTORS', 'hog'))
+
+
+class RawImageParser(BaseParser):
+    """
+    Corpo binário (Content-Type image/jpeg, image/png, ...): a imagem chega sem
+    base64 e o stream da requisição vai direto para o decodificador
+    """
+    media_type = 'image/*'
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        return {'image': stream}
+
+
+# Campos com a matrícula informada por crachá/PIN (verificação 1:1)
+IDENTITY_FIELDS = ('employee_id', 'colaborador_id')
+
+
+def claimed_employee_id(request):
+    """Matrícula informada no corpo ou na query string, ou None"""
+    for field in IDENTITY_FIELDS:
+        value = request.data.get(field) or request.query_params.get(field)
+        if value:
+            return str(value).strip()
+    return None
+
+
+def open_uploaded_image(image):
+    """Abrir a imagem recebida como base64 (JSON), arquivo multipart ou corpo binário"""
+    from PIL import Image
+    
+    if isinstance(image, str):
+        image = io.BytesIO(base64.b64decode(image))
+    return Image.open(image)
+
 
 class FaceRecognitionAPIView(APIView):
     """
     API para reconhecimento facial
     POST /api/face-recognition/
+    
+    Aceita JSON {"image": "<base64>", "timestamp": "..."}, multipart com o
+    arquivo no campo "image" ou o JPEG no corpo (timestamp na query string).
+    Com employee_id/colaborador_id a face é verificada 1:1 contra essa pessoa.
     """
+    parser_classes = [JSONParser, MultiPartParser, RawImageParser]
     
     def post(self, request):
+        import face_recognition
+        
         try:
             # Receber dados do app
-            image_base64 = request.data.get('image')
-            timestamp = request.data.get('timestamp')
+            image = request.data.get('image')
+            timestamp = request.data.get('timestamp') or request.query_params.get('timestamp')
             
-            if not image_base64:
+            if not image:
                 return Response({
                     'success': False,
                     'error': 'Imagem não fornecida'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Decodificar imagem base64
-            image_data = base64.b64decode(image_base64)
-            image = Image.open(io.BytesIO(image_data))
+            # Crachá/PIN: resolver a pessoa antes de processar a imagem
+            person_id = None
+            employee_id = claimed_employee_id(request)
+            if employee_id:
+                person_id = (Person.objects
+                             .filter(employee_id=employee_id, is_active=True)
+                             .values_list('id', flat=True)
+                             .first())
+                if person_id is None:
+                    return Response({
+                        'success': False,
+                        'error': 'Colaborador não cadastrado'
+                    }, status=status.HTTP_404_NOT_FOUND)
+            
+            # Decodificar imagem (base64 só no formato JSON)
+            image = open_uploaded_image(image)
             
-            # Converter para array numpy (formato do face_recognition)
-            image_array = np.array(image)
+            # Array numpy (formato do face_recognition) sem cópia extra
+            image_array = np.asarray(image)
             
-            # Detectar faces na imagem
-            face_locations = face_recognition.face_locations(image_array)
+            # Detectar faces na imagem (cascata configurada em FACE_DETECTORS)
+            face_locations = detector_cascade.detect(image_array)
             
             if not face_locations:
                 return Response({
@@ -74,11 +137,19 @@ class FaceRecognitionAPIView(APIView):
             
             # Comparar com faces conhecidas no banco de dados
             unknown_encoding = face_encodings[0]
-            best_match = self.find_best_match(unknown_encoding)
+            best_match = self.find_best_match(unknown_encoding, person_id)
             
             if best_match:
                 # Registrar ponto
-                attendance = self.register_attendance(best_match, timestamp)
+                try:
+                    attendance_id, pending = self.register_attendance(best_match, timestamp)
+                except AttendanceBufferFull as full:
+                    return Response({
+                        'success': False,
+                        'error': 'Servidor ocupado, tente novamente',
+                        'retry_after': full.retry_after
+                    }, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        headers={'Retry-After': str(full.retry_after)})
                 
                 return Response({
                     'success': True,
@@ -86,12 +157,14 @@ class FaceRecognitionAPIView(APIView):
                     'person_id': best_match.id,
                     'confidence': best_match.confidence,
                     'attendance_recorded': True,
-                    'attendance_id': attendance.id
+                    'attendance_id': attendance_id,
+                    'attendance_pending': pending
                 }, status=status.HTTP_200_OK)
             else:
                 return Response({
                     'success': False,
-                    'error': 'Pessoa não reconhecida',
+                    'error': ('Face não confere com o colaborador informado' if person_id
+                              else 'Pessoa não reconhecida'),
                     'confidence': 0.0
                 }, status=status.HTTP_404_NOT_FOUND)
                 
@@ -101,45 +174,65 @@ class FaceRecognitionAPIView(APIView):
                 'error': f'Erro interno: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
-    def find_best_match(self, unknown_encoding):
+    def find_best_match(self, unknown_encoding, person_id=None):
         """
-        Encontrar a melhor correspondência no banco de dados
+        Encontrar a melhor correspondência na galeria em memória
+        (uma comparação vetorizada, sem consultas ao banco).
+        Com `person_id`, compara só com o encoding dessa pessoa (1:1).
         """
-        persons = Person.objects.filter(is_active=True)
-        best_match = None
-        best_distance = float('inf')
+        if person_id is None:
+            person_id, name, distance = person_gallery.best_match(unknown_encoding)
+        else:
+            name, distance = person_gallery.verify(unknown_encoding, person_id)
         
-        for person in persons:
-            if person.face_encoding:
-                # Decodificar encoding salvo no banco
-                known_encoding = np.frombuffer(person.face_encoding, dtype=np.float64)
-                
-                # Calcular distância
-                distance = face_recognition.face_distance([known_encoding], unknown_encoding)[0]
-                
-                # Threshold de 0.6 (ajuste conforme necessário)
-                if distance < 0.6 and distance < best_distance:
-                    best_distance = distance
-                    best_match = person
-                    best_match.confidence = 1 - distance  # Converter para confiança
+        # Threshold de 0.6 (ajuste conforme necessário)
+        if person_id is None or distance >= 0.6:
+            return None
         
+        # Instância leve: só id e nome, suficiente para a resposta e para a FK do ponto
+        best_match = Person(id=person_id, name=name)
+        best_match.confidence = 1 - distance  # Converter para confiança
         return best_match
     
     def register_attendance(self, person, timestamp):
         """
-        Registrar ponto no banco de dados
+        Registrar ponto. Com FACE_ATTENDANCE_BUFFERED o ponto entra na fila do
+        attendance_buffer (gravação em lote) e o id retornado é o provisório
+        (Attendance.client_ref); sem ele, grava na hora. Retorna (id, pendente).
         """
+        timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+        if getattr(settings, 'FACE_ATTENDANCE_BUFFERED', True):
+            client_ref = attendance_buffer.add(person.id, timestamp, 'face_recognition', person.confidence)
+            return client_ref, True
+        
         attendance = Attendance.objects.create(
             person=person,
-            timestamp=datetime.fromisoformat(timestamp.replace('Z', '+00:00')),
-            method='face_recognition'
+            timestamp=timestamp,
+            method='face_recognition',
+            confidence=person.confidence
         )
-        return attendance
+        return attendance.id, False
+
+
+class ReadinessAPIView(APIView):
+    """
+    Readiness: GET /api/ready/
+    
+    200 depois do aquecimento (modelos do dlib e galeria carregados, ver
+    warmup.py), 503 antes. A liveness continua sendo o próprio servidor responder.
+    """
+    
+    def get(self, request):
+        state = warmup.readiness()
+        return Response(state, status=status.HTTP_200_OK if state['ready']
+                        else status.HTTP_503_SERVICE_UNAVAILABLE)
 
 
 # models.py
 from django.db import models
 from django.contrib.auth.models import User
+# copie backend-example/face_quantization.py para o app
+from .face_quantization import encoding_to_blob
 
 class Person(models.Model):
     """
@@ -148,14 +241,57 @@ class Person(models.Model):
     name = models.CharField(max_length=100)
     employee_id = models.CharField(max_length=50, unique=True)
     email = models.EmailField(blank=True)
-    face_encoding = models.BinaryField(null=True, blank=True)  # Encoding da face
+    # Encoding da face: 128 float32 (512 bytes). Blobs antigos em float64 (1024 bytes)
+    # continuam legíveis; a migração 0002 converte os existentes
+    face_encoding = models.BinaryField(null=True, blank=True)
     photo = models.ImageField(upload_to='faces/', null=True, blank=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Campos lidos pela galeria de faces (gallery.py): só alterações neles mudam a
+    # FaceGalleryVersion e fazem os outros workers reconstruírem a galeria
+    GALLERY_FIELDS = ('name', 'is_active', 'face_encoding')
+    
     def __str__(self):
         return f"{self.name} ({self.employee_id})"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Estado gravado no banco, comparado no post_save (ver signals.py)
+        instance._gallery_state = instance.gallery_state()
+        return instance
+    
+    def gallery_state(self):
+        """Valores dos GALLERY_FIELDS, ou None se algum não foi carregado (only/defer)"""
+        if self.get_deferred_fields() & set(self.GALLERY_FIELDS):
+            return None
+        encoding = self.face_encoding
+        return self.name, self.is_active, None if encoding is None else bytes(encoding)
+    
+    def set_face_encoding(self, encoding):
+        """Gravar o encoding em float32 (sem perda: o dlib calcula os descritores em float32)"""
+        self.face_encoding = encoding_to_blob(encoding)
+
+
+class FaceGalleryVersion(models.Model):
+    """
+    Versão da galeria de faces compartilhada pelos workers (uma linha, pk=1):
+    incrementada a cada alteração de Person, na mesma transação (ver signals.py),
+    para que cada PersonGalleryCache perceba alterações feitas em outro processo.
+    """
+    version = models.BigIntegerField(default=0)
+    
+    @classmethod
+    def bump(cls):
+        """Incrementar a versão e retornar o novo valor (a linha fica travada até o commit)"""
+        cls.objects.filter(pk=1).update(version=models.F('version') + 1)
+        return cls.current()
+    
+    @classmethod
+    def current(cls):
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
 
 
 class Attendance(models.Model):
@@ -172,6 +308,9 @@ class Attendance(models.Model):
     timestamp = models.DateTimeField()
     method = models.CharField(max_length=20, choices=METHODS, default='face_recognition')
     confidence = models.FloatField(null=True, blank=True)
+    # Id provisório devolvido ao app antes da gravação em lote (attendance_buffer.py);
+    # único para que regravar um lote não duplique pontos
+    client_ref = models.UUIDField(null=True, blank=True, unique=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -181,6 +320,666 @@ class Attendance(models.Model):
         return f"{self.person.name} - {self.timestamp}"
 
 
+# gallery.py
+import threading
+import time
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from .models import Person, FaceGalleryVersion
+# copie backend-example/face_gallery.py, face_index.py e face_quantization.py para o app
+from .face_gallery import FaceGallery
+from .face_index import create_index, ANN_MIN_GALLERY_SIZE
+from .face_quantization import encoding_from_blob
+
+# Fração de linhas descartadas (pessoas alteradas/removidas) que provoca a reconstrução
+GALLERY_REBUILD_DISCARDED_RATIO = 0.25
+# Galeria em float32, como os blobs de Person.set_face_encoding (sem perda para o
+# dlib): com FACE_SCAN_DTYPE = 'float32' a varredura lê a própria galeria, sem cópia
+GALLERY_DTYPE = np.float32
+
+
+class PersonGalleryCache:
+    """
+    Cache da galeria de encodings no processo.
+    
+    Construído a partir de Person.face_encoding e mantido atualizado pelos
+    sinais post_save/post_delete de Person (ver signals.py), aplicados só depois
+    do commit da transação. Cada processo worker tem o seu cache: a versão em
+    FaceGalleryVersion (incrementada pelos sinais na mesma transação, só quando
+    Person.GALLERY_FIELDS mudam) é consultada a cada
+    FACE_GALLERY_VERSION_CHECK_INTERVAL segundos e, se outro worker alterou
+    pessoas, a galeria é reconstruída em uma thread em segundo plano. Alterações
+    feitas com QuerySet.update() não disparam sinais e exigem FaceGalleryVersion.bump().
+    
+    O lock serializa só as escritas (sinais e a troca da galeria). As buscas pegam
+    um snapshot imutável da galeria e não esperam por cadastros em andamento;
+    durante uma reconstrução continuam na galeria anterior.
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._gallery = None
+        self._index = None
+        self._rows = {}  # person_id -> linha na galeria
+        self._names = {}  # person_id -> nome
+        self._version = None  # FaceGalleryVersion refletida nesta galeria
+        self._checked_at = 0.0
+        self._stale = False
+        self._changes = 0  # alterações aplicadas pelos sinais deste worker
+        self._refresher = None
+    
+    def _read(self):
+        """Montar uma galeria nova a partir do banco, sem trocá-la pela atual"""
+        # Versão lida antes das pessoas: alterações durante a carga forçam outra
+        version = FaceGalleryVersion.current()
+        gallery = FaceGallery(dtype=GALLERY_DTYPE)
+        rows = {}
+        names = {}
+        persons = (Person.objects
+                   .filter(is_active=True, face_encoding__isnull=False)
+                   .values_list('id', 'name', 'face_encoding'))
+        with gallery.batch():
+            for person_id, name, face_encoding in persons.iterator():
+                rows[person_id] = gallery.add(encoding_from_blob(face_encoding), person_id)
+                names[person_id] = name
+        index = create_index(
+            gallery,
+            getattr(settings, 'FACE_SEARCH_BACKEND', 'auto'),
+            getattr(settings, 'FACE_ANN_MIN_GALLERY_SIZE', ANN_MIN_GALLERY_SIZE),
+            scan_dtype=getattr(settings, 'FACE_SCAN_DTYPE', 'float64'),
+        )
+        return version, gallery, rows, names, index
+    
+    def _install(self, version, gallery, rows, names, index):
+        """Trocar a galeria atual pela lida em _read (com o lock)"""
+        self._gallery = gallery
+        self._rows = rows
+        self._names = names
+        self._version = version
+        self._checked_at = time.monotonic()
+        self._stale = False
+        # Publicado por último: as buscas só veem a galeria completa
+        self._index = index
+    
+    def _build(self):
+        """Montar a galeria a partir do banco e trocá-la pela atual (com o lock)"""
+        self._install(*self._read())
+    
+    def _ensure_loaded(self):
+        if self._index is None:
+            self._build()
+    
+    def _refresh(self):
+        """
+        Reconstruir em segundo plano se outro worker alterou pessoas ou há linhas
+        descartadas demais. A requisição só dispara a thread (uma por vez) e segue
+        com a galeria atual.
+        """
+        interval = getattr(settings, 'FACE_GALLERY_VERSION_CHECK_INTERVAL', 2.0)
+        if not self._stale and time.monotonic() - self._checked_at < interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._checked_at = time.monotonic()
+            self._refresher = threading.Thread(target=self._rebuild, name='face-gallery-refresh', daemon=True)
+            self._refresher.start()
+        finally:
+            self._lock.release()
+    
+    def _rebuild(self):
+        """Thread de _refresh: conferir a versão e, se mudou, ler a galeria fora do lock"""
+        try:
+            changes = self._changes
+            if not self._stale and FaceGalleryVersion.current() == self._version:
+                return
+            state = self._read()
+            version, gallery, rows, names, index = state
+            if len(gallery):
+                # Treino do IVF / cópia compacta aqui, não na primeira busca após a troca
+                index.search(np.zeros(gallery.encodings.shape[1]))
+            with self._lock:
+                self._install(*state)
+                if self._changes != changes:
+                    # Um sinal deste worker entrou durante a leitura: conferir de novo já
+                    self._checked_at = 0.0
+        except Exception as e:
+            print(f"⚠️  Erro ao reconstruir a galeria de faces: {e}")
+        finally:
+            connection.close()  # conexão aberta por esta thread
+    
+    def _loaded(self):
+        """Índice atual (com a galeria em index.gallery), carregando sob o lock se preciso"""
+        index = self._index
+        if index is None:
+            with self._lock:
+                self._ensure_loaded()
+                index = self._index
+        else:
+            self._refresh()
+            index = self._index
+        return index
+    
+    def load(self):
+        """Carregar a galeria agora (aquecimento) em vez de na primeira busca"""
+        with self._lock:
+            self._ensure_loaded()
+            if len(self._gallery):
+                # Treino do IVF / cópia compacta também fora da primeira requisição
+                self._index.search(np.zeros(self._gallery.encodings.shape[1]))
+            return len(self._gallery)
+    
+    def invalidate(self):
+        """Descartar o cache; será reconstruído na próxima busca"""
+        with self._lock:
+            self._index = None
+            self._gallery = None
+            self._rows = {}
+            self._names = {}
+            self._version = None
+    
+    def update_person(self, person, version=None):
+        """
+        Inserir, substituir ou remover a pessoa conforme o estado atual.
+        `version` é a FaceGalleryVersion gravada junto com a alteração (ver signals.py).
+        """
+        with self._lock:
+            if self._gallery is None:
+                return  # Ainda não carregado: a carga inicial já verá o estado novo
+            # Remoção e inserção publicam uma única versão nova da galeria
+            with self._gallery.batch():
+                self._discard(person.pk)
+                if person.is_active and person.face_encoding:
+                    encoding = encoding_from_blob(person.face_encoding)
+                    self._rows[person.pk] = self._gallery.add(encoding, person.pk)
+                    self._names[person.pk] = person.name
+            self._changes += 1
+            self._advance(version)
+    
+    def remove_person(self, person_id, version=None):
+        with self._lock:
+            if self._gallery is not None:
+                self._discard(person_id)
+                self._changes += 1
+                self._advance(version)
+    
+    def _advance(self, version):
+        """Acompanhar a versão só se nenhuma alteração de outro worker ficou no meio"""
+        if version is not None and self._version is not None and version == self._version + 1:
+            self._version = version
+    
+    def _discard(self, person_id):
+        """
+        Invalidar a linha da pessoa sem mover as outras (remove() trocaria o
+        layout e refaria a cópia compacta e o IVF a cada alteração). As linhas
+        descartadas saem na reconstrução, quando passam de GALLERY_REBUILD_DISCARDED_RATIO.
+        """
+        row = self._rows.pop(person_id, None)
+        self._names.pop(person_id, None)
+        if row is not None:
+            self._gallery.discard(row)
+            rows = len(self._gallery.encodings)
+            if rows - len(self._gallery) > rows * GALLERY_REBUILD_DISCARDED_RATIO:
+                self._stale = True
+    
+    def best_match(self, encoding):
+        """Retornar (person_id, nome, distância) da pessoa mais próxima"""
+        index = self._loaded()
+        snapshot = index.gallery.snapshot()
+        row, distance = index.search(encoding, snapshot)
+        if row is None:
+            return None, None, float('inf')
+        person_id = snapshot.names[row]
+        name = self._names.get(person_id)
+        if name is None:
+            return None, None, float('inf')  # removida depois do snapshot
+        return person_id, name, distance
+
+
+    def verify(self, encoding, person_id):
+        """Comparar só com o encoding da pessoa (1:1); retorna (nome, distância)"""
+        snapshot = self._loaded().gallery.snapshot()
+        row, distance = snapshot.best_match(encoding, snapshot.rows_for(person_id))
+        name = self._names.get(person_id)
+        if row is None or name is None:
+            return None, float('inf')
+        return name, distance
+
+
+person_gallery = PersonGalleryCache()
+
+
+# attendance_buffer.py
+# Pontos gravados em lote: a requisição só enfileira o registro e devolve um id
+# provisório (client_ref). Uma thread grava a fila com bulk_create quando ela
+# chega a FACE_ATTENDANCE_BATCH_SIZE ou a cada FACE_ATTENDANCE_FLUSH_INTERVAL
+# segundos. Se o banco falhar, ou a fila passar de FACE_ATTENDANCE_MAX_PENDING,
+# os registros vão para arquivos em FACE_ATTENDANCE_SPILL_DIR (no máximo
+# FACE_ATTENDANCE_MAX_SPILL_BYTES), regravados quando o banco voltar. No
+# encerramento do processo (atexit) a fila vai para o banco ou, se ele falhar,
+# para o disco. Um kill -9 perde no máximo o intervalo de gravação. Linhas
+# ilegíveis de um arquivo de espera vão para FACE_ATTENDANCE_SPILL_DIR/quarantine
+# em vez de travar a regravação.
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, connection
+from .models import Attendance
+
+# Subpasta de spill_dir com as linhas de arquivos de espera que não puderam ser lidas
+SPILL_QUARANTINE_DIR = 'quarantine'
+SPILL_RECORD_FIELDS = ('client_ref', 'person_id', 'timestamp', 'method')
+
+
+class AttendanceBufferFull(Exception):
+    """Fila e arquivos de espera cheios (banco fora do ar por muito tempo)"""
+    retry_after = 5
+
+
+class AttendanceBuffer:
+    def __init__(self, batch_size=200, flush_interval=1.0, max_pending=5000,
+                 spill_dir='attendance_spill', max_spill_bytes=64 * 1024 * 1024):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'queued': 0, 'written': 0, 'spilled': 0, 'replayed': 0, 'dropped': 0,
+                      'quarantined': 0}
+    
+    def add(self, person_id, timestamp, method='face_recognition', confidence=None):
+        """Enfileirar um ponto; retorna o id provisório (client_ref)"""
+        record = {
+            'client_ref': uuid.uuid4().hex,
+            'person_id': person_id,
+            'timestamp': timestamp.isoformat(),
+            'method': method,
+            'confidence': confidence,
+        }
+        self.start()
+        with self._lock:
+            overflow = len(self._pending) >= self.max_pending
+            if not overflow:
+                self._pending.append(record)
+                self.stats['queued'] += 1
+                if len(self._pending) >= self.batch_size:
+                    self._wake.set()
+        if overflow:
+            # Banco lento: o excedente vai direto para o disco (ou AttendanceBufferFull)
+            self._spill([record])
+        return record['client_ref']
+    
+    def start(self):
+        """Iniciar a thread de gravação (no aquecimento ou no primeiro ponto)"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name='attendance-buffer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Erro inesperado não pode matar a thread: os pontos ficariam só na fila
+                print(f"❌ Erro ao gravar pontos: {e!r}")
+    
+    def flush(self):
+        """Gravar a fila em lotes de batch_size e, com o banco respondendo, os arquivos de espera"""
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    count = min(self.batch_size, len(self._pending))
+                    batch = [self._pending.popleft() for _ in range(count)]
+                if not batch:
+                    break
+                try:
+                    written = self._write(batch)
+                except Exception:
+                    self._spill_or_requeue(batch)
+                    raise
+                if not written:
+                    self._spill_or_requeue(batch)
+                    return False
+            return self._replay_spill()
+    
+    def _write(self, batch):
+        """bulk_create do lote; False se o banco falhar (o lote continua pendente)"""
+        objs = [Attendance(client_ref=record['client_ref'],
+                           person_id=record['person_id'],
+                           timestamp=datetime.fromisoformat(record['timestamp']),
+                           method=record['method'],
+                           confidence=record['confidence'])
+                for record in batch]
+        written = len(objs)
+        try:
+            # ignore_conflicts: client_ref já gravado (lote regravado) é ignorado
+            Attendance.objects.bulk_create(objs, batch_size=self.batch_size, ignore_conflicts=True)
+        except IntegrityError:
+            # Ex.: pessoa removida depois do reconhecimento; gravar um a um e descartar o inválido
+            written = self._write_one_by_one(objs)
+        except DatabaseError as e:
+            print(f"⚠️  Falha ao gravar {len(batch)} pontos: {e}")
+            connection.close()
+            return False
+        finally:
+            close_old_connections()
+        self.stats['written'] += written
+        return True
+    
+    def _write_one_by_one(self, objs):
+        written = 0
+        for obj in objs:
+            try:
+                Attendance.objects.bulk_create([obj], ignore_conflicts=True)
+                written += 1
+            except IntegrityError as e:
+                self.stats['dropped'] += 1
+                print(f"❌ Ponto {obj.client_ref} descartado: {e}")
+        return written
+    
+    def spill_bytes(self):
+        """Tamanho dos arquivos de espera (compartilhados por todos os workers)"""
+        try:
+            return sum(entry.stat().st_size for entry in os.scandir(self.spill_dir) if entry.is_file())
+        except FileNotFoundError:
+            return 0
+    
+    def _spill(self, batch, bounded=True):
+        """Gravar o lote em um arquivo novo (fsync + rename atômico)"""
+        data = ''.join(json.dumps(record) + '\n' for record in batch).encode('utf-8')
+        with self._spill_lock:
+            if bounded and self.spill_bytes() + len(data) > self.max_spill_bytes:
+                raise AttendanceBufferFull()
+            path = os.path.join(self.spill_dir, f"{time.time_ns()}-{os.getpid()}.jsonl")
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+        self.stats['spilled'] += len(batch)
+    
+    def _spill_or_requeue(self, batch):
+        """Banco fora: lote para o disco; com o disco cheio, de volta ao início da fila"""
+        try:
+            self._spill(batch)
+        except (AttendanceBufferFull, OSError):
+            with self._lock:
+                self._pending.extendleft(reversed(batch))
+    
+    def _replay_spill(self):
+        """Regravar os arquivos de espera, do mais antigo ao mais novo"""
+        for name in sorted(os.listdir(self.spill_dir)):
+            if not name.endswith('.jsonl'):
+                continue
+            path = os.path.join(self.spill_dir, name)
+            try:
+                with open(path, 'rb') as f:
+                    lines = [line for line in f if line.strip()]
+            except FileNotFoundError:
+                continue  # outro worker já regravou
+            batch, bad_lines = [], []
+            for line in lines:
+                try:
+                    batch.append(self._parse_spill_line(line))
+                except (ValueError, TypeError, KeyError):
+                    bad_lines.append(line)
+            if batch and not self._write(batch):
+                return False
+            if bad_lines:
+                self._quarantine(name, bad_lines)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.stats['replayed'] += len(batch)
+        return True
+    
+    @staticmethod
+    def _parse_spill_line(line):
+        """Registro de uma linha do arquivo de espera; ValueError/TypeError/KeyError se ilegível"""
+        record = json.loads(line.decode('utf-8'))
+        for field in SPILL_RECORD_FIELDS:
+            if record[field] is None:
+                raise ValueError(f"campo {field} vazio")
+        datetime.fromisoformat(record['timestamp'])
+        record.setdefault('confidence', None)
+        return record
+    
+    def _quarantine(self, name, lines):
+        """Guardar as linhas ilegíveis para análise manual (não são regravadas)"""
+        quarantine_dir = os.path.join(self.spill_dir, SPILL_QUARANTINE_DIR)
+        os.makedirs(quarantine_dir, exist_ok=True)
+        with open(os.path.join(quarantine_dir, name), 'ab') as f:
+            for line in lines:
+                f.write(line if line.endswith(b'\n') else line + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats['quarantined'] += len(lines)
+        print(f"⚠️  {len(lines)} linhas ilegíveis de {name} movidas para {quarantine_dir}")
+    
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+    
+    def close(self):
+        """Encerramento: parar a thread e gravar a fila (no banco ou, se falhar, em disco)"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+                self._pending.clear()
+            if batch and not self._write(batch):
+                self._spill(batch, bounded=False)  # durabilidade acima do limite
+                print(f"💾 {len(batch)} pontos salvos em {self.spill_dir} para gravar na próxima subida")
+
+
+attendance_buffer = AttendanceBuffer(
+    batch_size=getattr(settings, 'FACE_ATTENDANCE_BATCH_SIZE', 200),
+    flush_interval=getattr(settings, 'FACE_ATTENDANCE_FLUSH_INTERVAL', 1.0),
+    max_pending=getattr(settings, 'FACE_ATTENDANCE_MAX_PENDING', 5000),
+    spill_dir=getattr(settings, 'FACE_ATTENDANCE_SPILL_DIR', 'attendance_spill'),
+    max_spill_bytes=getattr(settings, 'FACE_ATTENDANCE_MAX_SPILL_BYTES', 64 * 1024 * 1024),
+)
+
+
+# warmup.py
+# Aquecimento explícito do worker: importa o face_recognition (modelos do dlib),
+# roda detector e encoder uma vez e carrega a galeria. Iniciado pelo wsgi.py, e
+# não pelo AppConfig.ready(), para não rodar em migrate/shell.
+import threading
+import time
+import numpy as np
+
+_state = {'status': 'WARMING_UP', 'ready': False, 'warm_up_seconds': None, 'error': None}
+_started = False
+_start_lock = threading.Lock()
+
+
+def warm_up():
+    import face_recognition
+    from .gallery import person_gallery
+    from .views import detector_cascade
+    from .attendance_buffer import attendance_buffer
+    
+    # Pontos que ficaram em disco (banco fora do ar, encerramento) são regravados já
+    attendance_buffer.start()
+    
+    started = time.perf_counter()
+    try:
+        blank = np.zeros((160, 160, 3), dtype=np.uint8)
+        detector_cascade.detect(blank)  # sem faces: todos os detectores carregam
+        face_recognition.face_encodings(blank, [(5, 155, 155, 5)])
+        persons = person_gallery.load()
+    except Exception as e:
+        _state.update(status='FAILED', error=str(e))
+        print(f"❌ Erro no aquecimento: {e}")
+        return False
+    
+    _state.update(status='READY', ready=True, warm_up_seconds=round(time.perf_counter() - started, 3))
+    print(f"🔥 Pronto em {_state['warm_up_seconds']:.2f}s ({persons} pessoas na galeria)")
+    return True
+
+
+def start_warm_up():
+    """Executar warm_up() em segundo plano, uma vez por processo"""
+    global _started
+    with _start_lock:
+        if not _started:
+            _started = True
+            threading.Thread(target=warm_up, name='face-warm-up', daemon=True).start()
+
+
+def readiness():
+    return dict(_state)
+
+
+# migrations/0002_compact_face_encodings.py
+# Converte os blobs float64 existentes para float32 (metade do tamanho, mesmos
+# valores). Os dois formatos são lidos durante a migração, então ela pode rodar
+# com o sistema no ar; a reversão volta para float64.
+import numpy as np
+from django.db import migrations
+from ..face_quantization import encoding_from_blob, encoding_to_blob
+
+MIGRATION_BATCH_SIZE = 500
+
+def convert_face_encodings(apps, dtype):
+    Person = apps.get_model('your_app_name', 'Person')
+    blob_size = 128 * np.dtype(dtype).itemsize
+    batch = []
+    persons = Person.objects.filter(face_encoding__isnull=False).only('id', 'face_encoding')
+    for person in persons.iterator(chunk_size=MIGRATION_BATCH_SIZE):
+        blob = bytes(person.face_encoding)
+        if len(blob) == blob_size:
+            continue
+        person.face_encoding = encoding_to_blob(encoding_from_blob(blob), dtype)
+        batch.append(person)
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            Person.objects.bulk_update(batch, ['face_encoding'])
+            batch = []
+    if batch:
+        Person.objects.bulk_update(batch, ['face_encoding'])
+
+def compact_face_encodings(apps, schema_editor):
+    convert_face_encodings(apps, np.float32)
+
+def expand_face_encodings(apps, schema_editor):
+    convert_face_encodings(apps, np.float64)
+
+class Migration(migrations.Migration):
+    dependencies = [('your_app_name', '0001_initial')]
+    operations = [migrations.RunPython(compact_face_encodings, expand_face_encodings)]
+
+
+# migrations/0003_attendance_client_ref.py
+# Id provisório dos pontos gravados em lote (ver attendance_buffer.py)
+from django.db import migrations, models
+
+class Migration(migrations.Migration):
+    dependencies = [('your_app_name', '0002_compact_face_encodings')]
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='client_ref',
+            field=models.UUIDField(null=True, blank=True, unique=True, editable=False),
+        ),
+    ]
+
+
+# migrations/0004_face_gallery_version.py
+# Versão da galeria compartilhada pelos workers (ver gallery.py e signals.py)
+from django.db import migrations, models
+
+def create_gallery_version(apps, schema_editor):
+    apps.get_model('your_app_name', 'FaceGalleryVersion').objects.get_or_create(pk=1)
+
+class Migration(migrations.Migration):
+    dependencies = [('your_app_name', '0003_attendance_client_ref')]
+    operations = [
+        migrations.CreateModel(
+            name='FaceGalleryVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_gallery_version, migrations.RunPython.noop),
+    ]
+
+
+# signals.py
+# A versão é incrementada dentro da transação do save/delete; a galeria do
+# processo só muda no commit (um save desfeito não deixa uma pessoa fantasma).
+# Saves que não mudam Person.GALLERY_FIELDS (e-mail, foto, ...) não tocam a galeria.
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Person, FaceGalleryVersion
+from .gallery import person_gallery
+
+def gallery_changed(instance, created, update_fields):
+    """O save mudou o que a galeria lê? Sem o estado anterior, considera que sim"""
+    if update_fields is not None:
+        saved = set(update_fields) & set(Person.GALLERY_FIELDS)
+        # Save parcial: o estado em memória pode ter campos não gravados
+        instance._gallery_state = None
+        return bool(saved)
+    previous = getattr(instance, '_gallery_state', None)
+    state = instance._gallery_state = instance.gallery_state()
+    if created:
+        return bool(instance.is_active and instance.face_encoding)
+    return state is None or state != previous
+
+@receiver(post_save, sender=Person)
+def update_person_gallery(sender, instance, created, update_fields=None, **kwargs):
+    if not gallery_changed(instance, created, update_fields):
+        return
+    version = FaceGalleryVersion.bump()
+    transaction.on_commit(partial(person_gallery.update_person, instance, version))
+
+@receiver(post_delete, sender=Person)
+def remove_from_person_gallery(sender, instance, **kwargs):
+    version = FaceGalleryVersion.bump()
+    transaction.on_commit(partial(person_gallery.remove_person, instance.pk, version))
+
+
+# apps.py
+from django.apps import AppConfig
+
+class YourAppConfig(AppConfig):
+    name = 'your_app_name'
+    
+    def ready(self):
+        from . import signals  # noqa: F401  (registrar os sinais da galeria)
+
+
 # serializers.py
 from rest_framework import serializers
 from .models import Person, Attendance
@@ -200,13 +999,26 @@ class AttendanceSerializer(serializers.ModelSerializer):
 
 # urls.py
 from django.urls import path
-from .views import FaceRecognitionAPIView
+from .views import FaceRecognitionAPIView, ReadinessAPIView
 
 urlpatterns = [
     path('api/face-recognition/', FaceRecognitionAPIView.as_view(), name='face-recognition'),
+    path('api/ready/', ReadinessAPIView.as_view(), name='ready'),
 ]
 
 
+# wsgi.py (do projeto)
+import os
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'your_project.settings')
+application = get_wsgi_application()
+
+# Modelos e galeria em segundo plano; /api/ready/ responde 200 quando terminar
+from your_app_name.warmup import start_warm_up
+start_warm_up()
+
+
 # settings.py (configurações adicionais)
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -251,6 +1063,30 @@ DATABASES = {
     }
 }
 
+# Busca na galeria de faces: 'exact', 'ivf' (aproximado) ou 'auto'
+# ('auto' usa o IVF a partir de FACE_ANN_MIN_GALLERY_SIZE encodings)
+FACE_SEARCH_BACKEND = 'auto'
+FACE_ANN_MIN_GALLERY_SIZE = 20000
+# Representação lida na varredura ('float64', 'float32', 'float16' ou 'int8'). A
+# galeria já é float32: 'float16'/'int8' mantêm uma cópia compacta ao lado dela e
+# comparam de novo as melhores candidatas na galeria
+FACE_SCAN_DTYPE = 'float32'
+# Detectores em cascata, do mais barato ao mais caro ('opencv', 'hog:0', 'hog', 'cnn')
+FACE_DETECTORS = 'hog:0,hog'
+
+# Intervalo (segundos) entre as consultas à FaceGalleryVersion: alterações de
+# pessoas feitas em outro worker aparecem na galeria deste em até esse tempo
+# (mais a reconstrução, feita em segundo plano)
+FACE_GALLERY_VERSION_CHECK_INTERVAL = 2.0
+
+# Pontos gravados em lote (attendance_buffer.py); False grava cada ponto na requisição
+FACE_ATTENDANCE_BUFFERED = True
+FACE_ATTENDANCE_BATCH_SIZE = 200
+FACE_ATTENDANCE_FLUSH_INTERVAL = 1.0  # segundos
+FACE_ATTENDANCE_MAX_PENDING = 5000  # em memória; o excedente vai para o disco
+FACE_ATTENDANCE_SPILL_DIR = 'attendance_spill'
+FACE_ATTENDANCE_MAX_SPILL_BYTES = 64 * 1024 * 1024
+
 # Configurações do Google Cloud Storage
 DEFAULT_FILE_STORAGE = 'storages.backends.gcloud.GoogleCloudStorage'
 GS_BUCKET_NAME = 'your-bucket-name'
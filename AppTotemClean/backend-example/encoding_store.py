@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+Armazenamento append-only dos encodings faciais
+
+Formato do diretório (ex.: face_store/):
+    manifest.json          ponto de commit: geração dos arquivos, linhas e removidas
+    encodings-<g>.bin      blocos float64 de tamanho fixo (128 valores por linha)
+    names-<g>.jsonl        nome de cada linha, um JSON por linha ("nome" ou
+                           {"name": ..., "id": ...} quando a pessoa tem identificador)
+    deleted-<g>.bin        linhas removidas (uint64), na ordem das remoções
+    commit.counter         contador de commits (uint64) mapeado em memória
+    .lock                  lock de escrita entre processos
+
+Cada cadastro é um append O(1) nos arquivos seguido da regravação atômica
+(tmp + os.replace) do manifest, que tem tamanho fixo: ele só guarda quantas
+linhas e quantas remoções valem. Linhas e remoções além das registradas no
+manifest (gravação interrompida) são descartadas ao abrir. Ao ler um commit só
+o que veio depois do anterior é lido, e as listas de nomes, identificadores e
+removidas crescem no lugar (só são trocadas em uma geração nova), então quem as
+compartilha (SharedFaceGallery) lê até o tamanho que conhece. A leitura dos
+encodings é um np.memmap, então a inicialização não desserializa nada.
+Remoções só marcam a linha; compact() regrava as linhas vivas em uma nova
+geração de arquivos quando a fração removida passa de COMPACT_DELETED_RATIO.
+
+Vários processos podem abrir o mesmo diretório: as escritas são serializadas
+por flock e cada commit incrementa o contador compartilhado, que os leitores
+consultam (uma leitura de memória) para saber quando chamar refresh().
+"""
+
+import json
+import os
+import pickle
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock entre processos (servidor de um processo só)
+    fcntl = None
+
+ENCODING_SIZE = 128
+ENCODING_DTYPE = np.dtype(np.float64)
+ROW_BYTES = ENCODING_SIZE * ENCODING_DTYPE.itemsize
+TOMBSTONE_DTYPE = np.dtype('<u8')
+MANIFEST_FILE = "manifest.json"
+COUNTER_FILE = "commit.counter"
+LOCK_FILE = ".lock"
+FORMAT_VERSION = 3
+# Versão 1: linhas de nomes sem identificador; versões 1 e 2: removidas listadas
+# no manifest (migradas para deleted-<g>.bin ao abrir)
+SUPPORTED_VERSIONS = (1, 2, 3)
+COMPACT_DELETED_RATIO = 0.25
+REFRESH_RETRIES = 3
+
+
+def _fsync_dir(path):
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _atomic_write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(os.path.abspath(path)))
+
+
+class EncodingStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self.generation = 0  # geração dos arquivos (muda em rewrite/compact)
+        self.rows = 0
+        self.names = []
+        self.ids = []  # identificador da pessoa de cada linha (None se não informado)
+        self.tombstones = []  # linhas removidas, na ordem das remoções
+        self._deleted = set()
+        self._names_offset = 0
+        self._manifest_version = FORMAT_VERSION
+        self._seen_counter = None
+        self._lock_depth = 0
+        os.makedirs(directory, exist_ok=True)
+        with self._locked():
+            self._counter = self._open_counter()
+            self._open()
+        self._seen_counter = self.commit_counter
+
+    # Caminhos ----------------------------------------------------------------
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def manifest_path(self):
+        return self._path(MANIFEST_FILE)
+
+    def encodings_path(self, generation=None):
+        return self._path(f"encodings-{self.generation if generation is None else generation}.bin")
+
+    def names_path(self, generation=None):
+        return self._path(f"names-{self.generation if generation is None else generation}.jsonl")
+
+    def deleted_path(self, generation=None):
+        return self._path(f"deleted-{self.generation if generation is None else generation}.bin")
+
+    # Lock e contador entre processos -----------------------------------------
+
+    @contextmanager
+    def _locked(self):
+        """Lock de escrita reentrante: RLock entre threads + flock entre processos"""
+        with self._lock:
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self._path(LOCK_FILE), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def locked(self):
+        """
+        Lock de escrita do store (reentrante), para quem decide o que gravar a
+        partir do que leu (ex.: a linha a substituir): nenhum outro processo
+        grava entre a leitura e a escrita.
+        """
+        return self._locked()
+
+    def _open_counter(self):
+        path = self._path(COUNTER_FILE)
+        if not os.path.exists(path) or os.path.getsize(path) < 8:
+            with open(path, 'wb') as f:
+                f.write(b'\0' * 8)
+        return np.memmap(path, dtype=np.uint64, mode='r+', shape=(1,))
+
+    @property
+    def commit_counter(self):
+        """Número de commits feitos por qualquer processo (leitura de memória compartilhada)"""
+        return int(self._counter[0])
+
+    @property
+    def seen_counter(self):
+        """Contador do último commit refletido no estado em memória deste processo"""
+        return self._seen_counter
+
+    # Abertura / commit -------------------------------------------------------
+
+    def _open(self):
+        if os.path.exists(self.manifest_path):
+            self._load_manifest()
+            if self._manifest_version < FORMAT_VERSION:
+                # Removidas do manifest antigo vão para o arquivo append-only
+                with open(self.deleted_path(), 'wb') as f:
+                    f.write(np.asarray(self.tombstones, dtype=TOMBSTONE_DTYPE).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._commit()
+        else:
+            self._write_files(self.generation, np.empty((0, ENCODING_SIZE)), [], [])
+            self._commit()
+
+        # Descartar o que foi gravado depois do último commit
+        with open(self.encodings_path(), 'r+b') as f:
+            f.truncate(self.rows * ROW_BYTES)
+        with open(self.names_path(), 'r+b') as f:
+            f.truncate(self._names_offset)
+        with open(self.deleted_path(), 'r+b') as f:
+            f.truncate(len(self.tombstones) * TOMBSTONE_DTYPE.itemsize)
+
+    def _load_manifest(self):
+        """Sincronizar o estado em memória com o último commit (de qualquer processo)"""
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Versão de store não suportada: {manifest.get('version')}")
+
+        generation, rows = manifest['generation'], manifest['rows']
+        # Mesma geração: ler só as linhas e remoções novas e acrescentá-las no lugar
+        same_generation = generation == self.generation and rows >= len(self.names)
+        known_rows = len(self.names) if same_generation else 0
+        offset = self._names_offset if same_generation else 0
+
+        names, ids = [], []
+        with open(self.names_path(generation), 'rb') as f:
+            f.seek(offset)
+            for _ in range(rows - known_rows):
+                name, person_id = self._decode_name(f.readline())
+                names.append(name)
+                ids.append(person_id)
+            offset = f.tell()
+
+        if 'tombstones' in manifest:
+            count = manifest['tombstones']
+            known_tombstones = len(self.tombstones) if same_generation and count >= len(self.tombstones) else 0
+            with open(self.deleted_path(generation), 'rb') as f:
+                f.seek(known_tombstones * TOMBSTONE_DTYPE.itemsize)
+                data = f.read((count - known_tombstones) * TOMBSTONE_DTYPE.itemsize)
+            tombstones = np.frombuffer(data, dtype=TOMBSTONE_DTYPE).tolist()
+        else:
+            known_tombstones = 0
+            tombstones = list(manifest.get('deleted', []))
+
+        if not same_generation:
+            self.names, self.ids = [], []
+        if not known_tombstones:
+            self.tombstones, self._deleted = [], set()
+        self.generation = generation
+        self.names.extend(names)
+        self.ids.extend(ids)
+        self.tombstones.extend(tombstones)
+        self._deleted.update(tombstones)
+        self.rows = rows
+        self._names_offset = offset
+        self._manifest_version = manifest['version']
+
+    def refresh(self):
+        """Recarregar o manifest se outro processo fez commit; retorna True se mudou"""
+        counter = self.commit_counter
+        if counter == self._seen_counter:
+            return False
+        with self._lock:
+            for attempt in range(REFRESH_RETRIES):
+                try:
+                    self._load_manifest()
+                    break
+                except FileNotFoundError:
+                    # Uma compactação trocou os arquivos entre a leitura do manifest e a dos nomes
+                    if attempt == REFRESH_RETRIES - 1:
+                        raise
+            self._seen_counter = counter
+        return True
+
+    def _commit(self):
+        _atomic_write_json(self.manifest_path, {
+            'version': FORMAT_VERSION,
+            'dtype': ENCODING_DTYPE.name,
+            'dim': ENCODING_SIZE,
+            'generation': self.generation,
+            'rows': self.rows,
+            'tombstones': len(self.tombstones),
+        })
+        self._manifest_version = FORMAT_VERSION
+        self._counter[0] += 1
+        self._seen_counter = self.commit_counter
+
+    def _write_files(self, generation, encodings, names, ids):
+        with open(self.encodings_path(generation), 'wb') as f:
+            f.write(np.ascontiguousarray(encodings, dtype=ENCODING_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.names_path(generation), 'wb') as f:
+            for name, person_id in zip(names, ids):
+                f.write(self._encode_name(name, person_id))
+            f.flush()
+            os.fsync(f.fileno())
+            names_offset = f.tell()
+        with open(self.deleted_path(generation), 'wb') as f:
+            os.fsync(f.fileno())
+        return names_offset
+
+    @staticmethod
+    def _encode_name(name, person_id=None):
+        record = name if person_id is None else {'name': name, 'id': person_id}
+        return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+    @staticmethod
+    def _decode_name(line):
+        """Retorna (nome, identificador) de uma linha do arquivo de nomes"""
+        record = json.loads(line)
+        if isinstance(record, dict):
+            return record['name'], record.get('id')
+        return record, None
+
+    # Leitura -----------------------------------------------------------------
+
+    def __len__(self):
+        return self.rows - len(self.tombstones)
+
+    @property
+    def deleted(self):
+        """Conjunto das linhas removidas (cópia: para acompanhar as remoções use `tombstones`)"""
+        return frozenset(self._deleted)
+
+    @property
+    def deleted_ratio(self):
+        return len(self.tombstones) / self.rows if self.rows else 0.0
+
+    def encodings(self):
+        """Mapeamento em memória (somente leitura) de todas as linhas commitadas"""
+        if not self.rows:
+            return np.empty((0, ENCODING_SIZE), dtype=ENCODING_DTYPE)
+        return np.memmap(self.encodings_path(), dtype=ENCODING_DTYPE, mode='r',
+                         shape=(self.rows, ENCODING_SIZE))
+
+    def view(self):
+        """
+        Estado de um mesmo commit, para quem acompanha o store sem copiá-lo:
+        (geração, linhas, encodings, nomes, identificadores, removidas, quantas
+        removidas). As listas são as do store, que só crescem até a próxima
+        geração: leia os nomes até `linhas` e as removidas até a quantidade.
+        """
+        with self._lock:
+            return (self.generation, self.rows, self.encodings(), self.names, self.ids,
+                    self.tombstones, len(self.tombstones))
+
+    def live(self):
+        """Retornar (encodings, nomes, identificadores) das linhas não removidas"""
+        encodings = self.encodings()
+        if not self._deleted:
+            return encodings, list(self.names), list(self.ids)
+        keep = np.ones(self.rows, dtype=bool)
+        keep[sorted(self._deleted)] = False
+        return (encodings[keep],
+                [name for name, kept in zip(self.names, keep) if kept],
+                [person_id for person_id, kept in zip(self.ids, keep) if kept])
+
+    # Escrita -----------------------------------------------------------------
+
+    def append(self, encoding, name, person_id=None):
+        """Adicionar uma linha (O(1)) e retornar o índice dela no store"""
+        return self.append_many([encoding], [name], [person_id])[0]
+
+    def append_many(self, encodings, names, ids=None):
+        """Adicionar várias linhas com um único commit"""
+        encodings = np.asarray(encodings, dtype=ENCODING_DTYPE).reshape(-1, ENCODING_SIZE)
+        ids = [None] * len(names) if ids is None else list(ids)
+        if not len(encodings) == len(names) == len(ids):
+            raise ValueError("Quantidade de encodings e nomes não confere")
+        if not len(encodings):
+            return []
+
+        with self._locked():
+            self._load_manifest()
+            start = self.rows
+            self._write_rows(encodings, names, ids)
+            self._commit()
+            return list(range(start, self.rows))
+
+    def _write_rows(self, encodings, names, ids):
+        """
+        Gravar linhas logo após a última linha commitada da geração atual (sem
+        commit). O que houver depois dela (gravação de um processo que caiu, ou
+        uma falha entre os dois arquivos) é descartado antes, para que as linhas
+        novas não fiquem desalinhadas com os nomes.
+        """
+        with open(self.encodings_path(), 'r+b') as f:
+            f.truncate(self.rows * ROW_BYTES)
+            f.seek(self.rows * ROW_BYTES)
+            f.write(np.ascontiguousarray(encodings, dtype=ENCODING_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.names_path(), 'r+b') as f:
+            f.truncate(self._names_offset)
+            f.seek(self._names_offset)
+            for name, person_id in zip(names, ids):
+                f.write(self._encode_name(name, person_id))
+            f.flush()
+            os.fsync(f.fileno())
+            names_offset = f.tell()
+
+        self._names_offset = names_offset
+
+        self.rows += len(encodings)
+        self.names.extend(names)
+        self.ids.extend(ids)
+
+    def _write_tombstone(self, row):
+        """Acrescentar a remoção de `row` ao arquivo de removidas (sem commit)"""
+        with open(self.deleted_path(), 'r+b') as f:
+            f.truncate(len(self.tombstones) * TOMBSTONE_DTYPE.itemsize)
+            f.seek(len(self.tombstones) * TOMBSTONE_DTYPE.itemsize)
+            f.write(np.asarray([row], dtype=TOMBSTONE_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self.tombstones.append(row)
+        self._deleted.add(row)
+
+    def replace(self, row, encoding, name, person_id=None):
+        """
+        Substituir uma linha em um único commit: a nova vai para o fim e a antiga
+        é marcada como removida. Retorna o índice da nova linha; se a remoção
+        disparou uma compactação, os índices mudam (ver `generation`).
+        """
+        encoding = np.asarray(encoding, dtype=ENCODING_DTYPE).reshape(1, ENCODING_SIZE)
+        with self._locked():
+            self._load_manifest()
+            if not 0 <= row < self.rows or row in self._deleted:
+                raise IndexError(row)
+            new_row = self.rows
+            self._write_rows(encoding, [name], [person_id])
+            self._write_tombstone(row)
+            self._commit()
+            if self.deleted_ratio > COMPACT_DELETED_RATIO:
+                self._compact()
+            return new_row
+
+    def delete(self, row):
+        """Marcar uma linha como removida; compacta se houver muitas removidas"""
+        with self._locked():
+            self._load_manifest()
+            if not 0 <= row < self.rows:
+                raise IndexError(row)
+            if row in self._deleted:
+                return
+            self._write_tombstone(row)
+            self._commit()
+            if self.deleted_ratio > COMPACT_DELETED_RATIO:
+                self._compact()
+
+    def rewrite(self, encodings, names, ids=None):
+        """Substituir todo o conteúdo do store em uma nova geração de arquivos"""
+        ids = [None] * len(names) if ids is None else list(ids)
+        with self._locked():
+            self._load_manifest()
+            self._swap_generation(encodings, names, ids)
+
+    def compact(self):
+        """Regravar apenas as linhas vivas em uma nova geração de arquivos"""
+        with self._locked():
+            self._load_manifest()
+            self._compact()
+
+    def _compact(self):
+        if not self._deleted:
+            return
+        encodings, names, ids = self.live()
+        self._swap_generation(np.array(encodings), names, ids)
+
+    def reset(self):
+        """Apagar todos os encodings"""
+        self.rewrite(np.empty((0, ENCODING_SIZE)), [])
+
+    def _swap_generation(self, encodings, names, ids):
+        old_generation = self.generation
+        new_generation = old_generation + 1
+        names_offset = self._write_files(new_generation, encodings, names, ids)
+
+        self.generation = new_generation
+        self.rows = len(names)
+        self.names = list(names)
+        self.ids = list(ids)
+        self.tombstones = []
+        self._deleted = set()
+        self._names_offset = names_offset
+        self._commit()
+
+        # Processos que ainda mapeiam os arquivos antigos continuam lendo até remapear
+        for path in (self.encodings_path(old_generation), self.names_path(old_generation),
+                     self.deleted_path(old_generation)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Migração ----------------------------------------------------------------
+
+    def import_pickle(self, pickle_path):
+        """
+        Importar o antigo face_encodings.pkl para um store vazio e renomeá-lo
+        para .migrated. Retorna quantas faces foram importadas (0 se não havia
+        o que migrar ou se outro processo já migrou).
+        """
+        with self._locked():
+            self._load_manifest()
+            if self.rows or not os.path.exists(pickle_path):
+                return 0
+            with open(pickle_path, 'rb') as f:
+                data = pickle.load(f)
+            self.append_many(data['encodings'], list(data['names']))
+            os.replace(pickle_path, f"{pickle_path}.migrated")
+            return len(data['names'])
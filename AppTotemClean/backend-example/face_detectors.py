@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Detectores de face configuráveis, em cascata
+
+FACE_DETECTORS lista os detectores do mais barato ao mais caro; o próximo só
+roda quando os anteriores não encontraram nenhuma face:
+
+    opencv   Haar cascade frontal do OpenCV: o mais barato, menos preciso
+             (requer opencv-python 4.x; o OpenCV 5 não inclui as Haar cascades)
+    hog      HOG do dlib (padrão do face_recognition)
+    cnn      CNN (MMOD) do dlib: mais robusto a pose/iluminação, muito lento sem GPU
+
+Em uma imagem 640x480 (CPU, 1 thread): opencv ~70 ms, hog:0 ~100 ms,
+hog:1 ~380 ms, cnn:0 ~900 ms.
+
+Cada detector aceita ":<ampliações>" (ex.: "hog:0,cnn:1"): quantas vezes o dlib
+amplia a imagem antes de detectar. Com a imagem já reduzida pelo face_pipeline e
+uma face grande e frontal (o caso típico do totem), "hog:0" basta e é ~4x mais
+rápido que o padrão (1); a ampliação só ajuda com faces pequenas. Uma cascata
+como "hog:0,hog:1" só paga a ampliação nos quadros em que a face é pequena.
+
+A cascata registra no StageTimer o tempo de cada detector (etapa detect_<nome>)
+e se ele encontrou faces (timer.detections), que o metrics.py exporta. O nome
+inclui a ampliação quando ela não é a padrão: "hog:0" aparece como hog0.
+"""
+
+import os
+import threading
+import time
+
+# Cascata padrão: o mesmo HOG com 1 ampliação usado antes da cascata
+DETECTORS = os.environ.get('FACE_DETECTORS', 'hog')
+DEFAULT_UPSAMPLE = 1
+# Haar: menor face aceita como fração do menor lado da imagem (descarta falsos positivos pequenos)
+OPENCV_MIN_FACE_FRACTION = 0.15
+OPENCV_SCALE_FACTOR = 1.1
+OPENCV_MIN_NEIGHBORS = 5
+
+
+class DlibDetector:
+    """HOG ou CNN do dlib, via face_recognition.face_locations"""
+
+    def __init__(self, model, upsample=DEFAULT_UPSAMPLE):
+        self.model = model
+        self.upsample = upsample
+        # 'hog' com a ampliação padrão; 'hog0', 'hog2'... com outras
+        self.name = model if upsample == DEFAULT_UPSAMPLE else f"{model}{upsample}"
+
+    def detect(self, image_array):
+        import face_recognition
+
+        return face_recognition.face_locations(image_array, self.upsample, self.model)
+
+
+class OpenCVDetector:
+    """Haar cascade frontal do OpenCV; cv2 só é importado no primeiro uso"""
+
+    name = 'opencv'
+
+    def __init__(self):
+        # CascadeClassifier não é seguro para chamadas simultâneas: um por thread
+        self._local = threading.local()
+
+    def _classifier(self):
+        classifier = getattr(self._local, 'classifier', None)
+        if classifier is None:
+            import cv2
+
+            if not hasattr(cv2, 'CascadeClassifier'):
+                raise RuntimeError(f"OpenCV {cv2.__version__} sem Haar cascades; instale opencv-python<5")
+            path = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+            classifier = self._local.classifier = cv2.CascadeClassifier(path)
+        return classifier
+
+    def detect(self, image_array):
+        import cv2
+
+        gray = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
+        min_face = max(1, int(min(gray.shape) * OPENCV_MIN_FACE_FRACTION))
+        boxes = self._classifier().detectMultiScale(
+            gray, scaleFactor=OPENCV_SCALE_FACTOR, minNeighbors=OPENCV_MIN_NEIGHBORS,
+            minSize=(min_face, min_face))
+        # (x, y, largura, altura) -> (top, right, bottom, left) do face_recognition
+        return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in boxes]
+
+
+DETECTOR_NAMES = ('hog', 'cnn', 'opencv')
+
+
+def create_detector(spec):
+    """'hog', 'hog:0', 'cnn:1', 'opencv' -> detector"""
+    name, _, upsample = spec.strip().lower().partition(':')
+    if name not in DETECTOR_NAMES:
+        raise ValueError(f"Detector inválido: {name} (use {', '.join(DETECTOR_NAMES)})")
+    if upsample and not upsample.isdigit():
+        raise ValueError(f"Ampliações inválidas para o detector {name}: {upsample}")
+    if name == 'opencv':
+        if upsample:
+            raise ValueError("O detector opencv não usa ampliações (use 'opencv')")
+        return OpenCVDetector()
+    return DlibDetector(name, int(upsample) if upsample else DEFAULT_UPSAMPLE)
+
+
+class DetectorCascade:
+    def __init__(self, detectors):
+        if not detectors:
+            raise ValueError("A cascata precisa de pelo menos um detector")
+        names = [detector.name for detector in detectors]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Detector repetido na cascata: {', '.join(names)}")
+        self.detectors = detectors
+
+    @property
+    def names(self):
+        return [detector.name for detector in self.detectors]
+
+    def detect(self, image_array, timer=None):
+        """Caixas do primeiro detector que encontrar faces ([] se nenhum encontrar)"""
+        for detector in self.detectors:
+            start = time.perf_counter()
+            locations = detector.detect(image_array)
+            if timer is not None:
+                timer.record(f'detect_{detector.name}', (time.perf_counter() - start) * 1000)
+                timer.detections.append((detector.name, bool(locations)))
+            if locations:
+                return locations
+        return []
+
+
+def create_cascade(specs=DETECTORS):
+    """Cascata a partir de 'opencv,hog:0,cnn' (lista separada por vírgulas)"""
+    return DetectorCascade([create_detector(spec) for spec in specs.split(',') if spec.strip()])
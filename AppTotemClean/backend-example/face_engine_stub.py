@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Substituto determinístico do face_recognition para benchmarks sem dlib
+
+Imagens sintéticas (synthetic_image) carregam a identidade e a variação da
+foto em pixels do centro da face; face_encodings lê esses pixels e devolve
+sempre o mesmo encoding para a mesma imagem:
+
+- variação 0 é a foto de cadastro: exatamente identity_encoding(identidade);
+- variações > 0 são outras fotos da mesma pessoa, a ~0.35 do cadastro;
+- identidades fora da galeria ficam a ~1.0 de todas (pessoas desconhecidas).
+
+O resto da imagem é ruído da (identidade, variação), então cada foto tem
+bytes diferentes (e outra chave no cache de quadros). install() registra o módulo como face_recognition
+em sys.modules; deve ser chamado antes de importar face_pipeline/face_system.
+"""
+
+import io
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+ENCODING_SIZE = 128
+# Mesma calibração de benchmark_ann.py: ~1.0 entre pessoas diferentes e ~0.35
+# entre fotos da mesma pessoa
+IDENTITY_STD = 0.0625
+PHOTO_NOISE_STD = 0.031
+MEAN_OFFSET_STD = 0.05
+IMAGE_SIZE = 160
+# Tempo simulado da detecção (ms), para aproximar o custo do HOG quando desejado
+detect_ms = 0.0
+
+_mean = np.random.default_rng(0).normal(0.0, MEAN_OFFSET_STD, ENCODING_SIZE)
+
+
+def identity_encoding(identity, variant=0):
+    """Encoding da foto `variant` da pessoa `identity`"""
+    encoding = _mean + np.random.default_rng([1, identity]).normal(0.0, IDENTITY_STD, ENCODING_SIZE)
+    if variant:
+        encoding = encoding + np.random.default_rng([2, identity, variant]).normal(0.0, PHOTO_NOISE_STD, ENCODING_SIZE)
+    return encoding
+
+
+def identity_encodings(start, stop):
+    """Encodings de cadastro das identidades [start, stop) (N x 128)"""
+    return np.array([identity_encoding(identity) for identity in range(start, stop)])
+
+
+def _color(value):
+    return ((value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF)
+
+
+def _value(pixel):
+    red, green, blue = (int(channel) for channel in pixel[:3])
+    return (red << 16) | (green << 8) | blue
+
+
+def synthetic_image(identity, variant=0, size=IMAGE_SIZE):
+    """PNG (sem perdas) com a identidade e a variação codificadas no centro da face"""
+    rng = np.random.default_rng([3, identity, variant])
+    pixels = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    quarter, eighth = size // 4, size // 8
+    center = size // 2
+    pixels[center - eighth:center + eighth, quarter:center] = _color(identity)
+    pixels[center - eighth:center + eighth, center:size - quarter] = _color(variant)
+
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format='PNG')
+    return output.getvalue()
+
+
+# API usada pelo backend ---------------------------------------------------------
+
+def face_locations(img, number_of_times_to_upsample=1, model='hog'):
+    """Uma face no centro da imagem (a metade central)"""
+    if detect_ms:
+        time.sleep(detect_ms / 1000)
+    height, width = img.shape[:2]
+    return [(height // 4, 3 * width // 4, 3 * height // 4, width // 4)]
+
+
+def face_encodings(face_image, known_face_locations=None, num_jitters=1, model='small'):
+    if known_face_locations is None:
+        known_face_locations = face_locations(face_image)
+    encodings = []
+    for top, right, bottom, left in known_face_locations:
+        row = (top + bottom) // 2
+        offset = (right - left) // 4
+        identity = _value(face_image[row, (left + right) // 2 - offset])
+        variant = _value(face_image[row, (left + right) // 2 + offset])
+        encodings.append(identity_encoding(identity, variant))
+    return encodings
+
+
+def face_distance(face_encodings, face_to_compare):
+    if len(face_encodings) == 0:
+        return np.empty(0)
+    return np.linalg.norm(np.asarray(face_encodings) - face_to_compare, axis=1)
+
+
+def install():
+    """Registrar este módulo como face_recognition (antes de importar o backend)"""
+    sys.modules['face_recognition'] = sys.modules[__name__]
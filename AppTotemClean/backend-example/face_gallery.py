@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Galeria de encodings faciais em matriz NumPy contígua
+
+Os encodings ficam em uma matriz float pré-alocada (N x 128) que cresce em
+passos amortizados, com as normas das linhas em cache. Assim uma busca 1:N
+é uma única operação matriz-vetor sobre uma view da matriz, sem cópias.
+
+Cada linha é um modelo (template) de uma pessoa, identificada pela chave
+estável `person_key`: o identificador (colaborador_id, CPF, ...) ou, na falta
+dele, o nome. O índice chave -> linhas permite a verificação 1:1 sem varrer a
+galeria e limitar o número de modelos por pessoa. A correspondência por pessoa
+é a do seu modelo mais próximo, então a busca continua sendo um argmin só.
+
+Leituras concorrentes usam snapshot(): uma GallerySnapshot imutável que a
+requisição pega uma vez (leitura de um atributo, sem lock) e usa do início ao
+fim (busca, nome e identificador da linha encontrada). As escritas nunca
+alteram o que um snapshot publicado enxerga: linhas novas vão além do tamanho
+dele (a matriz e as listas de nomes e identificadores são compartilhadas e só
+crescem), e o que muda linhas existentes copia antes a matriz, as normas ou as
+listas (copy-on-write). O índice por pessoa é um dicionário base, nunca
+alterado, mais um dicionário pequeno com as mudanças recentes: só este é
+copiado a cada publicação, e ele é fundido em uma base nova quando passa de
+~raiz(pessoas) chaves, então um cadastro custa O(raiz(N)) e não O(N).
+Cada escrita termina publicando um snapshot novo; batch() agrupa várias
+escritas em uma única publicação. Um cadastro em andamento nunca bloqueia nem
+desalinha as buscas (nomes e encodings sempre da mesma versão).
+"""
+
+from contextlib import contextmanager
+
+import numpy as np
+
+ENCODING_SIZE = 128
+INITIAL_CAPACITY = 1024
+GROWTH_FACTOR = 2
+# Limite de elementos da matriz de distâncias (consultas x linhas) por bloco em best_matches
+MATCH_BLOCK_ELEMENTS = 4_000_000
+# Mínimo de mudanças no índice por pessoa antes de fundi-las na base (ver _publish)
+PERSON_CHANGES_MIN_MERGE = 256
+
+
+def person_key(name, person_id):
+    """Chave estável da pessoa: o identificador, ou o nome se não houver"""
+    return person_id if person_id is not None else name
+
+
+def most_redundant_template(encodings):
+    """
+    Escolher o modelo a descartar quando uma pessoa passa do limite: do par mais
+    próximo entre si, fica o mais central (mais perto do medoide do conjunto) e
+    sai o outro. Retorna o índice em `encodings` do modelo descartado.
+    """
+    encodings = np.asarray(encodings, dtype=np.float64)
+    sq_norms = np.einsum('ij,ij->i', encodings, encodings)
+    sq = sq_norms[:, None] - 2.0 * (encodings @ encodings.T) + sq_norms[None, :]
+    distances = np.sqrt(np.maximum(sq, 0.0))
+    np.fill_diagonal(distances, 0.0)
+    totals = distances.sum(axis=1)
+
+    np.fill_diagonal(distances, np.inf)
+    first, second = np.unravel_index(int(np.argmin(distances)), distances.shape)
+    return int(second if totals[first] <= totals[second] else first)
+
+
+class GalleryView:
+    """Leitura da galeria: comum à FaceGallery (estado atual) e à GallerySnapshot"""
+
+    def __len__(self):
+        return self._size - len(self._discarded)
+
+    @property
+    def encodings(self):
+        """View (sem cópia) das linhas ocupadas da matriz"""
+        return self._matrix[:self._size]
+
+    @property
+    def sq_norms(self):
+        """Normas ao quadrado das linhas ocupadas (infinitas para linhas inválidas)"""
+        return self._sq_norms[:self._size]
+
+    def person_key(self, index):
+        return person_key(self.names[index], self.ids[index])
+
+    def row_names(self):
+        """Nome de cada linha ocupada (a lista `names` pode ter linhas de versões mais novas)"""
+        return self.names[:self._size]
+
+    def _person_rows(self, key):
+        """Linhas da pessoa: as mudanças recentes têm prioridade sobre a base"""
+        rows = self._person_changes.get(key)
+        return self._rows_by_person.get(key, ()) if rows is None else rows
+
+    def _person_items(self):
+        """(chave, linhas) de cada pessoa com ao menos um modelo válido"""
+        changes = self._person_changes
+        for key, rows in self._rows_by_person.items():
+            if key not in changes:
+                yield key, rows
+        for key, rows in changes.items():
+            if rows:
+                yield key, rows
+
+    def rows_for(self, key):
+        """Linhas (modelos) da pessoa com a chave `key` (lista vazia se não há)"""
+        return list(self._person_rows(key))
+
+    def person_names(self):
+        """Nome de cada pessoa com ao menos um modelo válido"""
+        return [self.names[rows[0]] for _, rows in self._person_items()]
+
+    def person_count(self):
+        return self._person_count
+
+    def persons(self):
+        """(chave, nome, identificador) de cada pessoa com ao menos um modelo válido"""
+        return [(key, self.names[rows[0]], self.ids[rows[0]]) for key, rows in self._person_items()]
+
+    def distances(self, encoding, rows=None):
+        """
+        Distância euclidiana do encoding para todas as linhas da galeria
+        (ou apenas para as linhas em `rows`).
+
+        Usa ||a - b||² = ||a||² - 2·a·b + ||b||² com as normas em cache,
+        então o custo é um único produto matriz-vetor. A varredura completa usa a
+        precisão da galeria (uma galeria float32 não é convertida a cada busca);
+        as linhas em `rows` são comparadas em float64.
+        """
+        probe = np.asarray(encoding, dtype=np.float64).reshape(ENCODING_SIZE)
+        if rows is None:
+            matrix, sq_norms = self.encodings, self._sq_norms[:self._size]
+            dots = matrix @ probe.astype(matrix.dtype, copy=False)
+        else:
+            matrix, sq_norms = self._matrix[rows], self._sq_norms[rows]
+            dots = matrix.astype(np.float64, copy=False) @ probe
+        sq = sq_norms - 2.0 * dots + np.dot(probe, probe)
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq, out=sq)
+
+    def best_match(self, encoding, rows=None):
+        """
+        Retornar (índice, distância) da linha mais próxima, ou (None, inf) se vazia.
+        Com `rows` (ex.: rows_for(person_id)) compara só com essas linhas (1:1);
+        linhas além do tamanho da galeria (de uma versão mais nova) são ignoradas.
+        """
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            rows = rows[rows < self._size]
+        if not self._size or (rows is not None and not len(rows)):
+            return None, float('inf')
+        distances = self.distances(encoding, rows)
+        position = int(np.argmin(distances))
+        if not np.isfinite(distances[position]):
+            return None, float('inf')
+        index = position if rows is None else int(rows[position])
+        return index, float(distances[position])
+
+    def best_matches(self, encodings):
+        """
+        Melhor linha para cada encoding de uma vez: uma operação matriz-matriz
+        (em blocos de consultas para limitar a memória). Retorna [(índice, distância)].
+        """
+        probes = np.asarray(encodings, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+        if not self._size:
+            return [(None, float('inf'))] * len(probes)
+
+        results = []
+        block = max(1, MATCH_BLOCK_ELEMENTS // self._size)
+        for start in range(0, len(probes), block):
+            chunk = probes[start:start + block]
+            sq = (chunk.astype(self.dtype, copy=False) @ self.encodings.T).astype(np.float64, copy=False)
+            sq *= -2.0
+            sq += self.sq_norms[None, :]
+            sq += np.einsum('ij,ij->i', chunk, chunk)[:, None]
+            indices = np.argmin(sq, axis=1)
+            best = np.sqrt(np.maximum(sq[np.arange(len(chunk)), indices], 0.0))
+            for index, distance in zip(indices, best):
+                if np.isfinite(distance):
+                    results.append((int(index), float(distance)))
+                else:
+                    results.append((None, float('inf')))
+        return results
+
+
+class GallerySnapshot(GalleryView):
+    """
+    Versão imutável da galeria. Compartilha com a galeria (que os copia antes de
+    alterá-los no lugar) a matriz, as normas, os nomes, os identificadores e o
+    índice por pessoa; as leituras param em `_size`, então linhas acrescentadas
+    depois não aparecem.
+    """
+
+    def __init__(self, gallery):
+        self.dtype = gallery.dtype
+        self._matrix = gallery._matrix
+        self._sq_norms = gallery._sq_norms
+        self._size = gallery._size
+        self._length = len(gallery)
+        self.names = gallery.names
+        self.ids = gallery.ids
+        self._rows_by_person = gallery._rows_by_person
+        self._person_changes = gallery._person_changes
+        self._person_count = gallery._person_count
+        self.generation = gallery.generation
+        self.layout_generation = gallery.layout_generation
+
+    def __len__(self):
+        return self._length
+
+    def snapshot(self):
+        return self
+
+
+class FaceGallery(GalleryView):
+    def __init__(self, capacity=INITIAL_CAPACITY, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self._matrix = np.empty((max(1, capacity), ENCODING_SIZE), dtype=self.dtype)
+        self._sq_norms = np.empty(max(1, capacity), dtype=np.float64)
+        self._size = 0
+        self.names = []
+        self.ids = []
+        self._reset_person_index()
+        self._discarded = set()  # linhas invalidadas por discard() (norma infinita)
+        # Contadores de versão: `generation` muda a cada alteração; `layout_generation`
+        # só quando linhas existentes mudam de posição (remove/clear). Índices derivados
+        # usam os dois para saber se basta processar as linhas novas.
+        self.generation = 0
+        self.layout_generation = 0
+        self._batch_depth = 0
+        self._published = set()  # atributos compartilhados com o snapshot publicado
+        self._publish()
+
+    @property
+    def capacity(self):
+        return self._matrix.shape[0]
+
+    def snapshot(self):
+        """Versão atual, imutável, para uma requisição inteira (sem lock)"""
+        return self._snapshot
+
+    def _publish(self):
+        if not self._batch_depth:
+            if len(self._person_changes) > max(PERSON_CHANGES_MIN_MERGE, len(self._rows_by_person) ** 0.5):
+                self._merge_person_changes()
+            self._snapshot = GallerySnapshot(self)
+            self._published = {'_matrix', '_sq_norms', 'names', 'ids', '_person_changes'}
+
+    def _writable(self, attribute):
+        """Atributo pronto para alteração no lugar: copiado se o snapshot publicado o usa"""
+        if attribute in self._published:
+            self._published.discard(attribute)
+            setattr(self, attribute, getattr(self, attribute).copy())
+        return getattr(self, attribute)
+
+    @contextmanager
+    def batch(self):
+        """Publicar um único snapshot para várias escritas (ex.: clear + extend ao recarregar)"""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            self._publish()
+
+    def _reserve(self, required):
+        """Garantir capacidade para `required` linhas, crescendo geometricamente"""
+        if required <= self.capacity:
+            return
+        new_capacity = self.capacity
+        while new_capacity < required:
+            new_capacity *= GROWTH_FACTOR
+
+        matrix = np.empty((new_capacity, ENCODING_SIZE), dtype=self.dtype)
+        matrix[:self._size] = self._matrix[:self._size]
+        sq_norms = np.empty(new_capacity, dtype=np.float64)
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+
+        self._matrix = matrix
+        self._sq_norms = sq_norms
+        self._published -= {'_matrix', '_sq_norms'}
+
+    def _reset_person_index(self):
+        # person_key -> tupla de linhas (modelos) da pessoa. A base nunca é
+        # alterada; as mudanças ficam em _person_changes (tupla vazia = removida)
+        self._rows_by_person = {}
+        self._person_changes = {}
+        self._person_count = 0
+
+    def _set_person_rows(self, key, rows):
+        before = self._person_rows(key)
+        changes = self._writable('_person_changes')
+        if rows or key in self._rows_by_person:
+            changes[key] = rows
+        else:
+            changes.pop(key, None)
+        self._person_count += bool(rows) - bool(before)
+
+    def _merge_person_changes(self):
+        """Base nova com as mudanças (a antiga continua com os snapshots que a usam)"""
+        rows_by_person = dict(self._rows_by_person)
+        for key, rows in self._person_changes.items():
+            if rows:
+                rows_by_person[key] = rows
+            else:
+                rows_by_person.pop(key, None)
+        self._rows_by_person = rows_by_person
+        self._person_changes = {}
+
+    def _index_row(self, index):
+        key = self.person_key(index)
+        self._set_person_rows(key, self._person_rows(key) + (index,))
+
+    def _unindex_row(self, index):
+        key = self.person_key(index)
+        rows = self._person_rows(key)
+        if index in rows:
+            self._set_person_rows(key, tuple(row for row in rows if row != index))
+
+    def add(self, encoding, name, person_id=None):
+        """Adicionar um encoding ao final da galeria e retornar o índice da linha"""
+        encoding = np.asarray(encoding, dtype=self.dtype).reshape(ENCODING_SIZE)
+        self._reserve(self._size + 1)
+
+        index = self._size
+        self._matrix[index] = encoding
+        self._sq_norms[index] = float(np.einsum('i,i->', encoding, encoding, dtype=np.float64))
+        self.names.append(name)
+        self.ids.append(person_id)
+        self._index_row(index)
+        self._size += 1
+        self.generation += 1
+        self._publish()
+        return index
+
+    def extend(self, encodings, names, ids=None):
+        """Adicionar vários encodings de uma vez"""
+        encodings = np.asarray(encodings, dtype=self.dtype).reshape(-1, ENCODING_SIZE)
+        ids = [None] * len(names) if ids is None else list(ids)
+        if not len(encodings) == len(names) == len(ids):
+            raise ValueError("Quantidade de encodings e nomes não confere")
+        if not len(encodings):
+            return
+
+        start = self._size
+        end = start + len(encodings)
+        self._reserve(end)
+        self._matrix[start:end] = encodings
+        self._sq_norms[start:end] = np.einsum('ij,ij->i', encodings, encodings, dtype=np.float64)
+        self.names.extend(names)
+        self.ids.extend(ids)
+        for index in range(start, end):
+            self._index_row(index)
+        self._size = end
+        self.generation += 1
+        self._publish()
+
+    def remove(self, index):
+        """
+        Remover a linha `index` movendo a última linha para o lugar dela.
+
+        Retorna o nome da linha que foi movida para `index` (ou None se a linha
+        removida era a última), para que índices externos possam ser atualizados.
+        A troca é O(1), mas a primeira alteração após publicar um snapshot copia
+        a matriz (O(n)); para só invalidar a linha use discard().
+        """
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+
+        last = self._size - 1
+        moved_name = None
+        self._unindex_row(index)
+        self._discarded.discard(index)
+        # A posição `last` volta a ser livre e o próximo add() a sobrescreve no
+        # lugar: a matriz e as normas deixam de ser compartilhadas mesmo sem troca
+        matrix = self._writable('_matrix')
+        sq_norms = self._writable('_sq_norms')
+        if index != last:
+            self._unindex_row(last)
+            matrix[index] = matrix[last]
+            sq_norms[index] = sq_norms[last]
+            self._writable('names')[index] = self.names[last]
+            self._writable('ids')[index] = self.ids[last]
+            moved_name = self.names[index]
+            if last in self._discarded:
+                self._discarded.remove(last)
+                self._discarded.add(index)
+            else:
+                self._index_row(index)
+        self._writable('names').pop()
+        self._writable('ids').pop()
+        self._size = last
+        self.generation += 1
+        self.layout_generation += 1
+        self._publish()
+        return moved_name
+
+    def discard(self, index):
+        """
+        Invalidar a linha sem mover as outras: a norma infinita a exclui das
+        buscas e as posições das demais linhas (e índices derivados) continuam valendo
+        """
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        if index in self._discarded:
+            return
+        self._unindex_row(index)
+        self._writable('_sq_norms')[index] = np.inf
+        self._discarded.add(index)
+        self.generation += 1
+        self._publish()
+
+    def clear(self):
+        """Remover todos os encodings (matriz nova: os snapshots publicados continuam válidos)"""
+        self._matrix = np.empty_like(self._matrix)
+        self._sq_norms = np.empty_like(self._sq_norms)
+        self._size = 0
+        self.names = []
+        self.ids = []
+        self._reset_person_index()
+        self._discarded = set()
+        self._published = set()
+        self.generation += 1
+        self.layout_generation += 1
+        self._publish()
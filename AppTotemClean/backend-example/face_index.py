@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Backends de busca sobre a FaceGallery
+
+- ExactIndex: varredura completa (exata), ideal para galerias pequenas/médias
+- QuantizedIndex: varredura completa sobre uma cópia compacta (float32/float16/int8)
+              com as melhores candidatas comparadas de novo em precisão total
+- IVFIndex:   índice aproximado por listas invertidas (k-means + n_probe listas),
+              em NumPy puro, para galerias com 100k+ encodings
+
+Use create_index(gallery, backend, scan_dtype=...) para escolher; com
+backend='auto' o índice aproximado só é usado a partir de ANN_MIN_GALLERY_SIZE
+encodings. Com scan_dtype diferente de 'float64' as duas buscas leem a cópia
+compacta (ver face_quantization.py).
+
+search(encoding, snapshot) busca no snapshot da galeria que a requisição já
+pegou (ou no atual, se omitido), então o índice devolvido é uma linha dessa
+versão. Os estados derivados (cópia compacta, listas do IVF) são atualizados
+por uma busca de cada vez e trocados de uma vez; as demais não esperam e
+comparam as linhas ainda fora do estado direto no snapshot. Se uma remoção
+mudou o layout entre o snapshot e o estado, a busca vai direto ao snapshot (exata).
+"""
+
+import math
+import threading
+
+import numpy as np
+
+from face_quantization import CompactRows, RERANK_CANDIDATES, check_scan_dtype, dot_products, quantize, rerank
+
+ANN_MIN_GALLERY_SIZE = 20000
+IVF_DEFAULT_N_PROBE = 32
+IVF_KMEANS_ITERATIONS = 10
+IVF_TRAINING_SAMPLES_PER_LIST = 64
+# Retreinar os centróides quando a galeria cresce além deste fator desde o último treino
+IVF_RETRAIN_GROWTH = 2.0
+# Linhas novas comparadas direto na galeria antes de remontar as listas (remontar é O(n))
+IVF_MAX_UNINDEXED_ROWS = 1024
+
+SEARCH_BACKENDS = ('auto', 'exact', 'ivf')
+
+
+def current_snapshot(gallery, snapshot=None):
+    """O snapshot recebido (mesmo vazio) ou, sem ele, o atual da galeria"""
+    return gallery.snapshot() if snapshot is None else snapshot
+
+
+class ExactIndex:
+    """Busca exata: compara o encoding com todas as linhas da galeria"""
+
+    name = 'exact'
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+
+    def memory_usage(self):
+        """Bytes dos estados derivados da galeria, por tipo (a busca exata não tem)"""
+        return {}
+
+    def search(self, encoding, snapshot=None):
+        return current_snapshot(self.gallery, snapshot).best_match(encoding)
+
+    def search_many(self, encodings, snapshot=None):
+        return current_snapshot(self.gallery, snapshot).best_matches(encodings)
+
+
+class QuantizedIndex:
+    """Busca exata sobre a cópia compacta, com re-ranqueamento em precisão total"""
+
+    name = 'exact'
+
+    def __init__(self, gallery, scan_dtype, rerank_candidates=RERANK_CANDIDATES):
+        self.gallery = gallery
+        self.rows = CompactRows(gallery, scan_dtype)
+        self.rerank_candidates = rerank_candidates
+
+    def memory_usage(self):
+        return {'compact': self.rows.nbytes}
+
+    def search(self, encoding, snapshot=None):
+        snapshot = current_snapshot(self.gallery, snapshot)
+        if not len(snapshot):
+            return None, float('inf')
+        self.rows.sync(snapshot)
+        sq_distances = self.rows.approximate_sq_distances(encoding, snapshot)
+        if sq_distances is None:
+            return snapshot.best_match(encoding)
+        positions = np.arange(len(sq_distances))
+        return rerank(snapshot, encoding, positions, sq_distances, self.rerank_candidates)
+
+    def search_many(self, encodings, snapshot=None):
+        snapshot = current_snapshot(self.gallery, snapshot)
+        return [self.search(encoding, snapshot) for encoding in encodings]
+
+
+class IVFIndex:
+    """
+    Índice aproximado IVF (inverted file).
+
+    Os encodings são agrupados por k-means em `n_lists` centróides; a busca
+    compara o encoding só com as linhas das `n_probe` listas mais próximas.
+    As linhas ficam copiadas na representação compacta (float32 por padrão),
+    ordenadas por lista, para que cada lista visitada seja uma fatia contígua;
+    as melhores candidatas das listas visitadas são comparadas de novo em
+    precisão total na galeria.
+
+    O índice acompanha a galeria pelos contadores de geração: novas linhas
+    são apenas atribuídas ao centróide mais próximo, e remoções (que mudam
+    a posição das linhas) provocam uma reatribuição completa. As listas
+    prontas ficam em um único atributo (`_lists`), trocado ao fim de _sync();
+    até IVF_MAX_UNINDEXED_ROWS linhas novas são comparadas direto no snapshot
+    em vez de remontar as listas a cada cadastro.
+    """
+
+    name = 'ivf'
+
+    def __init__(self, gallery, n_lists=None, n_probe=IVF_DEFAULT_N_PROBE, seed=0,
+                 scan_dtype='float32', rerank_candidates=RERANK_CANDIDATES):
+        self.gallery = gallery
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.scan_dtype = check_scan_dtype(scan_dtype)
+        self.rerank_candidates = rerank_candidates
+        self._rng = np.random.default_rng(seed)
+        self._centroids = None
+        self._trained_size = 0
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._synced_size = 0
+        self._generation = None
+        self._layout_generation = None
+        # (layout_generation, linhas, centróides, ordem, offsets, códigos, escalas, normas) lido pelas buscas
+        self._lists = None
+        self._lock = threading.Lock()
+
+    def _lists_for(self, size):
+        if self.n_lists:
+            return min(self.n_lists, size)
+        return max(1, min(size, int(round(math.sqrt(size)))))
+
+    def train(self, snapshot=None):
+        """Calcular os centróides por k-means sobre uma amostra da galeria"""
+        encodings = current_snapshot(self.gallery, snapshot).encodings
+        size = len(encodings)
+        n_lists = self._lists_for(size)
+
+        sample_size = min(size, n_lists * IVF_TRAINING_SAMPLES_PER_LIST)
+        sample_rows = self._rng.choice(size, sample_size, replace=False)
+        sample = np.asarray(encodings[sample_rows], dtype=np.float32)
+
+        centroids = sample[self._rng.choice(sample_size, n_lists, replace=False)].copy()
+        for _ in range(IVF_KMEANS_ITERATIONS):
+            labels = self._nearest_centroids(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+        self._centroids = centroids
+        self._trained_size = size
+        self._synced_size = 0
+        self._assignments = np.empty(0, dtype=np.int32)
+
+    def memory_usage(self):
+        """Listas (cópia compacta ordenada, normas e ordem), centróides e atribuições"""
+        lists = self._lists
+        arrays = [self._assignments] if lists is None else [self._assignments] + list(lists[2:])
+        return {'ivf': sum(array.nbytes for array in arrays if array is not None)}
+
+    @staticmethod
+    def _nearest_centroids(vectors, centroids):
+        scores = (centroids * centroids).sum(axis=1) - 2.0 * (vectors @ centroids.T)
+        return np.argmin(scores, axis=1).astype(np.int32)
+
+    def _current_lists(self, snapshot):
+        """As listas prontas servem ao snapshot: mesmo layout e poucas linhas fora delas"""
+        lists = self._lists
+        if self._generation is not None and self._generation >= snapshot.generation:
+            return True
+        return (lists is not None and lists[0] == snapshot.layout_generation
+                and len(snapshot.encodings) - lists[1] <= IVF_MAX_UNINDEXED_ROWS)
+
+    def _sync(self, snapshot):
+        """Atualizar atribuições e listas invertidas até a versão `snapshot` da galeria"""
+        if self._current_lists(snapshot):
+            return
+        # Outra busca já está remontando: seguir com as listas atuais (só a primeira montagem espera)
+        if not self._lock.acquire(blocking=self._lists is None):
+            return
+        try:
+            if self._current_lists(snapshot):
+                return
+
+            size = len(snapshot.encodings)
+            if self._centroids is None or size > self._trained_size * IVF_RETRAIN_GROWTH:
+                self.train(snapshot)
+            elif self._layout_generation != snapshot.layout_generation:
+                self._synced_size = 0
+                self._assignments = np.empty(0, dtype=np.int32)
+
+            if self._synced_size < size:
+                new_rows = np.asarray(snapshot.encodings[self._synced_size:size], dtype=np.float32)
+                new_assignments = self._nearest_centroids(new_rows, self._centroids)
+                self._assignments = np.concatenate([self._assignments[:self._synced_size], new_assignments])
+                self._synced_size = size
+
+            order = np.argsort(self._assignments, kind='stable')
+            offsets = np.searchsorted(self._assignments[order], np.arange(len(self._centroids) + 1))
+            codes, scales = quantize(snapshot.encodings[order], self.scan_dtype)
+            # Normas da galeria (e não das cópias compactas) para respeitar linhas inválidas (inf)
+            sq_norms = snapshot.sq_norms[order].astype(np.float32)
+            self._lists = (snapshot.layout_generation, size, self._centroids, order, offsets, codes, scales, sq_norms)
+            self._generation = snapshot.generation
+            self._layout_generation = snapshot.layout_generation
+        finally:
+            self._lock.release()
+
+    def search(self, encoding, snapshot=None):
+        snapshot = current_snapshot(self.gallery, snapshot)
+        if not len(snapshot):
+            return None, float('inf')
+        self._sync(snapshot)
+        layout_generation, size, centroids, order, offsets, codes, list_scales, list_sq_norms = self._lists
+        if layout_generation != snapshot.layout_generation:
+            # Uma remoção mudou as posições (antes ou depois deste snapshot)
+            return snapshot.best_match(encoding)
+
+        probe = np.asarray(encoding, dtype=np.float32).reshape(-1)
+        n_probe = min(self.n_probe, len(centroids))
+        centroid_scores = (centroids * centroids).sum(axis=1) - 2.0 * (centroids @ probe)
+        lists = np.argpartition(centroid_scores, n_probe - 1)[:n_probe]
+
+        positions, scores = [], []
+        for l in lists:
+            start, end = offsets[l], offsets[l + 1]
+            if start == end:
+                continue
+            scales = None if list_scales is None else list_scales[start:end]
+            list_scores = list_sq_norms[start:end] - 2.0 * dot_products(codes[start:end], scales, probe)
+            if len(list_scores) > self.rerank_candidates:
+                nearest = np.argpartition(list_scores, self.rerank_candidates - 1)[:self.rerank_candidates]
+                positions.append(start + nearest)
+                scores.append(list_scores[nearest])
+            else:
+                positions.append(np.arange(start, end))
+                scores.append(list_scores)
+
+        best = None, float('inf')
+        if positions:
+            scores = np.concatenate(scores)
+            if np.isfinite(scores).any():
+                rows = order[np.concatenate(positions)]
+                best = rerank(snapshot, encoding, rows, scores, self.rerank_candidates)
+        if best[0] is None:
+            return snapshot.best_match(encoding)
+
+        rows = len(snapshot.encodings)
+        if size < rows:
+            # Linhas cadastradas depois da última montagem das listas
+            tail = snapshot.best_match(encoding, np.arange(size, rows))
+            if tail[1] < best[1]:
+                best = tail
+        return best
+
+    def search_many(self, encodings, snapshot=None):
+        # Cada consulta visita listas diferentes; não há ganho em juntar as buscas
+        snapshot = current_snapshot(self.gallery, snapshot)
+        return [self.search(encoding, snapshot) for encoding in encodings]
+
+
+def exact_index(gallery, scan_dtype='float64', rerank_candidates=RERANK_CANDIDATES):
+    """
+    Busca exata: direto na galeria se ela já está na representação pedida (ou em
+    float64 com scan_dtype='float64'), senão na cópia compacta com re-ranqueamento
+    """
+    if check_scan_dtype(scan_dtype) == 'float64' or np.dtype(scan_dtype) == gallery.dtype:
+        return ExactIndex(gallery)
+    return QuantizedIndex(gallery, scan_dtype, rerank_candidates)
+
+
+def create_index(gallery, backend='auto', min_ann_size=ANN_MIN_GALLERY_SIZE, scan_dtype='float64',
+                 rerank_candidates=RERANK_CANDIDATES, **ivf_options):
+    """Criar o backend de busca configurado para a galeria"""
+    if backend not in SEARCH_BACKENDS:
+        raise ValueError(f"Backend de busca inválido: {backend} (use {', '.join(SEARCH_BACKENDS)})")
+    # O IVF já lê uma cópia float32; só muda se for pedida uma representação menor
+    ivf_options.setdefault('scan_dtype', 'float32' if scan_dtype == 'float64' else scan_dtype)
+    ivf_options.setdefault('rerank_candidates', rerank_candidates)
+    if backend == 'auto':
+        return AutoIndex(gallery, min_ann_size, exact_scan_dtype=scan_dtype, **ivf_options)
+    if backend == 'ivf':
+        return IVFIndex(gallery, **ivf_options)
+    return exact_index(gallery, scan_dtype, rerank_candidates)
+
+
+class AutoIndex:
+    """Usa a busca exata em galerias pequenas e o IVF a partir de `min_ann_size`"""
+
+    def __init__(self, gallery, min_ann_size=ANN_MIN_GALLERY_SIZE, exact_scan_dtype='float64', **ivf_options):
+        self.gallery = gallery
+        self.min_ann_size = min_ann_size
+        self._exact = exact_index(gallery, exact_scan_dtype,
+                                  ivf_options.get('rerank_candidates', RERANK_CANDIDATES))
+        self._ivf = IVFIndex(gallery, **ivf_options)
+
+    @property
+    def name(self):
+        return self._current(self.gallery.snapshot()).name
+
+    def _current(self, snapshot):
+        return self._ivf if len(snapshot) >= self.min_ann_size else self._exact
+
+    def memory_usage(self):
+        # Os dois podem estar montados: a galeria cruzou o limite, ou voltou a ficar abaixo dele
+        return {**self._exact.memory_usage(), **self._ivf.memory_usage()}
+
+    def search(self, encoding, snapshot=None):
+        snapshot = current_snapshot(self.gallery, snapshot)
+        return self._current(snapshot).search(encoding, snapshot)
+
+    def search_many(self, encodings, snapshot=None):
+        snapshot = current_snapshot(self.gallery, snapshot)
+        return self._current(snapshot).search_many(encodings, snapshot)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Galerias particionadas por local (contrato)
+
+Cada totem atende um contrato com algumas centenas de colaboradores, mas a busca
+percorria a galeria da empresa inteira. Com FACE_PARTITIONS_FILE, a face enviada
+por um totem é comparada primeiro só com os colaboradores alocados ao local dele
+(colaboradores_contratos ativos) e, com FACE_PARTITION_FALLBACK, com a galeria
+global quando ninguém do local fica abaixo do limiar (ex.: cobertura de folga).
+
+O arquivo é exportado do banco do backend (ver README) e relido quando muda:
+
+    {
+      "sites":     {"12": ["1001", "1002"], "15": ["1003"]},
+      "tablets":   {"totem-recepcao": "12"},
+      "locations": {"Hospital Central - Recepção": "12"}
+    }
+
+sites leva o contrato aos colaborador_id alocados; tablets e locations levam o
+tablet_id ou o tablet_location enviados pelo app ao contrato. Uma requisição
+também pode informar o contrato direto (contrato_id ou site_id).
+
+A partição é uma cópia compacta (FaceGallery) dos modelos dos membros, lida do
+store (mmap) só nas linhas deles, na primeira busca do local, e guardada em um LRU
+de FACE_PARTITION_CACHE_SIZE locais. O cache acompanha as linhas e remoções novas
+do store e mantém uma versão por local: um cadastro só desatualiza os locais da
+pessoa. Compactação do store e mudanças no arquivo desatualizam todos. A partição
+pode ser carregada (load) ou descartada (evict) sozinha. FACE_SITES fixa os locais
+atendidos por este nó: são carregados no aquecimento, não saem do LRU, só os
+membros deles são acompanhados e requisições de outros locais são recusadas.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from face_gallery import FaceGallery, person_key
+
+PARTITIONS_FILE = os.environ.get('FACE_PARTITIONS_FILE', '')
+PARTITION_FALLBACK = os.environ.get('FACE_PARTITION_FALLBACK', '1') == '1'
+PARTITION_CACHE_SIZE = int(os.environ.get('FACE_PARTITION_CACHE_SIZE', 64))
+SITES = [site.strip() for site in os.environ.get('FACE_SITES', '').split(',') if site.strip()]
+
+# Campos da requisição que informam o local diretamente
+SITE_FIELDS = ('contrato_id', 'site_id')
+
+
+class PartitionMap:
+    """Conteúdo do FACE_PARTITIONS_FILE, relido quando o arquivo muda (mtime)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = 0
+        self.sites = {}
+        self.tablets = {}
+        self.locations = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """Reler o arquivo se ele mudou desde a última leitura; retorna True se mudou"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+
+        with self._lock:
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime
+            try:
+                data = {}
+                if mtime is not None:
+                    with open(self.path, encoding='utf-8') as f:
+                        data = json.load(f)
+                sites = {str(site): frozenset(str(member) for member in members)
+                         for site, members in data.get('sites', {}).items()}
+                tablets = {str(tablet): str(site) for tablet, site in data.get('tablets', {}).items()}
+                locations = {str(location): str(site) for location, site in data.get('locations', {}).items()}
+            except (OSError, ValueError, AttributeError, TypeError) as e:
+                # Mantém o mapa anterior (ex.: arquivo gravado pela metade)
+                print(f"⚠️  Erro ao ler {self.path}: {e}")
+                return False
+
+            self.sites, self.tablets, self.locations = sites, tablets, locations
+            self.version += 1
+            print(f"🗺️  Partições: {len(sites)} locais, {len(tablets)} totens ({self.path})")
+            return True
+
+    def site_for(self, data):
+        """Local da requisição: contrato_id/site_id informado, ou o do tablet_id/tablet_location"""
+        self.reload()
+        for field in SITE_FIELDS:
+            value = data.get(field)
+            if value is not None and str(value).strip():
+                return str(value).strip()
+        tablet_id = data.get('tablet_id')
+        if tablet_id is not None and str(tablet_id) in self.tablets:
+            return self.tablets[str(tablet_id)]
+        location = data.get('tablet_location')
+        if location is not None:
+            return self.locations.get(str(location).strip())
+        return None
+
+
+class SitePartition:
+    """
+    Modelos dos colaboradores de um local e a linha de cada um no store
+    (`rows`, as mesmas posições da galeria global)
+    """
+
+    def __init__(self, site, rows, encodings, names, ids, version):
+        self.site = site
+        self.version = version
+        self.rows = rows
+        self.gallery = FaceGallery(capacity=len(rows))
+        self.gallery.extend(encodings, names, ids)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def best_match(self, encoding):
+        """(índice na partição, distância) do modelo mais próximo, ou (None, inf)"""
+        return self.gallery.best_match(encoding)
+
+
+class PartitionCache:
+    """
+    LRU das partições carregadas, lidas direto do store. Um índice membro ->
+    linhas válidas acompanha o store de forma incremental (só as linhas e
+    remoções novas de cada commit) e incrementa a versão dos locais de cada
+    pessoa alterada; a compactação do store ou um arquivo novo recomeçam o
+    índice (`_epoch`) e desatualizam todas as partições.
+    """
+
+    def __init__(self, store, partition_map, capacity=PARTITION_CACHE_SIZE, pinned=()):
+        self.store = store
+        self.map = partition_map
+        self.capacity = capacity
+        self.pinned = frozenset(pinned)
+        self._partitions = OrderedDict()
+        self._lock = threading.Lock()
+        self._rows_by_member = {}  # membro acompanhado -> linhas válidas no store
+        self._sites_by_member = {}  # membro -> locais dele (só os fixados, com FACE_SITES)
+        self._site_versions = {}
+        self._epoch = 0
+        self._indexed = None  # (geração, linhas, removidas, versão do mapa) já no índice
+        self.loads = 0
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+
+    def serves(self, site):
+        """Sem FACE_SITES o nó atende qualquer local; com ele, só os fixados"""
+        return not self.pinned or site in self.pinned
+
+    def _catch_up(self, view):
+        """Levar o índice até `view` (ver EncodingStore.view); chamar com _lock"""
+        generation, rows, _, names, ids, tombstones, deleted = view
+        indexed = self._indexed
+        if indexed == (generation, rows, deleted, self.map.version):
+            return
+        if (indexed is None or indexed[0] != generation or indexed[3] != self.map.version
+                or indexed[1] > rows or indexed[2] > deleted):
+            self._epoch += 1
+            self._site_versions = {}
+            self._rows_by_member = {}
+            self._sites_by_member = {}
+            for site, members in self.map.sites.items():
+                if self.serves(site):
+                    for member in members:
+                        self._sites_by_member.setdefault(member, []).append(site)
+            indexed = (generation, 0, 0, self.map.version)
+
+        changed = set()
+        for row in range(indexed[1], rows):
+            member = person_key(names[row], ids[row])
+            if member in self._sites_by_member:
+                self._rows_by_member.setdefault(member, []).append(row)
+                changed.add(member)
+        for row in tombstones[indexed[2]:deleted]:
+            member = person_key(names[row], ids[row])
+            member_rows = self._rows_by_member.get(member)
+            if member_rows and row in member_rows:
+                member_rows.remove(row)
+                changed.add(member)
+        for member in changed:
+            for site in self._sites_by_member[member]:
+                self._site_versions[site] = self._site_versions.get(site, 0) + 1
+        self._indexed = (generation, rows, deleted, self.map.version)
+
+    def _version(self, site):
+        return self._epoch, self._site_versions.get(site, 0)
+
+    def get(self, site):
+        """Partição do local, montada se ainda não está carregada ou ficou desatualizada"""
+        self.map.reload()
+        view = self.store.view()
+        with self._lock:
+            self._catch_up(view)
+            partition = self._partitions.get(site)
+            if partition is not None and partition.version == self._version(site):
+                self._partitions.move_to_end(site)
+                return partition
+        return self.load(site, view)
+
+    def load(self, site, view=None):
+        """Montar (ou remontar) a partição do local com as linhas dos membros no store"""
+        view = self.store.view() if view is None else view
+        _, _, encodings, names, ids, _, _ = view
+        with self._lock:
+            self._catch_up(view)
+            rows = sorted(row for member in self.map.sites.get(site, ())
+                          for row in self._rows_by_member.get(member, ()))
+            partition = SitePartition(site, rows, encodings[rows], [names[row] for row in rows],
+                                      [ids[row] for row in rows], self._version(site))
+            self._partitions[site] = partition
+            self._partitions.move_to_end(site)
+            self.loads += 1
+            evictable = [loaded for loaded in self._partitions if loaded not in self.pinned]
+            while len(self._partitions) > max(self.capacity, len(self.pinned)) and evictable:
+                del self._partitions[evictable.pop(0)]
+                self.evictions += 1
+        return partition
+
+    def evict(self, site):
+        """Descartar a partição do local (a próxima busca a monta de novo); True se estava carregada"""
+        with self._lock:
+            return self._partitions.pop(site, None) is not None
+
+    def record_search(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self._lock:
+            searches = self.hits + self.misses
+            return {
+                'capacity': self.capacity,
+                'pinned': sorted(self.pinned),
+                'fallback': PARTITION_FALLBACK,
+                'loaded': {site: len(partition) for site, partition in self._partitions.items()},
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / searches, 3) if searches else 0.0,
+            }
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Pipeline de imagem ciente da resolução
+
+As câmeras dos totens enviam fotos de vários megapixels, mas a detecção HOG
+não precisa de tudo isso. O pipeline:
+
+1. decodifica o JPEG já reduzido (Image.draft usa a escala DCT 1/2, 1/4, 1/8)
+   até DECODE_MAX_SIZE e aplica a orientação EXIF;
+2. detecta as faces em uma cópia com no máximo DETECTION_MAX_SIZE pixels no
+   lado maior e mapeia as caixas de volta para a imagem decodificada;
+3. extrai o encoding de um recorte ao redor de cada face, reduzido para que a
+   face tenha no máximo ENCODING_FACE_SIZE pixels (o dlib alinha em 150x150).
+
+A detecção usa a cascata de face_detectors.py (FACE_DETECTORS). StageTimer
+registra o tempo de cada etapa em milissegundos e o resultado de cada detector
+da cascata (ver metrics.py).
+
+O face_recognition é importado só na primeira detecção: o import carrega os
+modelos do dlib (~1,5 s). warm_up() faz isso de forma explícita na inicialização.
+"""
+
+import io
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from face_detectors import create_cascade
+
+DECODE_MAX_SIZE = int(os.environ.get('FACE_DECODE_MAX_SIZE', 1600))
+DETECTION_MAX_SIZE = int(os.environ.get('FACE_DETECTION_MAX_SIZE', 640))
+ENCODING_FACE_SIZE = 300
+# Margem ao redor da caixa da face no recorte (fração do tamanho da face)
+CROP_MARGIN = 0.5
+
+# Cascata de detectores do processo (cada processo do pool monta a sua)
+DETECTOR_CASCADE = create_cascade()
+
+
+class StageTimer:
+    def __init__(self):
+        self.timings = {}
+        # (detector, encontrou faces) de cada detector executado pela cascata
+        self.detections = []
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed_ms(self):
+        """Tempo desde a criação do timer (total da requisição)"""
+        return (time.perf_counter() - self.started) * 1000
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def record(self, name, ms):
+        self.timings[name] = round(self.timings.get(name, 0.0) + ms, 2)
+
+    def merge(self, other):
+        """Somar tempos e detecções medidos em outro timer (ex.: em um processo do pool)"""
+        for name, ms in other.timings.items():
+            self.record(name, ms)
+        self.detections.extend(other.detections)
+
+
+def decode_image(image_data, max_size=DECODE_MAX_SIZE):
+    """
+    Decodificar a imagem (bytes ou arquivo, ex.: upload multipart) em RGB,
+    reduzida para no máximo `max_size` no lado maior
+    """
+    source = image_data if hasattr(image_data, 'read') else io.BytesIO(image_data)
+    image = Image.open(source)
+
+    # JPEG: decodificar direto em escala reduzida, mantendo o lado maior >= max_size
+    ratio = max_size / max(image.size)
+    if ratio < 1:
+        image.draft('RGB', (int(image.width * ratio), int(image.height * ratio)))
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.BILINEAR)
+    return image
+
+
+def detect_faces(image, max_size=DETECTION_MAX_SIZE, timer=None, cascade=None):
+    """Detectar faces em uma cópia reduzida e retornar as caixas nas coordenadas de `image`"""
+    cascade = cascade or DETECTOR_CASCADE
+    scale = 1.0
+    detection_image = image
+    if max(image.size) > max_size:
+        detection_image = image.copy()
+        detection_image.thumbnail((max_size, max_size), Image.BILINEAR)
+        scale = image.width / detection_image.width
+
+    locations = cascade.detect(np.asarray(detection_image), timer)
+    return [
+        (
+            max(0, int(top * scale)),
+            min(image.width, int(right * scale)),
+            min(image.height, int(bottom * scale)),
+            max(0, int(left * scale)),
+        )
+        for top, right, bottom, left in locations
+    ]
+
+
+def _face_crop(image, location):
+    """Recortar a face com margem, reduzindo o recorte se a face for maior que o necessário"""
+    top, right, bottom, left = location
+    face_size = max(bottom - top, right - left)
+    margin = int(face_size * CROP_MARGIN)
+    box = (
+        max(0, left - margin),
+        max(0, top - margin),
+        min(image.width, right + margin),
+        min(image.height, bottom + margin),
+    )
+    crop = image.crop(box)
+
+    factor = 1.0
+    if face_size > ENCODING_FACE_SIZE:
+        factor = ENCODING_FACE_SIZE / face_size
+        crop = crop.resize((max(1, int(crop.width * factor)), max(1, int(crop.height * factor))), Image.BILINEAR)
+
+    crop_location = (
+        int((top - box[1]) * factor),
+        int((right - box[0]) * factor),
+        int((bottom - box[1]) * factor),
+        int((left - box[0]) * factor),
+    )
+    return crop, crop_location
+
+
+def encode_faces(image, locations):
+    """Extrair o encoding de cada face a partir de um recorte do tamanho adequado"""
+    import face_recognition
+
+    encodings = []
+    for location in locations:
+        crop, crop_location = _face_crop(image, location)
+        face_encodings = face_recognition.face_encodings(np.asarray(crop), [crop_location])
+        if face_encodings:
+            encodings.append(face_encodings[0])
+    return encodings
+
+
+def warm_up():
+    """Importar o face_recognition e rodar os detectores e o encoder uma vez (modelos carregados)"""
+    blank = Image.new('RGB', (160, 160))
+    detect_faces(blank)  # sem faces: a cascata inteira roda
+    encode_faces(blank, [(5, 155, 155, 5)])
+
+
+def extract_probe(image_data, timer):
+    """Decodificar, detectar e extrair o encoding da primeira face; retorna (encoding, erro)"""
+    # Decodificar imagem (JPEG já reduzido, com orientação EXIF aplicada)
+    with timer.stage('decode'):
+        image = decode_image(image_data)
+
+    # Detectar faces na versão reduzida
+    with timer.stage('detect'):
+        face_locations = detect_faces(image, timer=timer)
+    if not face_locations:
+        return None, "Nenhuma face detectada na imagem"
+
+    # Extrair encoding da primeira face, a partir do recorte
+    with timer.stage('encode'):
+        face_encodings = encode_faces(image, face_locations[:1])
+    if not face_encodings:
+        return None, "Não foi possível processar a face"
+
+    return face_encodings[0], None
+
+
+def extract_enrollment(image_data, timer):
+    """
+    Preparar um cadastro: exige exatamente uma face na imagem.
+    Retorna (encoding, erro, imagem decodificada).
+    """
+    with timer.stage('decode'):
+        image = decode_image(image_data)
+
+    with timer.stage('detect'):
+        face_locations = detect_faces(image, timer=timer)
+    if not face_locations:
+        return None, "Nenhuma face detectada na imagem", image
+
+    if len(face_locations) > 1:
+        return None, "Múltiplas faces detectadas. Use uma imagem com apenas uma pessoa.", image
+
+    with timer.stage('encode'):
+        face_encodings = encode_faces(image, face_locations)
+    if not face_encodings:
+        return None, "Não foi possível extrair características da face", image
+
+    return face_encodings[0], None, image
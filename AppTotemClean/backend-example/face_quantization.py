@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Representações compactas dos encodings para a varredura 1:N
+
+A busca completa lê a galeria inteira a cada consulta; em float64 são 1024
+bytes por modelo. Com FACE_SCAN_DTYPE a varredura usa uma cópia compacta:
+
+    float32   512 bytes/linha  (sem perda: o dlib calcula os descritores em float32)
+    float16   256 bytes/linha
+    int8      132 bytes/linha  (128 códigos + escala float32 da linha)
+
+A cópia compacta só escolhe candidatos: as RERANK_CANDIDATES linhas mais
+próximas são comparadas de novo em precisão total na galeria, então a distância
+devolvida (e a decisão no limiar) é a mesma da busca em float64, a menos que a
+pessoa certa fique fora dos candidatos (ver benchmark_quantization.py).
+
+Também ficam aqui as funções de (de)serialização dos blobs de encoding usados
+no exemplo Django (Person.face_encoding), que aceitam os blobs float64 antigos.
+"""
+
+import threading
+
+import numpy as np
+
+ENCODING_SIZE = 128
+SCAN_DTYPES = ('float64', 'float32', 'float16', 'int8')
+RERANK_CANDIDATES = 32
+# Linhas convertidas para float32 por vez na varredura float16/int8 (512 KB, cabe no cache L2)
+SCAN_BLOCK_ROWS = 1024
+INT8_LEVELS = 127
+
+# Tamanho do blob -> dtype, para ler blobs antigos (float64) e novos lado a lado
+BLOB_DTYPES = {
+    ENCODING_SIZE * 8: np.dtype(np.float64),
+    ENCODING_SIZE * 4: np.dtype(np.float32),
+    ENCODING_SIZE * 2: np.dtype(np.float16),
+}
+
+
+def check_scan_dtype(scan_dtype):
+    if scan_dtype not in SCAN_DTYPES:
+        raise ValueError(f"Representação inválida: {scan_dtype} (use {', '.join(SCAN_DTYPES)})")
+    return scan_dtype
+
+
+def bytes_per_row(scan_dtype):
+    """Bytes lidos por linha na varredura"""
+    if check_scan_dtype(scan_dtype) == 'int8':
+        return ENCODING_SIZE + 4
+    return ENCODING_SIZE * np.dtype(scan_dtype).itemsize
+
+
+def quantize(encodings, scan_dtype):
+    """
+    Converter linhas (N x 128) para a representação compacta.
+    Retorna (códigos, escalas); escalas é None exceto em int8, onde cada linha
+    usa a escala simétrica max|x| / 127.
+    """
+    encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+    if check_scan_dtype(scan_dtype) != 'int8':
+        return encodings.astype(scan_dtype), None
+
+    peaks = np.abs(encodings).max(axis=1) if len(encodings) else np.empty(0)
+    scales = np.where(peaks > 0, peaks / INT8_LEVELS, 1.0).astype(np.float32)
+    codes = np.rint(encodings / scales[:, None].astype(np.float64))
+    return np.clip(codes, -INT8_LEVELS, INT8_LEVELS).astype(np.int8), scales
+
+
+def dot_products(codes, scales, probe):
+    """
+    Produto interno aproximado de cada linha compacta com `probe` (float32).
+    float16/int8 são convertidos em blocos, sem materializar a matriz em float32.
+    """
+    if codes.dtype in (np.float64, np.float32):
+        return codes @ probe.astype(codes.dtype)
+
+    dots = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), SCAN_BLOCK_ROWS):
+        block = codes[start:start + SCAN_BLOCK_ROWS].astype(np.float32)
+        dots[start:start + len(block)] = block @ probe
+    if scales is not None:
+        dots *= scales
+    return dots
+
+
+class CompactRows:
+    """
+    Cópia compacta das linhas de uma FaceGallery, acompanhada pelos contadores
+    de geração: linhas novas são convertidas de forma incremental e mudanças de
+    posição (remove/clear/compactação) refazem a cópia em um buffer novo. Linhas
+    descartadas não precisam ser tocadas: as normas (infinitas) vêm do snapshot.
+
+    sync() só avança e troca o estado (buffers, tamanho e layout) de uma vez;
+    as buscas leem esse estado sem lock, como os snapshots da galeria. Se outra
+    busca já está convertendo, sync() não espera: as linhas ainda não
+    convertidas são comparadas direto no snapshot.
+    """
+
+    def __init__(self, gallery, scan_dtype):
+        self.gallery = gallery
+        self.scan_dtype = check_scan_dtype(scan_dtype)
+        self._codes = np.empty((0, ENCODING_SIZE), dtype=scan_dtype)
+        self._scales = np.empty(0, dtype=np.float32) if scan_dtype == 'int8' else None
+        self._size = 0
+        self._generation = None
+        self._layout_generation = None
+        # (códigos, escalas, linhas convertidas, layout_generation) lido pelas buscas
+        self._state = (self._codes, self._scales, 0, None)
+        self._lock = threading.Lock()
+
+    def _reserve(self, required):
+        if required <= len(self._codes):
+            return
+        capacity = max(required, 2 * len(self._codes), 1024)
+        codes = np.empty((capacity, ENCODING_SIZE), dtype=self._codes.dtype)
+        codes[:self._size] = self._codes[:self._size]
+        self._codes = codes
+        if self._scales is not None:
+            scales = np.empty(capacity, dtype=np.float32)
+            scales[:self._size] = self._scales[:self._size]
+            self._scales = scales
+
+    def sync(self, snapshot):
+        """Converter as linhas até a versão `snapshot` da galeria (versões mais antigas são ignoradas)"""
+        if self._generation is not None and self._generation >= snapshot.generation:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._generation is not None and self._generation >= snapshot.generation:
+                return
+            if self._layout_generation != snapshot.layout_generation:
+                # Buscas em andamento ainda podem ler os buffers antigos: não reaproveitá-los
+                self._codes = np.empty((0, ENCODING_SIZE), dtype=self._codes.dtype)
+                self._scales = None if self._scales is None else np.empty(0, dtype=np.float32)
+                self._size = 0
+
+            size = len(snapshot.encodings)
+            if self._size < size:
+                codes, scales = quantize(snapshot.encodings[self._size:size], self.scan_dtype)
+                self._reserve(size)
+                self._codes[self._size:size] = codes
+                if scales is not None:
+                    self._scales[self._size:size] = scales
+            self._size = size
+            self._generation = snapshot.generation
+            self._layout_generation = snapshot.layout_generation
+            self._state = (self._codes, self._scales, size, snapshot.layout_generation)
+        finally:
+            self._lock.release()
+
+    @property
+    def nbytes(self):
+        """Memória dos buffers da cópia (incluindo a reserva para crescer)"""
+        codes, scales = self._codes, self._scales
+        return codes.nbytes + (0 if scales is None else scales.nbytes)
+
+    def approximate_sq_distances(self, probe, snapshot):
+        """
+        ||a - b||² aproximado para todas as linhas do snapshot (normas exatas dele),
+        ou None se a cópia acompanha outro layout da galeria. Linhas ainda não
+        convertidas entram com a distância exata.
+        """
+        codes, scales, size, layout_generation = self._state
+        if layout_generation != snapshot.layout_generation:
+            return None
+        rows = len(snapshot.encodings)
+        covered = min(size, rows)
+        probe32 = np.asarray(probe, dtype=np.float32).reshape(ENCODING_SIZE)
+        dots = dot_products(codes[:covered], None if scales is None else scales[:covered], probe32)
+        sq_distances = snapshot.sq_norms[:covered] - 2.0 * dots + float(np.dot(probe32, probe32))
+        if covered < rows:
+            tail = snapshot.distances(probe, np.arange(covered, rows))
+            sq_distances = np.concatenate([sq_distances, tail * tail])
+        return sq_distances
+
+
+def rerank(snapshot, encoding, positions, sq_distances, candidates=RERANK_CANDIDATES):
+    """
+    Das linhas `positions` (com distâncias aproximadas `sq_distances`), comparar
+    as `candidates` mais próximas em precisão total no snapshot da galeria e
+    retornar (índice, distância)
+    """
+    if not len(positions):
+        return None, float('inf')
+    if len(positions) > candidates:
+        nearest = np.argpartition(sq_distances, candidates - 1)[:candidates]
+        positions, sq_distances = positions[nearest], sq_distances[nearest]
+    finite = np.isfinite(sq_distances)
+    if not finite.all():
+        positions = positions[finite]
+    return snapshot.best_match(encoding, positions)
+
+
+# Blobs (Person.face_encoding no exemplo Django) --------------------------------
+
+def encoding_to_blob(encoding, dtype=np.float32):
+    """Serializar um encoding; float32 é sem perda para descritores do dlib"""
+    dtype = np.dtype(dtype)
+    if dtype.itemsize * ENCODING_SIZE not in BLOB_DTYPES:
+        raise ValueError(f"Tipo de blob não suportado: {dtype}")
+    return np.asarray(encoding, dtype=dtype).reshape(ENCODING_SIZE).tobytes()
+
+
+def encoding_from_blob(blob):
+    """Ler um blob de encoding (float64 antigo, float32 ou float16) como float64"""
+    dtype = BLOB_DTYPES.get(len(blob))
+    if dtype is None:
+        raise ValueError(f"Blob de encoding com tamanho inesperado: {len(blob)} bytes")
+    return np.frombuffer(blob, dtype=dtype).astype(np.float64)
@@ -0,0 +1,767 @@
+#!/usr/bin/env python3
+"""
+Sistema de reconhecimento facial compartilhado pelos servidores
+(flask-server.py e asgi-server.py)
+
+Reúne a configuração (variáveis de ambiente FACE_*) e a classe
+FaceRecognitionSystem: galeria, store, índice de busca e pool de inferência.
+
+Criar o FaceRecognitionSystem é rápido; os modelos do dlib e a galeria são
+carregados em warm_up() (start_warm_up() roda em segundo plano). Até o fim do
+aquecimento, reconhecimento e cadastro levantam WarmingUp (503 com Retry-After)
+e GET /ready responde 503, para o balanceador não enviar tráfego antes da hora.
+"""
+
+import base64
+import binascii
+import bisect
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from face_gallery import FaceGallery, ENCODING_SIZE, person_key, most_redundant_template
+from face_index import create_index, ANN_MIN_GALLERY_SIZE
+from face_quantization import RERANK_CANDIDATES
+from encoding_store import EncodingStore
+from shared_gallery import SharedFaceGallery
+from face_pipeline import StageTimer, extract_probe, extract_enrollment, warm_up as warm_up_models
+from inference_pool import InferencePool, PoolBusy, probe_task, enrollment_task
+from frame_cache import FrameCache, frame_hash
+from recent_identities import RecentIdentities
+from face_partitions import PartitionMap, PartitionCache, PARTITIONS_FILE, PARTITION_FALLBACK, SITES
+from bulk_enrollment import BULK_WORKERS, BULK_CHUNK_SIZE, list_photos, enrollment_file_task
+
+# Diretório para armazenar faces conhecidas
+KNOWN_FACES_DIR = "known_faces"
+# Store append-only dos encodings (ver encoding_store.py)
+STORE_DIR = "face_store"
+# Arquivo pickle antigo: migrado automaticamente para o STORE_DIR na inicialização
+ENCODINGS_FILE = "face_encodings.pkl"
+
+# Backend de busca: 'exact' (varredura completa), 'ivf' (aproximado) ou 'auto'
+# ('auto' usa o IVF só quando a galeria atinge FACE_ANN_MIN_GALLERY_SIZE encodings)
+SEARCH_BACKEND = os.environ.get('FACE_SEARCH_BACKEND', 'auto')
+SEARCH_ANN_MIN_GALLERY_SIZE = int(os.environ.get('FACE_ANN_MIN_GALLERY_SIZE', ANN_MIN_GALLERY_SIZE))
+
+# Representação lida na varredura: 'float64', 'float32', 'float16' ou 'int8'. As
+# FACE_RERANK_CANDIDATES melhores linhas são comparadas de novo em float64
+SCAN_DTYPE = os.environ.get('FACE_SCAN_DTYPE', 'float64')
+RERANK_CANDIDATES = int(os.environ.get('FACE_RERANK_CANDIDATES', RERANK_CANDIDATES))
+
+# Galeria sobre o mmap do STORE_DIR (padrão): a inicialização só mapeia o arquivo e
+# vários processos workers (ex.: gunicorn -w 4) compartilham as mesmas páginas,
+# acompanhando os cadastros dos outros pelo contador de commits. Com
+# FACE_SHARED_GALLERY=0 a galeria é uma cópia float64 na memória do processo.
+# Com FACE_SCAN_DTYPE compacto a galeria é sempre o mmap: a memória do processo
+# fica só com a cópia compacta e o re-ranqueamento lê as candidatas do store
+SHARED_GALLERY = os.environ.get('FACE_SHARED_GALLERY', '1') == '1' or SCAN_DTYPE != 'float64'
+
+# Distância máxima para reconhecimento (0.6 é um bom valor padrão)
+RECOGNITION_THRESHOLD = 0.6
+
+# Campos que identificam a pessoa (crachá, PIN): presentes na requisição, o
+# reconhecimento vira verificação 1:1 contra os encodings daquela pessoa
+IDENTITY_FIELDS = ('colaborador_id', 'employee_id', 'cpf')
+
+# Modelos (encodings) guardados por pessoa: recadastros acumulam até este limite e
+# depois substituem o modelo mais redundante, então a galeria não cresce sem limite
+MAX_TEMPLATES_PER_PERSON = int(os.environ.get('FACE_MAX_TEMPLATES', 5))
+
+# Máximo de imagens por requisição em /api/face-recognition/batch/
+MAX_BATCH_SIZE = 50
+
+# Pool de processos para decodificação/detecção/encoding (0 = executar na thread da requisição)
+INFERENCE_WORKERS = int(os.environ.get('FACE_INFERENCE_WORKERS', 0))
+# Requisições que podem aguardar além das que estão em execução; acima disso responde 503
+INFERENCE_QUEUE_SIZE = int(os.environ.get('FACE_INFERENCE_QUEUE_SIZE', 2 * INFERENCE_WORKERS))
+
+# Quadros repetidos do mesmo tablet dentro do TTL devolvem o resultado anterior (0 = desligado)
+FRAME_CACHE_TTL = float(os.environ.get('FACE_FRAME_CACHE_TTL', 10))
+FRAME_CACHE_SIZE = int(os.environ.get('FACE_FRAME_CACHE_SIZE', 1024))
+
+# Atalho por tablet: pessoas reconhecidas recentemente no totem são comparadas antes
+# da galeria inteira (0 = desligado). O limiar do atalho é mais rígido que o normal
+RECENT_PER_TABLET = int(os.environ.get('FACE_RECENT_PER_TABLET', 256))
+RECENT_MATCH_THRESHOLD = float(os.environ.get('FACE_RECENT_THRESHOLD', 0.5))
+
+# Pessoas por página em /api/list-persons/ (padrão e máximo do parâmetro limit)
+LIST_PAGE_SIZE = 500
+LIST_MAX_PAGE_SIZE = 5000
+
+# Retry-After (s) sugerido para requisições que chegam antes do fim do aquecimento
+WARM_UP_RETRY_AFTER = 5
+# Retry-After (s) para um cadastro em lote pedido enquanto outro está rodando
+BULK_BUSY_RETRY_AFTER = 30
+
+# Criar diretório se não existir
+if not os.path.exists(KNOWN_FACES_DIR):
+    os.makedirs(KNOWN_FACES_DIR)
+
+def identity_from(data):
+    """Identificador da pessoa informado na requisição (primeiro campo presente), ou None"""
+    for field in IDENTITY_FIELDS:
+        value = data.get(field)
+        if value is None or str(value).strip() == '':
+            continue
+        value = str(value).strip()
+        if field == 'cpf':
+            value = re.sub(r'\D', '', value)  # 123.456.789-09 -> 12345678909
+        return value
+    return None
+
+def gallery_etag(generation):
+    """ETag das respostas derivadas da galeria (muda a cada commit no store)"""
+    return f'"g{generation}"'
+
+def etag_matches(if_none_match, etag):
+    """True se o cabeçalho If-None-Match inclui `etag` (ou é *): responder 304"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(str(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        return base64.b64decode(cursor + '=' * (-len(cursor) % 4), altchars=b'-_', validate=True).decode('utf-8')
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Cursor inválido")
+
+class WarmingUp(PoolBusy):
+    """Modelos ou galeria ainda carregando: o cliente deve tentar de novo após `retry_after`"""
+    error = 'Servidor iniciando, tente novamente'
+
+class BulkEnrollmentBusy(PoolBusy):
+    """Outro cadastro em lote em andamento: um por vez, o pool do lote já ocupa todos os núcleos"""
+    error = 'Cadastro em lote em andamento, tente novamente'
+
+class FaceRecognitionSystem:
+    def __init__(self):
+        self.store = EncodingStore(STORE_DIR)
+        self.gallery = SharedFaceGallery(self.store) if SHARED_GALLERY else FaceGallery()
+        self.search_index = create_index(self.gallery, SEARCH_BACKEND, SEARCH_ANN_MIN_GALLERY_SIZE,
+                                         scan_dtype=SCAN_DTYPE, rerank_candidates=RERANK_CANDIDATES)
+        self.pool = None
+        if INFERENCE_WORKERS:
+            self.pool = InferencePool(INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE)
+        self.frame_cache = FrameCache(FRAME_CACHE_TTL, FRAME_CACHE_SIZE) if FRAME_CACHE_TTL > 0 else None
+        self.recent = RecentIdentities(RECENT_PER_TABLET) if RECENT_PER_TABLET > 0 else None
+        self._enroll_lock = threading.Lock()
+        # (geração, linhas, removidas) do store já aplicados à galeria em memória
+        self._loaded = None
+        self._bulk_lock = threading.Lock()
+        # Galerias por local (contrato): só com FACE_PARTITIONS_FILE
+        self.partitions = None
+        if PARTITIONS_FILE:
+            self.partitions = PartitionCache(self.store, PartitionMap(PARTITIONS_FILE), pinned=SITES)
+        # (versão, chaves ordenadas, nomes) da última listagem: reordenar só após mudanças
+        self._listing = None
+        self.ready = threading.Event()
+        self.warm_up_seconds = None
+        self.warm_up_error = None
+        self._warm_up_thread = None
+    
+    def warm_up(self):
+        """
+        Carregar os modelos do dlib (neste processo ou nos processos do pool), a
+        galeria e o índice de busca. Retorna True se o sistema ficou pronto.
+        """
+        started = time.perf_counter()
+        try:
+            if self.pool:
+                self.pool.warm_up()
+                print(f"⚙️  Pool de inferência: {INFERENCE_WORKERS} processos, fila de {INFERENCE_QUEUE_SIZE}")
+            else:
+                warm_up_models()
+            
+            with self._enroll_lock:
+                self.load_known_faces()
+                if len(self.gallery):
+                    # Treino do IVF / cópia compacta agora, não na primeira busca
+                    self.search_index.search(np.zeros(ENCODING_SIZE))
+            
+            if self.partitions:
+                for site in SITES:
+                    self.partitions.load(site)
+                if SITES:
+                    print(f"🏢 Locais atendidos: {', '.join(f'{site} ({len(self.partitions.get(site))} modelos)' for site in SITES)}")
+        except Exception as e:
+            self.warm_up_error = str(e)
+            print(f"❌ Erro no aquecimento: {e}")
+            return False
+        
+        self.warm_up_seconds = round(time.perf_counter() - started, 3)
+        self.ready.set()
+        print(f"🔥 Sistema pronto em {self.warm_up_seconds:.2f}s")
+        return True
+    
+    def start_warm_up(self):
+        """Executar warm_up() em segundo plano (o servidor já atende /, /ready e /metrics)"""
+        if self._warm_up_thread is None:
+            self._warm_up_thread = threading.Thread(target=self.warm_up, name='face-warm-up', daemon=True)
+            self._warm_up_thread.start()
+        return self._warm_up_thread
+    
+    def readiness(self):
+        """Estado do aquecimento (GET /ready): READY, WARMING_UP ou FAILED"""
+        if self.ready.is_set():
+            status = 'READY'
+        else:
+            status = 'FAILED' if self.warm_up_error else 'WARMING_UP'
+        return {
+            'status': status,
+            'ready': self.ready.is_set(),
+            'warm_up_seconds': self.warm_up_seconds,
+            'error': self.warm_up_error,
+        }
+    
+    def require_ready(self):
+        if not self.ready.is_set():
+            raise WarmingUp(WARM_UP_RETRY_AFTER)
+    
+    def site_for(self, data):
+        """Local (contrato) da requisição, ou None se as partições estão desligadas ou o totem não tem local"""
+        return self.partitions.map.site_for(data) if self.partitions else None
+    
+    def sync(self):
+        """Incorporar cadastros feitos por outros workers (só lê um contador se nada mudou)"""
+        if SHARED_GALLERY:
+            self.gallery.refresh()
+        elif self.store.refresh() or self._loaded != self._store_state():
+            with self._enroll_lock:
+                self._apply_store()
+    
+    def _store_state(self):
+        return (self.store.generation, self.store.rows, len(self.store.tombstones))
+    
+    def _apply_store(self):
+        """
+        Galeria em memória (FACE_SHARED_GALLERY=0): acrescentar as linhas e
+        remoções do store que ela ainda não tem, nas mesmas posições; depois de
+        uma compactação ou de um reset, recarregar tudo. Chamar com _enroll_lock.
+        As buscas continuam na versão anterior até a nova estar completa.
+        """
+        self.store.refresh()
+        generation, rows, encodings, names, ids, tombstones, deleted = self.store.view()
+        loaded = self._loaded
+        if loaded == (generation, rows, deleted):
+            return
+        if loaded is None or loaded[0] != generation or loaded[1] > rows or loaded[2] > deleted:
+            loaded = (generation, 0, 0)
+        with self.gallery.batch():
+            if not loaded[1]:
+                self.gallery.clear()
+            if rows > loaded[1]:
+                self.gallery.extend(encodings[loaded[1]:rows], names[loaded[1]:rows], ids[loaded[1]:rows])
+            for row in tombstones[loaded[2]:deleted]:
+                self.gallery.discard(row)
+        self._loaded = (generation, rows, deleted)
+    
+    def _sync_locked(self):
+        """sync() para quem já tem _enroll_lock"""
+        if SHARED_GALLERY:
+            self.gallery.refresh()
+        else:
+            self._apply_store()
+    
+    @property
+    def known_face_encodings(self):
+        return self.gallery.snapshot().encodings
+    
+    @property
+    def known_face_names(self):
+        """Nome de cada linha da galeria (uma por modelo)"""
+        return self.gallery.snapshot().row_names()
+    
+    @property
+    def known_persons(self):
+        """Nome de cada pessoa cadastrada (uma vez, independente do número de modelos)"""
+        return self.gallery.snapshot().person_names()
+    
+    @property
+    def person_count(self):
+        return self.gallery.snapshot().person_count()
+    
+    @property
+    def generation(self):
+        """
+        Versão da galeria: o contador de commits do store refletido neste processo.
+        Fica no face_store/, então é o mesmo em todos os workers e sobrevive a reinícios.
+        """
+        return self.store.seen_counter
+    
+    def _sorted_persons(self):
+        """Pessoas ordenadas pela chave, recalculadas só quando a galeria muda"""
+        listing = self._listing
+        if listing is None or listing[0] != (self.generation, self.gallery.generation):
+            with self._enroll_lock:
+                version = (self.generation, self.gallery.generation)
+                persons = sorted((str(key), name) for key, name, _ in self.gallery.snapshot().persons())
+            listing = self._listing = (version, [key for key, _ in persons], [name for _, name in persons])
+        return listing
+    
+    def persons_page(self, cursor=None, limit=None):
+        """
+        Página de /api/list-persons/, em ordem de chave (identificador ou nome).
+        O cursor é a última chave da página anterior, então cadastros entre as
+        páginas não repetem nem pulam as pessoas que já existiam.
+        ValueError se o cursor ou o limit forem inválidos.
+        """
+        self.require_ready()
+        if limit is None or limit == '':
+            limit = LIST_PAGE_SIZE
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            limit = 0
+        if not 1 <= limit <= LIST_MAX_PAGE_SIZE:
+            raise ValueError(f"limit deve estar entre 1 e {LIST_MAX_PAGE_SIZE}")
+        
+        self.sync()
+        (generation, _), keys, names = self._sorted_persons()
+        start = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+        end = min(start + limit, len(keys))
+        return {
+            'known_faces': names[start:end],
+            'count': end - start,
+            'total_count': len(keys),
+            'next_cursor': encode_cursor(keys[end - 1]) if end < len(keys) else None,
+            'generation': generation,
+        }
+    
+    def load_known_faces(self):
+        """Carregar faces conhecidas do store (mmap), migrando o antigo pickle se existir"""
+        try:
+            if os.path.exists(ENCODINGS_FILE):
+                migrated = self.store.import_pickle(ENCODINGS_FILE)
+                if migrated:
+                    print(f"📦 Migradas {migrated} faces de {ENCODINGS_FILE} para {STORE_DIR}/")
+            
+            # Mesmas posições do store: linhas removidas viram linhas descartadas
+            self._loaded = None
+            self._sync_locked()
+            if len(self.gallery):
+                print(f"✅ Carregadas {self.person_count} pessoas ({len(self.gallery)} modelos faciais)")
+            else:
+                print("ℹ️  Nenhuma face cadastrada. Use /add-person para adicionar pessoas.")
+        except Exception as e:
+            print(f"⚠️  Erro ao carregar encodings: {e}")
+    
+    def save_known_faces(self):
+        """Compactar o store (só as linhas válidas) e recarregar a galeria"""
+        try:
+            with self._enroll_lock:
+                self.store.compact()
+                self.load_known_faces()
+            print(f"✅ Salvos {len(self.gallery)} encodings")
+        except Exception as e:
+            print(f"❌ Erro ao salvar encodings: {e}")
+    
+    def image_data(self, image, timer):
+        """
+        Preparar a imagem recebida para o pipeline. `image` pode ser a string
+        base64 do JSON, os bytes de um upload binário ou o arquivo de um upload
+        multipart; só o base64 precisa ser decodificado antes. Arquivos vão
+        direto para o decodificador, exceto com o pool (os processos recebem bytes).
+        """
+        if isinstance(image, str):
+            with timer.stage('base64'):
+                return base64.b64decode(image)
+        if self.pool and hasattr(image, 'read'):
+            with timer.stage('upload'):
+                return image.read()
+        return image
+    
+    def add_person(self, name, image, timer=None, person_id=None):
+        """
+        Adicionar uma nova pessoa ao sistema (imagem em base64, bytes ou arquivo).
+        Com `person_id` (ver identity_from) a pessoa pode ser verificada 1:1.
+        """
+        self.require_ready()
+        timer = timer or StageTimer()
+        try:
+            image_data = self.image_data(image, timer)
+            
+            # Decodificar, detectar (exatamente uma face) e extrair o encoding
+            if self.pool:
+                encoding, error, reference, task_timer = self.pool.run(enrollment_task, image_data)
+                timer.merge(task_timer)
+            else:
+                encoding, error, image = extract_enrollment(image_data, timer)
+            if error:
+                return False, error
+            
+            # Salvar no store (append O(1)) e na galeria em memória
+            with timer.stage('persist'):
+                message = self.store_template(encoding, name, person_id)
+                
+                # Salvar imagem de referência
+                image_path = os.path.join(KNOWN_FACES_DIR, f"{name}.jpg")
+                if self.pool:
+                    with open(image_path, 'wb') as f:
+                        f.write(reference)
+                else:
+                    image.save(image_path)
+            
+            return True, message
+            
+        except PoolBusy:
+            raise
+        except Exception as e:
+            return False, f"Erro ao processar imagem: {str(e)}"
+    
+    def store_template(self, encoding, name, person_id=None):
+        """
+        Guardar o encoding como modelo da pessoa (chave: person_id ou nome).
+        Até MAX_TEMPLATES_PER_PERSON modelos são acumulados; depois o novo
+        substitui o mais redundante (most_redundant_template), ou é descartado
+        se ele próprio for o redundante. Retorna a mensagem para o cliente.
+        """
+        # Com o lock do store, nenhum outro processo (ex.: o CLI) grava entre a
+        # leitura das linhas da pessoa e a escrita: as posições da galeria são as do store
+        with self._enroll_lock, self.store.locked():
+            self._sync_locked()
+            rows = self.gallery.rows_for(person_key(name, person_id))
+            
+            if len(rows) < MAX_TEMPLATES_PER_PERSON:
+                self.store.append(encoding, name, person_id)
+                self._sync_locked()
+                if rows:
+                    return f"Novo modelo facial de '{name}' adicionado ({len(rows) + 1}/{MAX_TEMPLATES_PER_PERSON})"
+                return f"Pessoa '{name}' adicionada com sucesso!"
+            
+            templates = np.vstack([self.gallery.encodings[rows], np.asarray(encoding)[None, :]])
+            drop = most_redundant_template(templates)
+            if drop == len(rows):
+                return f"Modelos faciais de '{name}' mantidos: a nova foto já está representada"
+            
+            # Uma só versão nova da galeria: a pessoa nunca aparece sem o modelo
+            # substituído (com compactação, a galeria é recarregada)
+            self.store.replace(rows[drop], encoding, name, person_id)
+            self._sync_locked()
+            return f"Modelos faciais de '{name}' atualizados ({MAX_TEMPLATES_PER_PERSON} modelos)"
+    
+    def store_templates(self, templates):
+        """
+        Guardar vários modelos [(encoding, nome, person_id)] como store_template,
+        mas com um único commit no store para todos os que só acrescentam uma
+        linha. Pessoas que já têm MAX_TEMPLATES_PER_PERSON modelos passam pela
+        substituição de store_template, uma a uma.
+        """
+        replacements = []
+        with self._enroll_lock, self.store.locked():
+            self._sync_locked()
+            counts = {}
+            appended = []
+            for encoding, name, person_id in templates:
+                key = person_key(name, person_id)
+                if key not in counts:
+                    counts[key] = len(self.gallery.rows_for(key))
+                if counts[key] < MAX_TEMPLATES_PER_PERSON:
+                    counts[key] += 1
+                    appended.append((encoding, name, person_id))
+                else:
+                    replacements.append((encoding, name, person_id))
+            
+            if appended:
+                encodings, names, ids = zip(*appended)
+                self.store.append_many(np.asarray(encodings), list(names), list(ids))
+                self._sync_locked()
+        
+        for encoding, name, person_id in replacements:
+            self.store_template(encoding, name, person_id)
+    
+    def add_persons_bulk(self, path, timer=None, workers=BULK_WORKERS, reserved=False):
+        """
+        Cadastrar as fotos <employee_id>.jpg de um diretório ou .zip (ver
+        bulk_enrollment.py) em um pool de processos próprio, com um único commit
+        no store. Retorna o relatório {'total', 'enrolled', 'rejected', 'seconds'};
+        `rejected` traz arquivo, colaborador e motivo de cada foto recusada.
+        BulkEnrollmentBusy se outro lote estiver rodando neste processo; com
+        `reserved`, a vez já foi tomada com bulk_slot().
+        """
+        if reserved:
+            return self._add_persons_bulk(path, timer or StageTimer(), workers)
+        with self.bulk_slot():
+            return self._add_persons_bulk(path, timer or StageTimer(), workers)
+    
+    @contextmanager
+    def bulk_slot(self):
+        """
+        Vez do lote neste processo, tomada sem esperar: BulkEnrollmentBusy se outro
+        lote estiver rodando. Os servidores a tomam antes de receber o arquivo e
+        chamam add_persons_bulk(..., reserved=True) dentro dela.
+        """
+        self.require_ready()
+        if not self._bulk_lock.acquire(blocking=False):
+            raise BulkEnrollmentBusy(BULK_BUSY_RETRY_AFTER)
+        try:
+            yield
+        finally:
+            self._bulk_lock.release()
+    
+    def _add_persons_bulk(self, path, timer, workers):
+        with timer.stage('list'):
+            photos, rejected = list_photos(path)
+        total = len(photos) + len(rejected)
+        print(f"📥 Cadastro em lote: {len(photos)} fotos em {path} ({len(rejected)} arquivos ignorados)")
+        
+        accepted = []
+        if photos:
+            pool = InferencePool(max(1, min(workers, len(photos))), 0)
+            try:
+                for start in range(0, len(photos), BULK_CHUNK_SIZE):
+                    chunk = photos[start:start + BULK_CHUNK_SIZE]
+                    jobs = [(source, os.path.join(KNOWN_FACES_DIR, f"{employee_id}.jpg"))
+                            for _, employee_id, source in chunk]
+                    outputs = pool.run_many(enrollment_file_task, jobs)
+                    for (file, employee_id, _), (encoding, error, task_timer) in zip(chunk, outputs):
+                        timer.merge(task_timer)
+                        if error:
+                            rejected.append({'file': file, 'employee_id': employee_id, 'error': error})
+                        else:
+                            accepted.append((encoding, employee_id, employee_id))
+                    print(f"   {start + len(chunk)}/{len(photos)} fotos processadas")
+            finally:
+                pool.shutdown()
+        
+        with timer.stage('persist'):
+            self.store_templates(accepted)
+        
+        return {
+            'total': total,
+            'enrolled': len(accepted),
+            'rejected': rejected,
+            'seconds': round(timer.elapsed_ms / 1000, 3),
+        }
+    
+    def reset(self):
+        """Apagar todas as faces conhecidas (store, galeria e imagens de referência)"""
+        self.require_ready()
+        with self._enroll_lock:
+            self.store.reset()
+            self._sync_locked()
+        if self.frame_cache:
+            self.frame_cache.clear()
+        if self.recent:
+            self.recent.clear()
+        
+        # Remover arquivo de encodings antigo, se ainda existir
+        if os.path.exists(ENCODINGS_FILE):
+            os.remove(ENCODINGS_FILE)
+        
+        # Remover imagens conhecidas
+        if os.path.exists(KNOWN_FACES_DIR):
+            for file in os.listdir(KNOWN_FACES_DIR):
+                os.remove(os.path.join(KNOWN_FACES_DIR, file))
+    
+    def extract_probe(self, image, timer):
+        """Decodificar, detectar e extrair o encoding da primeira face; retorna (encoding, erro)"""
+        image_data = self.image_data(image, timer)
+        
+        if self.pool:
+            encoding, error, task_timer = self.pool.run(probe_task, image_data)
+            timer.merge(task_timer)
+            return encoding, error
+        return extract_probe(image_data, timer)
+    
+    def match_result(self, best_match_index, best_distance, snapshot):
+        """
+        Converter a melhor correspondência em (sucesso, mensagem, nome, confiança).
+        `snapshot` é a versão da galeria em que a busca foi feita (nome da mesma versão).
+        """
+        if best_match_index is not None and best_distance < RECOGNITION_THRESHOLD:
+            name = snapshot.names[best_match_index]
+            confidence = 1 - best_distance  # Converter distância para confiança
+            return True, f"Pessoa reconhecida: {name}", name, confidence
+        if best_match_index is None:
+            return False, "Pessoa não reconhecida", None, 0.0
+        return False, "Pessoa não reconhecida", None, 1 - best_distance
+    
+    def recognize_face(self, image, timer=None, tablet_id=None, person_id=None, site=None):
+        """
+        Reconhecer face na imagem fornecida (base64, bytes ou arquivo).
+        Com `person_id` a face é comparada só com os encodings dessa pessoa
+        (verificação 1:1) em vez da galeria inteira; com `site` (ver site_for),
+        primeiro só com os colaboradores do local.
+        Com o cache de quadros ligado, a mesma imagem reenviada pelo mesmo
+        `tablet_id` dentro do TTL devolve o resultado anterior sem detecção.
+        """
+        self.require_ready()
+        timer = timer or StageTimer()
+        try:
+            if person_id is not None:
+                self.sync()
+                if not self.gallery.rows_for(person_id):
+                    return False, "Colaborador não cadastrado para reconhecimento facial", None, 0.0
+            
+            image_data = self.image_data(image, timer)
+            
+            cache_key = None
+            if self.frame_cache:
+                # A geração da galeria na chave invalida resultados anteriores a um cadastro
+                self.sync()
+                with timer.stage('frame_hash'):
+                    cache_key = (tablet_id, person_id, site, frame_hash(image_data), self.gallery.generation)
+                cached = self.frame_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+            
+            result = self._recognize(image_data, timer, person_id, tablet_id, site)
+            if cache_key is not None:
+                self.frame_cache.put(cache_key, result)
+            return result
+                
+        except PoolBusy:
+            raise
+        except Exception as e:
+            return False, f"Erro no reconhecimento: {str(e)}", None, 0.0
+    
+    def _recognize(self, image_data, timer, person_id=None, tablet_id=None, site=None):
+        unknown_encoding, error = self.extract_probe(image_data, timer)
+        if error:
+            return False, error, None, 0.0
+        
+        self.sync()
+        # Uma versão da galeria para a requisição inteira: busca e nome sempre coerentes
+        snapshot = self.gallery.snapshot()
+        
+        if person_id is not None:
+            # Verificação 1:1: só as linhas da pessoa informada
+            with timer.stage('match'):
+                rows = snapshot.rows_for(person_id)
+                best_match_index, best_distance = snapshot.best_match(unknown_encoding, rows)
+            result = self.match_result(best_match_index, best_distance, snapshot)
+            if not result[0]:
+                return (False, "Face não confere com o colaborador informado") + result[2:]
+            return result
+        
+        # Se não há faces conhecidas
+        if not len(snapshot):
+            return False, "Nenhuma pessoa cadastrada no sistema", None, 0.0
+        
+        use_recent = self.recent is not None and tablet_id is not None
+        if use_recent:
+            shortcut = self.match_recent(unknown_encoding, tablet_id, timer, snapshot)
+            if shortcut is not None:
+                return shortcut
+        
+        if site is not None and self.partitions:
+            site_result = self.match_site(unknown_encoding, site, tablet_id, timer, snapshot)
+            if site_result is not None:
+                return site_result
+        
+        # Comparar com faces conhecidas (busca exata ou IVF, conforme SEARCH_BACKEND)
+        started = time.perf_counter()
+        with timer.stage('match'):
+            best_match_index, best_distance = self.search_index.search(unknown_encoding, snapshot)
+        result = self.match_result(best_match_index, best_distance, snapshot)
+        
+        if use_recent:
+            self.recent.record_full_scan(tablet_id, (time.perf_counter() - started) * 1000)
+            if result[0]:
+                self.recent.record_match(tablet_id, best_match_index, snapshot.layout_generation)
+        return result
+    
+    def match_recent(self, encoding, tablet_id, timer, snapshot):
+        """
+        Comparar só com as pessoas reconhecidas recentemente no tablet.
+        Retorna o resultado se alguma ficar abaixo de RECENT_MATCH_THRESHOLD, senão None.
+        """
+        rows = self.recent.candidates(tablet_id, snapshot.layout_generation)
+        if not rows:
+            return None
+        
+        started = time.perf_counter()
+        with timer.stage('match_recent'):
+            best_match_index, best_distance = snapshot.best_match(encoding, rows)
+        hit = best_match_index is not None and best_distance < RECENT_MATCH_THRESHOLD
+        self.recent.record_shortcut(tablet_id, hit, (time.perf_counter() - started) * 1000)
+        if not hit:
+            return None
+        self.recent.record_match(tablet_id, best_match_index, snapshot.layout_generation)
+        return self.match_result(best_match_index, best_distance, snapshot)
+    
+    def match_site(self, encoding, site, tablet_id, timer, snapshot):
+        """
+        Comparar só com os colaboradores do local. Retorna o resultado se alguém do
+        local ficar abaixo do limiar; senão None (segue para a galeria global) ou,
+        sem FACE_PARTITION_FALLBACK, o resultado negativo.
+        """
+        if not self.partitions.serves(site):
+            return False, f"Local {site} não atendido por este servidor", None, 0.0
+        
+        with timer.stage('partition'):
+            partition = self.partitions.get(site)
+        with timer.stage('match_site'):
+            best_match_index, best_distance = partition.best_match(encoding)
+        # Nome da própria partição (lida do store, não do snapshot da requisição)
+        result = self.match_result(best_match_index, best_distance, partition.gallery)
+        self.partitions.record_search(result[0])
+        
+        if result[0]:
+            if self.recent is not None and tablet_id is not None:
+                # O atalho guarda linhas da galeria global: só se a linha é válida no snapshot
+                row = partition.rows[best_match_index]
+                if row in snapshot.rows_for(partition.gallery.person_key(best_match_index)):
+                    self.recent.record_match(tablet_id, row, snapshot.layout_generation)
+            return result
+        return None if PARTITION_FALLBACK else result
+    
+    def recognize_faces(self, images, timer=None):
+        """
+        Reconhecer várias imagens. Detecção e encoding rodam por imagem; o
+        matching de todos os encodings contra a galeria é uma única operação.
+        Retorna uma tupla (sucesso, mensagem, nome, confiança) por imagem.
+        """
+        self.require_ready()
+        timer = timer or StageTimer()
+        results = [None] * len(images)
+        probes = []
+        positions = []
+        
+        if self.pool:
+            # Todas as imagens do lote em paralelo nos processos do pool
+            extracted = [None] * len(images)
+            images_data = []
+            for position, image in enumerate(images):
+                try:
+                    images_data.append((position, self.image_data(image, timer)))
+                except Exception as e:
+                    extracted[position] = (None, f"Erro no reconhecimento: {str(e)}")
+            outputs = self.pool.run_many(probe_task, [image_data for _, image_data in images_data])
+            for (position, _), (encoding, error, task_timer) in zip(images_data, outputs):
+                timer.merge(task_timer)
+                extracted[position] = (encoding, error)
+        else:
+            extracted = []
+            for image in images:
+                try:
+                    extracted.append(self.extract_probe(image, timer))
+                except Exception as e:
+                    extracted.append((None, f"Erro no reconhecimento: {str(e)}"))
+        
+        for position, (encoding, error) in enumerate(extracted):
+            if error:
+                results[position] = (False, error, None, 0.0)
+            else:
+                probes.append(encoding)
+                positions.append(position)
+        
+        if probes:
+            self.sync()
+            snapshot = self.gallery.snapshot()
+            if not len(snapshot):
+                for position in positions:
+                    results[position] = (False, "Nenhuma pessoa cadastrada no sistema", None, 0.0)
+            else:
+                with timer.stage('match'):
+                    matches = self.search_index.search_many(probes, snapshot)
+                for position, (best_match_index, best_distance) in zip(positions, matches):
+                    results[position] = self.match_result(best_match_index, best_distance, snapshot)
+        
+        return results
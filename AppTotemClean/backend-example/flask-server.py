@@ -3,179 +3,146 @@
 Servidor Flask com reconhecimento facial real
 Execute: python flask-server.py
 
-Dependências: pip install flask flask-cors face-recognition opencv-python pillow numpy
+Dependências: pip install flask flask-cors face-recognition pillow numpy
 """
 
+import os
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import json
-import base64
-import face_recognition
-import numpy as np
-from PIL import Image
-import io
-import os
-import pickle
 from datetime import datetime
-import cv2
+from face_pipeline import StageTimer
+from inference_pool import PoolBusy
+from face_system import FaceRecognitionSystem, MAX_BATCH_SIZE, identity_from, gallery_etag, etag_matches
+from bulk_enrollment import ArchiveTooLarge, MAX_ARCHIVE_BYTES, save_archive
+from metrics import FaceMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 app = Flask(__name__)
 CORS(app)  # Permitir requisições do app mobile
 
-# Diretório para armazenar faces conhecidas
-KNOWN_FACES_DIR = "known_faces"
-ENCODINGS_FILE = "face_encodings.pkl"
+# Inicializar sistema de reconhecimento facial
+# (os processos do pool de inferência reimportam este arquivo como __mp_main__ e não
+# precisam da galeria: só usam as funções do face_pipeline)
+if __name__ != '__mp_main__':
+    face_system = FaceRecognitionSystem()
+    face_metrics = FaceMetrics(face_system)
+    # Modelos e galeria em segundo plano: GET /ready responde 200 quando terminar
+    face_system.start_warm_up()
 
-# Criar diretório se não existir
-if not os.path.exists(KNOWN_FACES_DIR):
-    os.makedirs(KNOWN_FACES_DIR)
+def busy_response(busy):
+    """Resposta rápida de backpressure: pool de inferência saturado ou sistema ainda aquecendo"""
+    print(f"⏳ {busy.error} (cliente deve tentar novamente em {busy.retry_after}s)")
+    response = jsonify({
+        'success': False,
+        'error': busy.error,
+        'retry_after': busy.retry_after
+    })
+    response.headers['Retry-After'] = str(busy.retry_after)
+    return response, 503
 
-class FaceRecognitionSystem:
-    def __init__(self):
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.load_known_faces()
-    
-    def load_known_faces(self):
-        """Carregar faces conhecidas do arquivo de encodings"""
-        if os.path.exists(ENCODINGS_FILE):
-            try:
-                with open(ENCODINGS_FILE, 'rb') as f:
-                    data = pickle.load(f)
-                    self.known_face_encodings = data['encodings']
-                    self.known_face_names = data['names']
-                print(f"✅ Carregadas {len(self.known_face_names)} faces conhecidas")
-            except Exception as e:
-                print(f"⚠️  Erro ao carregar encodings: {e}")
-        else:
-            print("ℹ️  Nenhum arquivo de encodings encontrado. Use /add-person para adicionar pessoas.")
-    
-    def save_known_faces(self):
-        """Salvar faces conhecidas no arquivo de encodings"""
-        try:
-            data = {
-                'encodings': self.known_face_encodings,
-                'names': self.known_face_names
-            }
-            with open(ENCODINGS_FILE, 'wb') as f:
-                pickle.dump(data, f)
-            print(f"✅ Salvos {len(self.known_face_names)} encodings")
-        except Exception as e:
-            print(f"❌ Erro ao salvar encodings: {e}")
-    
-    def add_person(self, name, image_base64):
-        """Adicionar uma nova pessoa ao sistema"""
-        try:
-            # Decodificar imagem
-            image_data = base64.b64decode(image_base64)
-            image = Image.open(io.BytesIO(image_data))
-            image_array = np.array(image)
-            
-            # Detectar faces
-            face_locations = face_recognition.face_locations(image_array)
-            if not face_locations:
-                return False, "Nenhuma face detectada na imagem"
-            
-            if len(face_locations) > 1:
-                return False, "Múltiplas faces detectadas. Use uma imagem com apenas uma pessoa."
-            
-            # Extrair encoding
-            face_encodings = face_recognition.face_encodings(image_array, face_locations)
-            if not face_encodings:
-                return False, "Não foi possível extrair características da face"
-            
-            # Adicionar ao sistema
-            self.known_face_encodings.append(face_encodings[0])
-            self.known_face_names.append(name)
-            
-            # Salvar no arquivo
-            self.save_known_faces()
-            
-            # Salvar imagem de referência
-            image_path = os.path.join(KNOWN_FACES_DIR, f"{name}.jpg")
-            image.save(image_path)
-            
-            return True, f"Pessoa '{name}' adicionada com sucesso!"
-            
-        except Exception as e:
-            return False, f"Erro ao processar imagem: {str(e)}"
+# Corpo binário: a imagem vai direto para o decodificador, sem base64 (~33% menor)
+RAW_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'application/octet-stream')
+
+def read_image_upload():
+    """
+    Ler a imagem da requisição em um dos formatos aceitos:
+    - JSON {"image": "<base64>", ...} (formato original do app)
+    - multipart/form-data com o arquivo no campo "image" e os demais campos no form
+    - corpo binário (Content-Type image/jpeg, ...) com os demais campos na query string
+    Retorna (imagem, campos); campos é None se a requisição não tem dados.
+    """
+    if request.mimetype in RAW_IMAGE_TYPES:
+        return request.get_data(cache=False), request.args
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        return (upload.stream if upload else None), request.form
     
-    def recognize_face(self, image_base64):
-        """Reconhecer face na imagem fornecida"""
-        try:
-            # Decodificar imagem
-            image_data = base64.b64decode(image_base64)
-            image = Image.open(io.BytesIO(image_data))
-            image_array = np.array(image)
-            
-            # Detectar faces
-            face_locations = face_recognition.face_locations(image_array)
-            if not face_locations:
-                return False, "Nenhuma face detectada na imagem", None, 0.0
-            
-            # Extrair encodings
-            face_encodings = face_recognition.face_encodings(image_array, face_locations)
-            if not face_encodings:
-                return False, "Não foi possível processar a face", None, 0.0
-            
-            # Se não há faces conhecidas
-            if not self.known_face_encodings:
-                return False, "Nenhuma pessoa cadastrada no sistema", None, 0.0
-            
-            # Comparar com faces conhecidas
-            unknown_encoding = face_encodings[0]
-            distances = face_recognition.face_distance(self.known_face_encodings, unknown_encoding)
-            best_match_index = np.argmin(distances)
-            best_distance = distances[best_match_index]
-            
-            # Threshold para reconhecimento (0.6 é um bom valor padrão)
-            RECOGNITION_THRESHOLD = 0.6
-            
-            if best_distance < RECOGNITION_THRESHOLD:
-                name = self.known_face_names[best_match_index]
-                confidence = 1 - best_distance  # Converter distância para confiança
-                return True, f"Pessoa reconhecida: {name}", name, confidence
-            else:
-                return False, "Pessoa não reconhecida", None, 1 - best_distance
-                
-        except Exception as e:
-            return False, f"Erro no reconhecimento: {str(e)}", None, 0.0
+    data = request.get_json()
+    if not data:
+        return None, None
+    return data.get('image'), data
 
-# Inicializar sistema de reconhecimento facial
-face_system = FaceRecognitionSystem()
+def read_batch_upload():
+    """
+    Ler os itens de um lote: JSON {"images": [...]} ou multipart com vários
+    arquivos no campo "images" e um campo "timestamp" por arquivo, na mesma ordem.
+    Retorna a lista de itens {"image", "timestamp"} ou None se não há lista.
+    """
+    if request.mimetype == 'multipart/form-data':
+        uploads = request.files.getlist('images')
+        timestamps = request.form.getlist('timestamp')
+        return [
+            {'image': upload.stream, 'timestamp': timestamps[i] if i < len(timestamps) else None}
+            for i, upload in enumerate(uploads)
+        ]
+    
+    data = request.get_json()
+    if not data or not isinstance(data.get('images'), list):
+        return None
+    return [item if isinstance(item, dict) else {'image': item} for item in data['images']]
 
 @app.route('/', methods=['GET'])
 def health_check():
-    """Endpoint para verificar se o servidor está funcionando"""
-    return jsonify({
+    """
+    Endpoint para verificar se o servidor está funcionando. Resposta leve, só
+    com contagens (consultada pelo balanceador a cada poucos segundos); os nomes
+    ficam em /api/list-persons/ e as estatísticas dos caches em ?details=1
+    """
+    face_system.sync()
+    health = {
         'status': 'OK',
         'message': 'Servidor Flask com reconhecimento facial funcionando!',
-        'known_faces_count': len(face_system.known_face_names),
-        'known_faces': face_system.known_face_names,
+        'ready': face_system.ready.is_set(),
+        'known_faces_count': face_system.person_count,
+        'templates_count': len(face_system.gallery),
+        'generation': face_system.generation,
         'timestamp': datetime.now().isoformat()
-    })
+    }
+    if request.args.get('details'):
+        health['frame_cache'] = face_system.frame_cache.stats() if face_system.frame_cache else None
+        health['recent_identities'] = face_system.recent.stats() if face_system.recent else None
+        health['partitions'] = face_system.partitions.stats() if face_system.partitions else None
+    return jsonify(health)
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: 200 só depois do aquecimento (modelos e galeria carregados); 503 antes"""
+    state = face_system.readiness()
+    return jsonify(dict(state, timestamp=datetime.now().isoformat())), 200 if state['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Tempos por etapa, tamanho da galeria e memória no formato do Prometheus"""
+    return face_metrics.render(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
 
 @app.route('/api/face-recognition/', methods=['POST'])
 def face_recognition_api():
     """API para reconhecimento facial"""
     try:
-        # Parse do JSON
-        data = request.get_json()
+        # Imagem em base64 (JSON), multipart ou corpo binário
+        image, data = read_image_upload()
         
-        if not data:
+        if data is None:
             return jsonify({
                 'success': False,
                 'error': 'Dados não fornecidos'
             }), 400
         
-        image_base64 = data.get('image')
         timestamp = data.get('timestamp')
+        # Crachá/PIN informado: verificação 1:1 em vez de busca na galeria inteira
+        person_id = identity_from(data)
+        mode = 'verification' if person_id else 'identification'
+        # Local do totem: busca só entre os colaboradores do contrato (FACE_PARTITIONS_FILE)
+        site = face_system.site_for(data)
         
         print(f"[{datetime.now()}] Recebida requisição de reconhecimento facial")
         print(f"Timestamp: {timestamp}")
-        print(f"Imagem recebida: {'Sim' if image_base64 else 'Não'}")
+        if person_id:
+            print(f"🪪 Verificação 1:1 do colaborador {person_id}")
+        if site:
+            print(f"🏢 Local {site}")
+        print(f"Imagem recebida: {'Sim' if image else 'Não'}")
         
-        if not image_base64:
+        if not image:
             return jsonify({
                 'success': False,
                 'error': 'Imagem não fornecida'
@@ -183,7 +150,15 @@ def face_recognition_api():
         
         # Processar reconhecimento facial
         print("🔍 Processando reconhecimento facial...")
-        success, message, person_name, confidence = face_system.recognize_face(image_base64)
+        timer = StageTimer()
+        try:
+            success, message, person_name, confidence = face_system.recognize_face(
+                image, timer, data.get('tablet_id'), person_id, site
+            )
+        except PoolBusy as busy:
+            print(f"⏱️  {face_metrics.observe(mode, 'busy', timer)}")
+            return busy_response(busy)
+        print(f"⏱️  {face_metrics.observe(mode, 'success' if success else 'rejected', timer)}")
         
         if success:
             print(f"✅ Pessoa reconhecida: {person_name} (confiança: {confidence:.2f})")
@@ -193,6 +168,7 @@ def face_recognition_api():
                 'confidence': round(confidence, 3),
                 'attendance_recorded': True,
                 'message': message,
+                'mode': mode,
                 'timestamp': timestamp
             })
         else:
@@ -200,7 +176,8 @@ def face_recognition_api():
             return jsonify({
                 'success': False,
                 'error': message,
-                'confidence': round(confidence, 3)
+                'confidence': round(confidence, 3),
+                'mode': mode
             }), 404
         
     except Exception as e:
@@ -210,36 +187,121 @@ def face_recognition_api():
             'error': f'Erro interno: {str(e)}'
         }), 500
 
+@app.route('/api/face-recognition/batch/', methods=['POST'])
+def face_recognition_batch_api():
+    """
+    API para reconhecimento facial em lote (ex.: pontos guardados pelo totem offline)
+    
+    Corpo: {"images": [{"image": "<base64>", "timestamp": "..."}, ...]}
+    ou multipart com vários arquivos "images" e um "timestamp" por arquivo.
+    Retorna um resultado por imagem, na mesma ordem e no mesmo formato de /api/face-recognition/
+    """
+    try:
+        items = read_batch_upload()
+        
+        if items is None:
+            return jsonify({
+                'success': False,
+                'error': 'Lista de imagens não fornecida'
+            }), 400
+        
+        if not items:
+            return jsonify({
+                'success': False,
+                'error': 'Lista de imagens vazia'
+            }), 400
+        
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({
+                'success': False,
+                'error': f'Máximo de {MAX_BATCH_SIZE} imagens por lote'
+            }), 400
+        
+        if any(not item.get('image') for item in items):
+            return jsonify({
+                'success': False,
+                'error': 'Imagem não fornecida em um ou mais itens'
+            }), 400
+        
+        print(f"[{datetime.now()}] Recebido lote de {len(items)} imagens para reconhecimento")
+        timer = StageTimer()
+        try:
+            outcomes = face_system.recognize_faces([item['image'] for item in items], timer)
+        except PoolBusy as busy:
+            print(f"⏱️  {face_metrics.observe('batch', 'busy', timer)}")
+            return busy_response(busy)
+        print(f"⏱️  {face_metrics.observe('batch', 'success', timer)}")
+        
+        results = []
+        for item, (success, message, person_name, confidence) in zip(items, outcomes):
+            if success:
+                results.append({
+                    'success': True,
+                    'person_name': person_name,
+                    'confidence': round(confidence, 3),
+                    'attendance_recorded': True,
+                    'message': message,
+                    'timestamp': item.get('timestamp')
+                })
+            else:
+                results.append({
+                    'success': False,
+                    'error': message,
+                    'confidence': round(confidence, 3),
+                    'timestamp': item.get('timestamp')
+                })
+        
+        recognized = sum(1 for result in results if result['success'])
+        print(f"✅ Lote processado: {recognized}/{len(results)} reconhecidos")
+        return jsonify({
+            'success': True,
+            'total': len(results),
+            'recognized': recognized,
+            'results': results
+        })
+        
+    except Exception as e:
+        print(f"❌ Erro: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Erro interno: {str(e)}'
+        }), 500
+
 @app.route('/api/add-person/', methods=['POST'])
 def add_person_api():
     """API para adicionar nova pessoa ao sistema"""
     try:
-        data = request.get_json()
+        image, data = read_image_upload()
         
-        if not data:
+        if data is None:
             return jsonify({
                 'success': False,
                 'error': 'Dados não fornecidos'
             }), 400
         
         name = data.get('name')
-        image_base64 = data.get('image')
         
-        if not name or not image_base64:
+        if not name or not image:
             return jsonify({
                 'success': False,
                 'error': 'Nome e imagem são obrigatórios'
             }), 400
         
         print(f"🆕 Adicionando nova pessoa: {name}")
-        success, message = face_system.add_person(name, image_base64)
+        timer = StageTimer()
+        try:
+            success, message = face_system.add_person(name, image, timer, identity_from(data))
+        except PoolBusy as busy:
+            print(f"⏱️  {face_metrics.observe('enrollment', 'busy', timer)}")
+            return busy_response(busy)
+        print(f"⏱️  {face_metrics.observe('enrollment', 'success' if success else 'rejected', timer)}")
         
         if success:
             print(f"✅ {message}")
             return jsonify({
                 'success': True,
                 'message': message,
-                'total_known_faces': len(face_system.known_face_names)
+                'total_known_faces': face_system.person_count
             })
         else:
             print(f"❌ {message}")
@@ -255,30 +317,106 @@ def add_person_api():
             'error': f'Erro interno: {str(e)}'
         }), 500
 
+# Corpo binário do cadastro em lote (o arquivo .zip inteiro)
+ARCHIVE_TYPES = ('application/zip', 'application/x-zip-compressed', 'application/octet-stream')
+
+@app.route('/api/add-person/bulk/', methods=['POST'])
+def add_person_bulk_api():
+    """
+    API para cadastro em lote: .zip com fotos <employee_id>.jpg no corpo
+    (Content-Type application/zip) ou no campo "archive" do multipart.
+    Retorna quantas fotos foram cadastradas e o motivo de cada rejeição.
+    Para milhares de fotos, prefira python bulk_enrollment.py (sem timeout HTTP).
+    Um lote por vez (503 com Retry-After se outro estiver rodando) e no máximo
+    FACE_BULK_MAX_BYTES por arquivo (413).
+    """
+    try:
+        timer = StageTimer()
+        try:
+            # A vez é tomada antes de receber o arquivo: um segundo pedido recebe
+            # 503 sem enviá-lo, e nenhum lote entra entre o recebimento e o cadastro
+            with face_system.bulk_slot():
+                return enroll_archive(timer)
+        except PoolBusy as busy:
+            print(f"⏱️  {face_metrics.observe('bulk_enrollment', 'busy', timer)}")
+            return busy_response(busy)
+        
+    except Exception as e:
+        print(f"❌ Erro: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Erro interno: {str(e)}'
+        }), 500
+
+def enroll_archive(timer):
+    """Receber o .zip do lote (com a vez já tomada) e cadastrar as fotos"""
+    try:
+        if request.content_length is not None and request.content_length > MAX_ARCHIVE_BYTES:
+            raise ArchiveTooLarge(MAX_ARCHIVE_BYTES)
+        if request.mimetype == 'multipart/form-data':
+            upload = request.files.get('archive')
+            stream = upload.stream if upload else None
+        else:
+            stream = request.stream if request.mimetype in ARCHIVE_TYPES else None
+        
+        if stream is None:
+            return jsonify({
+                'success': False,
+                'error': 'Arquivo .zip não fornecido'
+            }), 400
+        
+        print(f"[{datetime.now()}] Recebido arquivo para cadastro em lote")
+        archive_path = save_archive(stream)
+    except ArchiveTooLarge as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 413
+    try:
+        report = face_system.add_persons_bulk(archive_path, timer, reserved=True)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Arquivo .zip inválido'
+        }), 400
+    finally:
+        os.remove(archive_path)
+    print(f"⏱️  {face_metrics.observe('bulk_enrollment', 'success', timer)}")
+    
+    print(f"✅ Cadastro em lote: {report['enrolled']}/{report['total']} fotos cadastradas")
+    return jsonify(dict(report, success=True, total_known_faces=face_system.person_count))
+
 @app.route('/api/list-persons/', methods=['GET'])
 def list_persons_api():
-    """API para listar pessoas cadastradas"""
-    return jsonify({
-        'success': True,
-        'known_faces': face_system.known_face_names,
-        'total_count': len(face_system.known_face_names)
-    })
+    """
+    API para listar pessoas cadastradas, paginada: ?limit=N (padrão 500) e
+    ?cursor=<next_cursor da página anterior>. ETag = geração da galeria; com
+    If-None-Match igual a resposta é 304 sem corpo.
+    """
+    try:
+        page = face_system.persons_page(request.args.get('cursor'), request.args.get('limit'))
+    except PoolBusy as busy:
+        return busy_response(busy)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    etag = gallery_etag(page['generation'])
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return '', 304, headers
+    return jsonify(dict(page, success=True)), 200, headers
 
 @app.route('/api/reset-system/', methods=['POST'])
 def reset_system_api():
     """API para resetar o sistema (apagar todas as faces conhecidas)"""
     try:
-        face_system.known_face_encodings = []
-        face_system.known_face_names = []
-        
-        # Remover arquivo de encodings
-        if os.path.exists(ENCODINGS_FILE):
-            os.remove(ENCODINGS_FILE)
-        
-        # Remover imagens conhecidas
-        if os.path.exists(KNOWN_FACES_DIR):
-            for file in os.listdir(KNOWN_FACES_DIR):
-                os.remove(os.path.join(KNOWN_FACES_DIR, file))
+        try:
+            face_system.reset()
+        except PoolBusy as busy:
+            return busy_response(busy)
         
         print("🔄 Sistema resetado")
         return jsonify({
@@ -296,11 +434,15 @@ if __name__ == '__main__':
     print("�� Iniciando servidor Flask com reconhecimento facial real...")
     print("📱 Endpoints disponíveis:")
     print("   - POST /api/face-recognition/     (reconhecer face)")
+    print("   - POST /api/face-recognition/batch/ (reconhecer lote de imagens)")
     print("   - POST /api/add-person/           (adicionar pessoa)")
-    print("   - GET  /api/list-persons/         (listar pessoas)")
+    print("   - POST /api/add-person/bulk/      (cadastro em lote: .zip de fotos)")
+    print("   - GET  /api/list-persons/         (listar pessoas, paginado)")
     print("   - POST /api/reset-system/         (resetar sistema)")
     print("   - GET  /                          (health check)")
-    print("🔍 Health check: http://localhost:8000/")
+    print("   - GET  /ready                     (pronto para tráfego)")
+    print("   - GET  /metrics                   (métricas Prometheus)")
+    print("🔍 Health check: http://localhost:8000/ | Readiness: http://localhost:8000/ready")
     print("⚡ Para parar o servidor: Ctrl+C")
     print("-" * 60)
     
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Cache de resultados para quadros repetidos
+
+O totem costuma reenviar o mesmo quadro (toque duplo, retry da rede). Em vez de
+detectar e extrair o encoding de novo, o resultado anterior é devolvido se a
+mesma imagem chegar do mesmo tablet dentro de FACE_FRAME_CACHE_TTL segundos.
+
+A chave é um hash criptográfico (BLAKE2b) dos bytes recebidos, então só um
+reenvio idêntico reaproveita o resultado. Um hash perceptual aceitaria quadros
+apenas parecidos e poderia devolver a identidade de outra pessoa que passou
+pelo mesmo totem logo antes.
+O cache é por processo, limitado em tamanho (LRU) e em tempo (TTL).
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def frame_hash(image_data):
+    """Hash dos bytes da imagem (bytes ou arquivo); arquivos voltam para a posição original"""
+    if not hasattr(image_data, 'read'):
+        return hashlib.blake2b(image_data, digest_size=32).digest()
+
+    digest = hashlib.blake2b(digest_size=32)
+    position = image_data.tell()
+    try:
+        for chunk in iter(lambda: image_data.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    finally:
+        image_data.seek(position)
+    return digest.digest()
+
+
+class FrameCache:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # chave -> (expira_em, resultado)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Resultado guardado para `key`, ou None se ausente/expirado"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'ttl_seconds': self.ttl,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
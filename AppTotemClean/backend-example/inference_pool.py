@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Pool de processos para decodificação, detecção e encoding
+
+A detecção/encoding do dlib é CPU-bound; rodando dentro das threads do Flask
+ela disputa o GIL e usa um único núcleo. O InferencePool envia essas etapas
+para processos (cada um com o modelo já aquecido) e limita o número de
+tarefas admitidas: com todos os processos ocupados e a fila cheia, run()
+levanta PoolBusy imediatamente, com uma estimativa de quando tentar de novo,
+em vez de deixar a latência crescer sem limite.
+"""
+
+import io
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Peso da última medição na média móvel do tempo por tarefa
+TASK_TIME_SMOOTHING = 0.2
+INITIAL_TASK_SECONDS = 0.5
+# Limite para todos os processos do pool iniciarem e carregarem os modelos
+WARM_UP_TIMEOUT = 300
+
+
+class PoolBusy(Exception):
+    """Pool saturado: o cliente deve tentar de novo após `retry_after` segundos"""
+    error = 'Servidor ocupado, tente novamente'
+
+    def __init__(self, retry_after):
+        super().__init__(f"{self.error} em {retry_after}s")
+        self.retry_after = retry_after
+
+
+# Funções executadas nos processos do pool ------------------------------------
+
+def _warm_up_worker():
+    """Carregar os modelos do dlib uma vez por processo"""
+    from face_pipeline import warm_up
+
+    warm_up()
+
+
+def _wait_all_workers(barrier):
+    """Ocupar o processo até todos os outros também terem iniciado (ver warm_up)"""
+    barrier.wait(WARM_UP_TIMEOUT)
+
+
+def probe_task(image_data):
+    """Retorna (encoding, erro, StageTimer com os tempos)"""
+    from face_pipeline import StageTimer, extract_probe
+
+    timer = StageTimer()
+    try:
+        encoding, error = extract_probe(image_data, timer)
+    except Exception as e:
+        encoding, error = None, f"Erro no reconhecimento: {str(e)}"
+    return encoding, error, timer
+
+
+def enrollment_task(image_data):
+    """Retorna (encoding, erro, JPEG da imagem de referência, StageTimer com os tempos)"""
+    from face_pipeline import StageTimer, extract_enrollment
+
+    timer = StageTimer()
+    try:
+        encoding, error, image = extract_enrollment(image_data, timer)
+    except Exception as e:
+        return None, f"Erro ao processar imagem: {str(e)}", None, timer
+
+    reference = None
+    if error is None:
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=90)
+        reference = buffer.getvalue()
+    return encoding, error, reference, timer
+
+
+# Pool ------------------------------------------------------------------------
+
+class InferencePool:
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._in_flight = 0
+        self._task_seconds = INITIAL_TASK_SECONDS
+        self._stats_lock = threading.Lock()
+        # 'spawn': não herdar threads/locks do servidor em um fork
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_warm_up_worker,
+        )
+
+    def warm_up(self):
+        """
+        Iniciar todos os processos agora (o initializer carrega os modelos) em vez
+        de durante as primeiras requisições. O executor só cria um processo novo
+        quando não há um ocioso, então cada tarefa de aquecimento espera em uma
+        barreira até as `workers` tarefas estarem rodando, uma em cada processo.
+        """
+        with multiprocessing.get_context('spawn').Manager() as manager:
+            barrier = manager.Barrier(self.workers)
+            futures = [self._executor.submit(_wait_all_workers, barrier) for _ in range(self.workers)]
+            for future in futures:
+                future.result()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def retry_after(self):
+        """Segundos sugeridos para tentar de novo: tempo médio que uma tarefa ocupa uma vaga"""
+        with self._stats_lock:
+            return max(1, math.ceil(self._task_seconds))
+
+    def _acquire(self, count):
+        """Reservar `count` vagas sem esperar; PoolBusy se não houver todas"""
+        acquired = 0
+        while acquired < count and self._slots.acquire(blocking=False):
+            acquired += 1
+        if acquired < count:
+            for _ in range(acquired):
+                self._slots.release()
+            raise PoolBusy(self.retry_after())
+        with self._stats_lock:
+            self._in_flight += count
+
+    def _release(self, count):
+        with self._stats_lock:
+            self._in_flight -= count
+        for _ in range(count):
+            self._slots.release()
+
+    def _record_time(self, started):
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._task_seconds += TASK_TIME_SMOOTHING * (elapsed - self._task_seconds)
+
+    def _submit(self, fn, argument):
+        started = time.perf_counter()
+        future = self._executor.submit(fn, argument)
+        future.add_done_callback(lambda _: self._record_time(started))
+        return future
+
+    def run(self, fn, argument):
+        """Executar uma tarefa no pool e aguardar o resultado (PoolBusy se saturado)"""
+        self._acquire(1)
+        try:
+            return self._submit(fn, argument).result()
+        finally:
+            self._release(1)
+
+    def run_many(self, fn, arguments):
+        """
+        Executar várias tarefas em paralelo, na ordem dos argumentos.
+        Lotes maiores que a capacidade do pool usam as vagas reservadas como janela.
+        """
+        window = min(len(arguments), self.capacity)
+        if not window:
+            return []
+        self._acquire(window)
+        try:
+            futures = [self._submit(fn, argument) for argument in arguments[:window]]
+            results = []
+            for argument in arguments[window:]:
+                results.append(futures[len(results)].result())
+                futures.append(self._submit(fn, argument))
+            results.extend(future.result() for future in futures[len(results):])
+            return results
+        finally:
+            self._release(window)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Métricas do backend no formato texto do Prometheus (GET /metrics)
+
+Cada requisição de reconhecimento/cadastro termina com FaceMetrics.observe():
+os tempos de cada etapa do StageTimer (base64, upload, frame_hash, decode,
+detect, encode, match, match_recent, persist) e o tempo total vão para
+histogramas com os rótulos `operation` (identification, verification, batch,
+enrollment) e `outcome` (success, rejected, busy). A mesma chamada devolve uma
+linha key=value para o log, com todos os tempos da requisição. Cada detector
+executado pela cascata (face_detectors.py) conta como acerto ou erro em
+face_detector_runs_total; o tempo dele é a etapa detect_<detector>.
+
+Tamanho da galeria, memória e contadores dos caches são lidos do
+FaceRecognitionSystem a cada coleta. Cada processo tem os próprios
+histogramas: com vários workers, o Prometheus deve coletar cada um.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+# Limites dos buckets em segundos: de 0,5 ms (busca em galeria pequena) a 10 s (fila cheia)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = OrderedDict()  # valores dos rótulos -> [contagens por bucket, soma]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labelvalues, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _labels(self.labelnames + ('le',), labelvalues + (_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+def _metric(name, kind, documentation, samples):
+    """Linhas de uma métrica gauge/counter; `samples` é [(rótulos dict, valor)]"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+    return lines
+
+
+def resident_memory_bytes():
+    """Memória residente do processo (Linux: /proc/self/statm), ou None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class FaceMetrics:
+    def __init__(self, face_system):
+        self.face_system = face_system
+        self.stage_seconds = Histogram(
+            'face_stage_duration_seconds', 'Tempo de cada etapa do pipeline de reconhecimento/cadastro',
+            ('operation', 'stage'))
+        self.request_seconds = Histogram(
+            'face_request_duration_seconds', 'Tempo total da operação no servidor',
+            ('operation', 'outcome'))
+        self.detector_runs = Counter(
+            'face_detector_runs_total', 'Execuções de cada detector da cascata (hit = encontrou faces)',
+            ('detector', 'result'))
+
+    def observe(self, operation, outcome, timer):
+        """Registrar os tempos da requisição; retorna a linha key=value para o log"""
+        total_ms = timer.elapsed_ms
+        for stage, ms in timer.timings.items():
+            self.stage_seconds.observe(ms / 1000, operation, stage)
+        self.request_seconds.observe(total_ms / 1000, operation, outcome)
+        hits = OrderedDict()  # detector -> imagens em que encontrou a face
+        for detector, found in timer.detections:
+            self.detector_runs.inc(detector, 'hit' if found else 'miss')
+            if found:
+                hits[detector] = hits.get(detector, 0) + 1
+
+        fields = [f"operation={operation}", f"outcome={outcome}", f"total_ms={total_ms:.1f}"]
+        fields += [f"{stage}_ms={ms:.1f}" for stage, ms in timer.timings.items()]
+        if timer.detections:
+            found_by = ','.join(name if count == 1 else f"{name}:{count}" for name, count in hits.items())
+            fields.append(f"detector={found_by or 'none'}")
+        return ' '.join(fields)
+
+    def render(self):
+        """Texto completo para GET /metrics"""
+        system = self.face_system
+        system.sync()
+        gallery = system.gallery
+        storage = 'mmap' if hasattr(gallery, 'store') else 'heap'
+
+        lines = self.stage_seconds.render() + self.request_seconds.render() + self.detector_runs.render()
+        lines += _metric('face_gallery_persons', 'gauge', 'Pessoas cadastradas',
+                         [({}, system.person_count)])
+        lines += _metric('face_gallery_templates', 'gauge', 'Modelos faciais válidos (linhas buscadas)',
+                         [({}, len(gallery))])
+        lines += _metric('face_gallery_rows', 'gauge', 'Linhas da galeria, incluindo as descartadas',
+                         [({}, len(gallery.encodings))])
+        # Cópias do índice de busca (compacta da varredura, listas do IVF) ficam no processo
+        copies = [({'storage': 'heap', 'kind': kind}, nbytes)
+                  for kind, nbytes in system.search_index.memory_usage().items()]
+        lines += _metric('face_gallery_memory_bytes', 'gauge',
+                         'Memória dos encodings, normas e cópias do índice (mmap = page cache compartilhado)',
+                         [({'storage': storage, 'kind': 'encodings'}, gallery.encodings.nbytes),
+                          ({'storage': 'heap', 'kind': 'norms'}, gallery.sq_norms.nbytes)] + copies)
+
+        readiness = system.readiness()
+        lines += _metric('face_ready', 'gauge', 'Aquecimento concluído (1) ou em andamento/falhou (0)',
+                         [({}, int(readiness['ready']))])
+        if readiness['warm_up_seconds'] is not None:
+            lines += _metric('face_warm_up_seconds', 'gauge', 'Duração do aquecimento (modelos, galeria e índice)',
+                             [({}, readiness['warm_up_seconds'])])
+
+        resident = resident_memory_bytes()
+        if resident is not None:
+            lines += _metric('process_resident_memory_bytes', 'gauge', 'Memória residente do processo',
+                             [({}, resident)])
+
+        if system.frame_cache:
+            stats = system.frame_cache.stats()
+            lines += _metric('face_frame_cache_lookups_total', 'counter', 'Consultas ao cache de quadros',
+                             [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])])
+            lines += _metric('face_frame_cache_entries', 'gauge', 'Entradas no cache de quadros',
+                             [({}, stats['entries'])])
+
+        if system.recent:
+            tablets = system.recent.stats()['tablets'].values()
+            lines += _metric('face_recent_shortcut_lookups_total', 'counter',
+                             'Consultas ao atalho por tablet (todos os tablets)',
+                             [({'result': 'hit'}, sum(t['hits'] for t in tablets)),
+                              ({'result': 'miss'}, sum(t['lookups'] - t['hits'] for t in tablets))])
+        return '\n'.join(lines) + '\n'
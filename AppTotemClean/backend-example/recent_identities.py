@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Atalho por tablet: pessoas reconhecidas recentemente em cada totem
+
+Cada local vê as mesmas poucas centenas de pessoas todo dia. Para cada
+tablet_id guardamos (LRU) as linhas da galeria reconhecidas ali; a face é
+comparada primeiro só com essas linhas e a busca completa só roda se nenhuma
+delas ficar abaixo do limiar do atalho. O limiar do atalho é mais rígido que o
+do reconhecimento para que uma pessoa mais próxima fora da lista não seja
+ignorada.
+
+As linhas são posições na galeria: quando a disposição muda (remoção,
+compactação, reset) as listas são descartadas e se refazem com o uso.
+Requisições que ainda usam um snapshot de disposição anterior não descartam
+nem gravam nada (layout_generation só cresce).
+Por tablet são medidos acertos e o tempo do atalho e da busca completa, de onde
+sai a estimativa de tempo economizado.
+"""
+
+import threading
+from collections import OrderedDict
+
+# Peso da última medição nas médias móveis de tempo
+LATENCY_SMOOTHING = 0.1
+
+
+class TabletStats:
+    def __init__(self):
+        self.lookups = 0
+        self.hits = 0
+        self.shortcut_ms = None  # média móvel do tempo do atalho
+        self.full_scan_ms = None  # média móvel do tempo da busca completa
+        self.saved_ms = 0.0  # tempo economizado nos acertos menos o gasto nos erros
+
+    @staticmethod
+    def _smooth(average, value):
+        if average is None:
+            return value
+        return average + LATENCY_SMOOTHING * (value - average)
+
+    def record_shortcut(self, hit, elapsed_ms):
+        self.lookups += 1
+        self.shortcut_ms = self._smooth(self.shortcut_ms, elapsed_ms)
+        if hit:
+            self.hits += 1
+            if self.full_scan_ms is not None:
+                self.saved_ms += self.full_scan_ms - elapsed_ms
+        else:
+            self.saved_ms -= elapsed_ms
+
+    def record_full_scan(self, elapsed_ms):
+        self.full_scan_ms = self._smooth(self.full_scan_ms, elapsed_ms)
+
+    def as_dict(self):
+        return {
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            'shortcut_ms': round(self.shortcut_ms, 3) if self.shortcut_ms is not None else None,
+            'full_scan_ms': round(self.full_scan_ms, 3) if self.full_scan_ms is not None else None,
+            'saved_ms_total': round(self.saved_ms, 1),
+        }
+
+
+class RecentIdentities:
+    def __init__(self, per_tablet):
+        self.per_tablet = per_tablet
+        self._recent = {}  # tablet_id -> OrderedDict(linha -> None), mais recente no fim
+        self._stats = {}  # tablet_id -> TabletStats
+        self._layout_generation = None
+        self._lock = threading.Lock()
+
+    def _check_layout(self, layout_generation):
+        """
+        Descartar as listas só quando a disposição avança. Retorna False se
+        `layout_generation` é anterior à atual (as linhas não valem para ela).
+        """
+        if self._layout_generation is None or layout_generation > self._layout_generation:
+            self._recent = {}
+            self._layout_generation = layout_generation
+        return layout_generation == self._layout_generation
+
+    def candidates(self, tablet_id, layout_generation):
+        """Linhas reconhecidas recentemente no tablet (mais recentes primeiro)"""
+        with self._lock:
+            if not self._check_layout(layout_generation):
+                return []
+            recent = self._recent.get(tablet_id)
+            return list(reversed(recent)) if recent else []
+
+    def record_match(self, tablet_id, row, layout_generation):
+        with self._lock:
+            if not self._check_layout(layout_generation):
+                return
+            recent = self._recent.setdefault(tablet_id, OrderedDict())
+            recent[row] = None
+            recent.move_to_end(row)
+            while len(recent) > self.per_tablet:
+                recent.popitem(last=False)
+
+    def _tablet_stats(self, tablet_id):
+        stats = self._stats.get(tablet_id)
+        if stats is None:
+            stats = self._stats[tablet_id] = TabletStats()
+        return stats
+
+    def record_shortcut(self, tablet_id, hit, elapsed_ms):
+        with self._lock:
+            self._tablet_stats(tablet_id).record_shortcut(hit, elapsed_ms)
+
+    def record_full_scan(self, tablet_id, elapsed_ms):
+        with self._lock:
+            self._tablet_stats(tablet_id).record_full_scan(elapsed_ms)
+
+    def clear(self):
+        with self._lock:
+            self._recent = {}
+
+    def stats(self):
+        """Acertos e latência por tablet"""
+        with self._lock:
+            return {
+                'per_tablet': self.per_tablet,
+                'tablets': {
+                    str(tablet_id): dict(stats.as_dict(), candidates=len(self._recent.get(tablet_id, ())))
+                    for tablet_id, stats in self._stats.items()
+                },
+            }
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Galeria compartilhada entre processos workers
+
+A SharedFaceGallery não copia os encodings: a matriz é o próprio np.memmap do
+arquivo do EncodingStore, então todos os workers leem as mesmas páginas do
+page cache. Cada worker mantém apenas as normas das linhas (8 bytes por face)
+e a lista de nomes.
+
+Antes de cada busca o worker chama refresh(), que compara o contador de
+commits do store (memória compartilhada) com o último visto. Cadastros feitos
+por outro worker são incorporados sem recarregar: só as linhas novas são
+mapeadas e têm a norma calculada. Linhas removidas ficam com norma infinita
+até a próxima compactação, então nunca são a melhor correspondência.
+
+Cada refresh() com mudanças publica um snapshot novo (ver face_gallery.py). A
+matriz é um mapeamento novo a cada commit; as normas e as listas de nomes só
+crescem além do tamanho dos snapshots (remoções e compactações usam cópias), então
+buscas em andamento continuam com a versão que pegaram e um cadastro custa O(1)
+(mais o índice por pessoa), não O(N).
+"""
+
+import threading
+import numpy as np
+
+from face_gallery import FaceGallery, GROWTH_FACTOR
+
+
+def read_only(operation):
+    """Erro das escritas diretas na galeria compartilhada"""
+    return TypeError(f"SharedFaceGallery é somente leitura: use EncodingStore.{operation}() e depois refresh()")
+
+
+class SharedFaceGallery(FaceGallery):
+    def __init__(self, store):
+        self._deleted_count = 0  # usado por __len__ já no primeiro snapshot
+        super().__init__(capacity=1, dtype=np.float64)
+        self.store = store
+        self._file_generation = None
+        self._refresh_lock = threading.Lock()
+        self._remap()
+
+    def refresh(self):
+        """Incorporar commits de outros processos; retorna True se a galeria mudou"""
+        self.store.refresh()
+        with self._refresh_lock:
+            return self._remap()
+
+    def _remap(self):
+        """
+        Acompanhar o último commit do store. Na mesma geração de arquivos só as
+        linhas e remoções novas são processadas: as normas das linhas novas vão
+        além do tamanho dos snapshots publicados e só uma remoção de linha antiga
+        copia as normas antes de marcá-la. Nomes e identificadores são as listas
+        do próprio store (que só crescem), sem cópia.
+        """
+        generation, rows, matrix, names, ids, tombstones, deleted_count = self.store.view()
+        if (generation == self._file_generation and rows == self._size
+                and deleted_count == self._deleted_count):
+            return False
+        same_layout = (generation == self._file_generation
+                       and rows >= self._size
+                       and deleted_count >= self._deleted_count)
+        start = self._size if same_layout else 0
+        newly_deleted = tombstones[self._deleted_count if same_layout else 0:deleted_count]
+
+        if not same_layout or rows > len(self._sq_norms):
+            capacity = max(rows, GROWTH_FACTOR * len(self._sq_norms)) if same_layout else max(rows, 1)
+            sq_norms = np.empty(capacity, dtype=np.float64)
+            sq_norms[:start] = self._sq_norms[:start]
+            self._sq_norms = sq_norms
+            self._published.discard('_sq_norms')
+        elif any(row < start for row in newly_deleted):
+            self._writable('_sq_norms')
+        new_rows = matrix[start:rows]
+        self._sq_norms[start:rows] = np.einsum('ij,ij->i', new_rows, new_rows)
+        if newly_deleted:
+            self._sq_norms[newly_deleted] = np.inf
+
+        self._matrix = matrix
+        self.names = names
+        self.ids = ids
+        self._reindex(start, rows, newly_deleted)
+        self._size = rows
+        self._deleted_count = deleted_count
+        self._file_generation = generation
+        self.generation += 1
+        if not same_layout:
+            self.layout_generation += 1
+        self._publish()
+        return True
+
+    def _reindex(self, start, rows, newly_deleted):
+        """Atualizar o índice pessoa -> linhas: linhas novas entram, removidas saem"""
+        if not start:
+            self._reset_person_index()
+        deleted = set(newly_deleted)
+        for index in range(start, rows):
+            if index not in deleted:
+                self._index_row(index)
+        for index in deleted:
+            if index < start:
+                self._unindex_row(index)
+
+    def __len__(self):
+        return self._size - self._deleted_count
+
+    # A escrita é feita pelo EncodingStore; a galeria só acompanha os commits
+
+    def add(self, encoding, name, person_id=None):
+        raise read_only('append')
+
+    def extend(self, encodings, names, ids=None):
+        raise read_only('append_many')
+
+    def remove(self, index):
+        raise read_only('delete')
+
+    def discard(self, index):
+        raise read_only('delete')
+
+    def clear(self):
+        raise read_only('reset')
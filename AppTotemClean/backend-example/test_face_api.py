@@ -5,16 +5,23 @@ Use este script para testar o sistema antes de usar o app mobile
 
 Uso:
     python test_face_api.py --help
+    python test_face_api.py --load fotos/ --concurrency 20 --requests 1000
 """
 
 import requests
 import base64
 import json
 import argparse
+import math
 import os
+import random
+import threading
+import time
+from collections import Counter
 from datetime import datetime
 
 BASE_URL = "http://localhost:8000"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
 
 def encode_image(image_path):
     """Converter imagem para base64"""
@@ -34,7 +41,6 @@ def test_health():
             data = response.json()
             print("✅ Servidor funcionando!")
             print(f"   - Faces conhecidas: {data['known_faces_count']}")
-            print(f"   - Pessoas: {data['known_faces']}")
             return True
         else:
             print(f"❌ Servidor com problema: {response.status_code}")
@@ -121,12 +127,21 @@ def recognize_face(image_path):
 def list_persons():
     """Listar pessoas cadastradas"""
     try:
-        response = requests.get(f"{BASE_URL}/api/list-persons/")
-        result = response.json()
+        names = []
+        cursor = None
+        while True:
+            response = requests.get(f"{BASE_URL}/api/list-persons/", params={'cursor': cursor})
+            if response.status_code != 200:
+                break
+            result = response.json()
+            names.extend(result['known_faces'])
+            cursor = result['next_cursor']
+            if cursor is None:
+                break
         
         if response.status_code == 200:
             print(f"👥 Pessoas cadastradas ({result['total_count']}):")
-            for i, name in enumerate(result['known_faces'], 1):
+            for i, name in enumerate(names, 1):
                 print(f"   {i}. {name}")
             return True
         else:
@@ -159,17 +174,178 @@ def reset_system():
         print("❌ Operação cancelada")
         return False
 
+def percentile(sorted_values, p):
+    """Percentil por posição (nearest-rank) de uma lista já ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+def load_images(directory):
+    """Ler todas as imagens do diretório: [(nome da pessoa, bytes)]"""
+    images = []
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, file_name), 'rb') as f:
+                images.append((os.path.splitext(file_name)[0], f.read()))
+    return images
+
+def build_request(kind, name, image, image_format):
+    """
+    Montar a requisição uma vez, antes da carga (base64/JSON não pesam no cliente).
+    Retorna (caminho, kwargs do requests).
+    """
+    path = '/api/add-person/' if kind == 'add-person' else '/api/face-recognition/'
+    fields = {'name': name} if kind == 'add-person' else {'timestamp': datetime.now().isoformat()}
+    if image_format == 'raw':
+        return path, {'data': image, 'params': fields, 'headers': {'Content-Type': 'image/jpeg'}}
+    if image_format == 'multipart':
+        return path, {'data': fields, 'files': {'image': (f"{name}.jpg", image, 'image/jpeg')}}
+    body = dict(fields, image=base64.b64encode(image).decode('utf-8'))
+    return path, {'data': json.dumps(body), 'headers': {'Content-Type': 'application/json'}}
+
+def run_load_test(directory, total, concurrency, rps=None, add_ratio=0.0, image_format='json',
+                  timeout=30, seed=0):
+    """
+    Repetir as imagens do diretório contra o servidor com `concurrency` conexões
+    keep-alive (uma requests.Session por thread).
+    Sem `rps`, cada conexão envia a próxima requisição assim que recebe a resposta
+    (carga fechada). Com `rps`, a requisição i é agendada para i/rps segundos após o
+    início, como totens que não esperam uns pelos outros (troca de turno). A latência
+    conta a partir do horário agendado, então a espera por uma conexão livre também entra.
+    """
+    images = load_images(directory)
+    if not images:
+        print(f"❌ Nenhuma imagem em {directory}")
+        return None
+    
+    rng = random.Random(seed)
+    plan = []
+    for i in range(total):
+        kind = 'add-person' if rng.random() < add_ratio else 'face-recognition'
+        name, image = images[i % len(images)]
+        plan.append((kind,) + build_request(kind, name, image, image_format))
+    
+    results = []  # (tipo, status ou nome da exceção, latência ms, mensagem de erro)
+    results_lock = threading.Lock()
+    next_index = iter(range(total))
+    index_lock = threading.Lock()
+    start = time.perf_counter()
+    
+    def worker():
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        while True:
+            with index_lock:
+                i = next(next_index, None)
+            if i is None:
+                break
+            kind, path, kwargs = plan[i]
+            scheduled = start + i / rps if rps else time.perf_counter()
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            
+            error = None
+            try:
+                response = session.post(f"{BASE_URL}{path}", timeout=timeout, **kwargs)
+                outcome = response.status_code
+                if outcome != 200:
+                    try:
+                        error = response.json().get('error')
+                    except ValueError:
+                        error = response.text[:80]
+            except requests.RequestException as e:
+                outcome, error = type(e).__name__, str(e)[:80]
+            latency_ms = (time.perf_counter() - scheduled) * 1000
+            with results_lock:
+                results.append((kind, outcome, latency_ms, error))
+        session.close()
+    
+    mode = f"{rps} req/s agendadas" if rps else "carga fechada"
+    print(f"🚀 {total} requisições ({mode}), {concurrency} conexões, formato {image_format}, "
+          f"{len(images)} imagens de {directory}")
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    
+    return summarize_load(results, elapsed)
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 50), 1),
+        'p95_ms': round(percentile(latencies, 95), 1),
+        'p99_ms': round(percentile(latencies, 99), 1),
+        'max_ms': round(latencies[-1], 1) if latencies else 0.0,
+    }
+
+def summarize_load(results, elapsed):
+    """Imprimir e retornar latências, vazão e respostas por status/erro"""
+    report = {
+        'elapsed_s': round(elapsed, 2),
+        'throughput_rps': round(len(results) / elapsed, 1) if elapsed else 0.0,
+        'latency': latency_summary([latency for _, _, latency, _ in results]),
+        'endpoints': {},
+        'responses': dict(Counter(str(outcome) for _, outcome, _, _ in results)),
+        'errors': dict(Counter(f"{outcome}: {error}" for _, outcome, _, error in results if error)),
+    }
+    for kind in sorted({kind for kind, _, _, _ in results}):
+        report['endpoints'][kind] = latency_summary([latency for k, _, latency, _ in results if k == kind])
+    
+    latency = report['latency']
+    print(f"\n📊 {len(results)} requisições em {report['elapsed_s']} s ({report['throughput_rps']} req/s)")
+    print(f"   Latência: p50 {latency['p50_ms']} ms | p95 {latency['p95_ms']} ms | "
+          f"p99 {latency['p99_ms']} ms | máx {latency['max_ms']} ms")
+    for kind, summary in report['endpoints'].items():
+        print(f"   {kind:<17} {summary['count']:>6}  p50 {summary['p50_ms']} ms | "
+              f"p95 {summary['p95_ms']} ms | p99 {summary['p99_ms']} ms")
+    print("   Respostas:")
+    for outcome, count in sorted(report['responses'].items()):
+        print(f"     {outcome:<17} {count:>6}")
+    if report['errors']:
+        print("   Mensagens das respostas != 200 e falhas de conexão:")
+        for error, count in sorted(report['errors'].items(), key=lambda item: -item[1]):
+            print(f"     {count:>6}  {error}")
+    return report
+
 def main():
+    global BASE_URL
     parser = argparse.ArgumentParser(description='Script de teste para APIs de reconhecimento facial')
     parser.add_argument('--health', action='store_true', help='Testar se servidor está funcionando')
     parser.add_argument('--add', nargs=2, metavar=('NOME', 'IMAGEM'), help='Adicionar pessoa (nome e caminho da imagem)')
     parser.add_argument('--recognize', metavar='IMAGEM', help='Testar reconhecimento (caminho da imagem)')
     parser.add_argument('--list', action='store_true', help='Listar pessoas cadastradas')
     parser.add_argument('--reset', action='store_true', help='Resetar sistema (apagar todas as pessoas)')
+    parser.add_argument('--url', default=BASE_URL, help=f'Endereço do servidor (padrão: {BASE_URL})')
+    
+    load = parser.add_argument_group('teste de carga')
+    load.add_argument('--load', metavar='DIRETORIO', help='Repetir as imagens do diretório contra o servidor')
+    load.add_argument('--requests', type=int, default=200, help='Total de requisições (padrão: 200)')
+    load.add_argument('--concurrency', type=int, default=10, help='Conexões keep-alive simultâneas (padrão: 10)')
+    load.add_argument('--rps', type=float, help='Taxa alvo (req/s); sem ela cada conexão envia sem pausa')
+    load.add_argument('--add-ratio', type=float, default=0.0,
+                      help='Fração de cadastros (/api/add-person/, nome = arquivo da imagem)')
+    load.add_argument('--format', choices=('json', 'multipart', 'raw'), default='json',
+                      help='Formato do upload (padrão: json com base64, como o app)')
+    load.add_argument('--timeout', type=float, default=30, help='Timeout por requisição em segundos')
+    load.add_argument('--output', metavar='ARQUIVO', help='Salvar o relatório em JSON')
     
     args = parser.parse_args()
+    BASE_URL = args.url.rstrip('/')
     
-    if args.health:
+    if args.load:
+        report = run_load_test(args.load, args.requests, args.concurrency, args.rps,
+                               args.add_ratio, args.format, args.timeout)
+        if report and args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"📄 Relatório salvo em {args.output}")
+    elif args.health:
         test_health()
     elif args.add:
         name, image_path = args.add
@@ -188,9 +364,11 @@ def main():
         print("  python test_face_api.py --recognize foto.jpg        # Testar reconhecimento")
         print("  python test_face_api.py --list                      # Listar pessoas")
         print("  python test_face_api.py --reset                     # Resetar sistema")
+        print("  python test_face_api.py --load fotos/ --rps 50      # Teste de carga")
         print("\nExemplos:")
         print("  python test_face_api.py --add 'Maria Silva' maria.jpg")
         print("  python test_face_api.py --recognize teste.jpg")
+        print("  python test_face_api.py --load fotos/ --concurrency 40 --requests 2000 --add-ratio 0.05")
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -2,15 +2,26 @@
 """
 Script de teste para a API de reconhecimento facial
 Testa as funcionalidades básicas do sistema de ponto digital
+
+Uso:
+    python test_face_api.py                                  # testes básicos
+    python test_face_api.py --load fotos/ --concurrency 20   # teste de carga
 """
 
 import requests
+import argparse
 import json
+import math
 import os
+import random
+import threading
+import time
+from collections import Counter
 from io import BytesIO
 
 # Configurações da API
 API_BASE_URL = "http://localhost:3333/api/face"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
 
 def criar_imagem_teste():
     """Cria uma imagem de teste simples em memória"""
@@ -166,8 +177,144 @@ def test_reset_system():
     except Exception as e:
         print(f"❌ Erro inesperado: {e}")
 
-def main():
-    """Função principal que executa todos os testes"""
+def percentile(sorted_values, p):
+    """Percentil por posição (nearest-rank) de uma lista já ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+def load_images(directory):
+    """
+    Ler as imagens do diretório: [(colaborador_id, nome, bytes)]
+    Arquivos no formato "<id>_<nome>.jpg" usam o id do colaborador; os demais
+    recebem ids sequenciais (o cadastro exige um colaborador existente no banco).
+    """
+    images = []
+    file_names = [f for f in sorted(os.listdir(directory)) if f.lower().endswith(IMAGE_EXTENSIONS)]
+    for i, file_name in enumerate(file_names, start=1):
+        stem = os.path.splitext(file_name)[0]
+        prefix, _, rest = stem.partition('_')
+        colaborador_id, name = (prefix, rest or stem) if prefix.isdigit() else (str(i), stem)
+        with open(os.path.join(directory, file_name), 'rb') as f:
+            images.append((colaborador_id, name, f.read()))
+    return images
+
+def run_load_test(directory, total, concurrency, rps=None, add_ratio=0.0, timeout=30, seed=0):
+    """
+    Repetir as imagens do diretório contra /face-recognition e /add-person com
+    `concurrency` conexões keep-alive (uma requests.Session por thread).
+    Sem `rps`, cada conexão envia a próxima requisição assim que recebe a resposta;
+    com `rps`, a requisição i é agendada para i/rps segundos após o início e a
+    latência conta a partir do horário agendado.
+    O faceRecognitionLimiter do backend limita requisições por IP: respostas 429
+    aparecem no relatório e indicam o limite, não a capacidade do servidor.
+    """
+    images = load_images(directory)
+    if not images:
+        print(f"❌ Nenhuma imagem em {directory}")
+        return None
+    
+    rng = random.Random(seed)
+    plan = []
+    for i in range(total):
+        kind = 'add-person' if rng.random() < add_ratio else 'face-recognition'
+        colaborador_id, name, image = images[i % len(images)]
+        data = {'name': name, 'colaborador_id': colaborador_id} if kind == 'add-person' else {}
+        plan.append((kind, data, (f"{name}.jpg", image, 'image/jpeg')))
+    
+    results = []  # (tipo, status ou nome da exceção, latência ms, mensagem de erro)
+    results_lock = threading.Lock()
+    next_index = iter(range(total))
+    index_lock = threading.Lock()
+    start = time.perf_counter()
+    
+    def worker():
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        while True:
+            with index_lock:
+                i = next(next_index, None)
+            if i is None:
+                break
+            kind, data, image_file = plan[i]
+            scheduled = start + i / rps if rps else time.perf_counter()
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            
+            error = None
+            try:
+                response = session.post(f"{API_BASE_URL}/{kind}", data=data,
+                                        files={'image': image_file}, timeout=timeout)
+                outcome = response.status_code
+                if outcome != 200:
+                    try:
+                        body = response.json()
+                        error = body.get('message') or body.get('error')
+                    except ValueError:
+                        error = response.text[:80]
+            except requests.RequestException as e:
+                outcome, error = type(e).__name__, str(e)[:80]
+            latency_ms = (time.perf_counter() - scheduled) * 1000
+            with results_lock:
+                results.append((kind, outcome, latency_ms, error))
+        session.close()
+    
+    mode = f"{rps} req/s agendadas" if rps else "carga fechada"
+    print(f"🚀 {total} requisições ({mode}), {concurrency} conexões, {len(images)} imagens de {directory}")
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    
+    return summarize_load(results, elapsed)
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 50), 1),
+        'p95_ms': round(percentile(latencies, 95), 1),
+        'p99_ms': round(percentile(latencies, 99), 1),
+        'max_ms': round(latencies[-1], 1) if latencies else 0.0,
+    }
+
+def summarize_load(results, elapsed):
+    """Imprimir e retornar latências, vazão e respostas por status/erro"""
+    report = {
+        'elapsed_s': round(elapsed, 2),
+        'throughput_rps': round(len(results) / elapsed, 1) if elapsed else 0.0,
+        'latency': latency_summary([latency for _, _, latency, _ in results]),
+        'endpoints': {},
+        'responses': dict(Counter(str(outcome) for _, outcome, _, _ in results)),
+        'errors': dict(Counter(f"{outcome}: {error}" for _, outcome, _, error in results if error)),
+    }
+    for kind in sorted({kind for kind, _, _, _ in results}):
+        report['endpoints'][kind] = latency_summary([latency for k, _, latency, _ in results if k == kind])
+    
+    latency = report['latency']
+    print(f"\n📊 {len(results)} requisições em {report['elapsed_s']} s ({report['throughput_rps']} req/s)")
+    print(f"   Latência: p50 {latency['p50_ms']} ms | p95 {latency['p95_ms']} ms | "
+          f"p99 {latency['p99_ms']} ms | máx {latency['max_ms']} ms")
+    for kind, summary in report['endpoints'].items():
+        print(f"   {kind:<17} {summary['count']:>6}  p50 {summary['p50_ms']} ms | "
+              f"p95 {summary['p95_ms']} ms | p99 {summary['p99_ms']} ms")
+    print("   Respostas:")
+    for outcome, count in sorted(report['responses'].items()):
+        print(f"     {outcome:<17} {count:>6}")
+    if report['errors']:
+        print("   Mensagens das respostas != 200 e falhas de conexão:")
+        for error, count in sorted(report['errors'].items(), key=lambda item: -item[1]):
+            print(f"     {count:>6}  {error}")
+    if report['responses'].get('429'):
+        print("   ⚠️  429: limite por IP do faceRecognitionLimiter (adicione o IP à whitelist para medir o servidor)")
+    return report
+
+def run_basic_tests():
+    """Executa os testes básicos em sequência"""
     print("🧪 TESTE DA API DE RECONHECIMENTO FACIAL")
     print("=" * 50)
     
@@ -193,5 +340,32 @@ def main():
     print("   - Para testes com imagens reais: substitua criar_imagem_teste()")
     print("   - Backend deve estar rodando em http://localhost:3333")
 
+def main():
+    """Função principal: testes básicos ou teste de carga (--load)"""
+    global API_BASE_URL
+    parser = argparse.ArgumentParser(description='Testes da API de reconhecimento facial do backend')
+    parser.add_argument('--url', default=API_BASE_URL, help=f'Base da API (padrão: {API_BASE_URL})')
+    load = parser.add_argument_group('teste de carga')
+    load.add_argument('--load', metavar='DIRETORIO', help='Repetir as imagens do diretório contra o servidor')
+    load.add_argument('--requests', type=int, default=200, help='Total de requisições (padrão: 200)')
+    load.add_argument('--concurrency', type=int, default=10, help='Conexões keep-alive simultâneas (padrão: 10)')
+    load.add_argument('--rps', type=float, help='Taxa alvo (req/s); sem ela cada conexão envia sem pausa')
+    load.add_argument('--add-ratio', type=float, default=0.0,
+                      help='Fração de cadastros (/add-person, arquivos "<colaborador_id>_<nome>.jpg")')
+    load.add_argument('--timeout', type=float, default=30, help='Timeout por requisição em segundos')
+    load.add_argument('--output', metavar='ARQUIVO', help='Salvar o relatório em JSON')
+    args = parser.parse_args()
+    API_BASE_URL = args.url.rstrip('/')
+    
+    if not args.load:
+        run_basic_tests()
+        return
+    
+    report = run_load_test(args.load, args.requests, args.concurrency, args.rps, args.add_ratio, args.timeout)
+    if report and args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📄 Relatório salvo em {args.output}")
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file